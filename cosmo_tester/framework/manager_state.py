@@ -0,0 +1,308 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+from multiprocessing.pool import ThreadPool
+
+from cosmo_tester.framework import projections
+
+PAGE_SIZE = 1000
+CONCURRENCY = 4
+# newest first sweeps start small, most snapshots find nothing new
+SWEEP_PAGE_SIZE = 10
+# as Execution.END_STATES of the rest client, not imported to keep this
+# module usable without it
+EXECUTION_END_STATES = ['terminated', 'failed', 'cancelled']
+
+
+def list_all(list_func, page_size=PAGE_SIZE, pool=None, **kwargs):
+    """Lists all resources of a paginated REST list call.
+
+    The first page tells the total number of resources, the remaining
+    pages are then fetched concurrently when a pool is given.
+    """
+    first_page = list_func(_offset=0, _size=page_size, **kwargs)
+    items = list(first_page.items)
+    total = _total(first_page)
+    # the manager may cap the page size, pages are as big as the first one
+    page_size = len(items)
+    if total is None or page_size == 0 or total <= page_size:
+        return items
+
+    def fetch(offset):
+        return list_func(_offset=offset, _size=page_size, **kwargs).items
+    offsets = range(page_size, total, page_size)
+    pages = pool.map(fetch, offsets) if pool else map(fetch, offsets)
+    for page in pages:
+        items.extend(page)
+    return items
+
+
+def _total(response):
+    metadata = getattr(response, 'metadata', None) or {}
+    pagination = metadata.get('pagination') or {}
+    return pagination.get('total')
+
+
+def get_manager_state(client, concurrency=CONCURRENCY):
+    """Snapshot of the blueprints, deployments and node instances of a
+    manager.
+
+    All node instances are fetched in a single paginated sweep instead of
+    per deployment, concurrently with blueprints and deployments, and all
+    node instances views are built in a single pass over them.
+    """
+    def query(func):
+        return projections.query('get_manager_state', func)
+    pool = ThreadPool(concurrency)
+    try:
+        blueprints = pool.apply_async(
+            list_all, (query(client.blueprints.list),))
+        deployments = pool.apply_async(
+            list_all, (query(client.deployments.list),))
+        node_instances = list_all(query(client.node_instances.list),
+                                  pool=pool)
+        blueprints = blueprints.get()
+        deployments = deployments.get()
+    finally:
+        pool.close()
+        pool.join()
+
+    return _build_state(blueprints, deployments, node_instances)
+
+
+def _build_state(blueprints, deployments, node_instances):
+    state = {
+        'blueprints': dict((b.id, b) for b in blueprints),
+        'deployments': dict((d.id, d) for d in deployments),
+        'nodes': {},
+        'node_state': dict((d.id, {}) for d in deployments),
+        'deployment_nodes': dict((d.id, []) for d in deployments)
+    }
+    for node_instance in node_instances:
+        deployment_id = node_instance.deployment_id
+        # deployments created after they were listed are left out
+        if deployment_id not in state['deployments']:
+            continue
+        state['nodes'][node_instance.id] = node_instance
+        state['node_state'][deployment_id][node_instance.id] = node_instance
+        state['deployment_nodes'][deployment_id].append(node_instance)
+    return state
+
+
+def get_manager_state_delta(before, after):
+    """Entities of the after state which are not in the before state.
+
+    Same shape as the manager state. Entities are compared by id and the
+    delta holds the after state entities themselves rather than copies, so
+    it should be treated as read only.
+    """
+    deployment_ids = before['deployments'].viewkeys()
+    return {
+        'blueprints': _without(after['blueprints'],
+                               before['blueprints'].viewkeys()),
+        'deployments': _without(after['deployments'], deployment_ids),
+        'nodes': _without(after['nodes'], before['nodes'].viewkeys()),
+        'node_state': _without(after['node_state'], deployment_ids),
+        'deployment_nodes': _without(after['deployment_nodes'],
+                                     deployment_ids)
+    }
+
+
+def _without(entities, ids):
+    return dict((entity_id, entity)
+                for entity_id, entity in entities.iteritems()
+                if entity_id not in ids)
+
+
+class ManagerStateTracker(object):
+    """Keeps a manager state up to date with incremental fetches.
+
+    The first snapshot is a full one. Later snapshots sweep blueprints,
+    deployments and executions newest first, down to the creation time
+    cursor of the previous snapshot, so their cost depends on what changed
+    rather than on what exists. Blueprint and deployment ids are only
+    listed when the totals the manager reports show that some were
+    deleted.
+
+    Node instances only change by executions, so only node instances of
+    new deployments, and of deployments with executions started since or
+    still running at the previous snapshot, are fetched again. System
+    workflows, e.g. snapshot restores, may change anything and make the
+    next snapshot a full one.
+    """
+
+    def __init__(self, client, concurrency=CONCURRENCY):
+        self.client = client
+        self.concurrency = concurrency
+        self.state = None
+        self._cursors = {}
+        # execution id to deployment id, of executions not ended yet
+        self._running = {}
+
+    def snapshot(self):
+        """Current manager state, in the get_manager_state shape."""
+        if self.state is None or not self._update():
+            self._full_snapshot()
+        return self.state
+
+    def delta(self):
+        """Entities created since the previous snapshot."""
+        before = self.state
+        after = self.snapshot()
+        if before is None:
+            return after
+        return get_manager_state_delta(before, after)
+
+    @staticmethod
+    def _query(func, fields=None):
+        return projections.query('manager_state_tracker', func, fields)
+
+    def _full_snapshot(self):
+        self._cursors = {}
+        # executions first, so executions started during the full fetch
+        # are swept by the next snapshot
+        executions, _ = self._sweep('executions',
+                                    self.client.executions.list,
+                                    projections.EXECUTION_ACTIVITY,
+                                    include_system_workflows=True)
+        self._running = dict((e.id, e.deployment_id) for e in executions
+                             if e.status not in EXECUTION_END_STATES)
+        self.state = get_manager_state(self.client, self.concurrency)
+        for name in ['blueprints', 'deployments']:
+            self._advance_cursor(name, self.state[name].values())
+
+    def _update(self):
+        """Updates the state, returns False when a full snapshot is
+        needed instead."""
+        executions, _ = self._sweep('executions',
+                                    self.client.executions.list,
+                                    projections.EXECUTION_ACTIVITY,
+                                    include_system_workflows=True)
+        swept_ids = set(e.id for e in executions)
+        get_execution = self._query(self.client.executions.get,
+                                    projections.EXECUTION_ACTIVITY)
+        executions.extend(get_execution(execution_id)
+                          for execution_id in self._running
+                          if execution_id not in swept_ids)
+        if any(not e.deployment_id for e in executions):
+            return False
+        active_deployments = set(e.deployment_id for e in executions)
+        self._running = dict((e.id, e.deployment_id) for e in executions
+                             if e.status not in EXECUTION_END_STATES)
+
+        blueprints, _ = self._update_created('blueprints',
+                                             self.client.blueprints.list,
+                                             self.state['blueprints'])
+        deployments, created = self._update_created(
+            'deployments',
+            self.client.deployments.list,
+            self.state['deployments'])
+        changed_deployments = (active_deployments | created) & \
+            deployments.viewkeys()
+
+        def fetch(deployment_id):
+            return list_all(self._query(self.client.node_instances.list),
+                            deployment_id=deployment_id)
+        pool = ThreadPool(self.concurrency)
+        try:
+            changed_deployments = sorted(changed_deployments)
+            fetched = dict(zip(changed_deployments,
+                               pool.map(fetch, changed_deployments)))
+        finally:
+            pool.close()
+            pool.join()
+
+        node_instances = []
+        for deployment_id in deployments:
+            if deployment_id in fetched:
+                node_instances.extend(fetched[deployment_id])
+            else:
+                node_instances.extend(
+                    self.state['deployment_nodes'][deployment_id])
+        self.state = _build_state(blueprints.values(),
+                                  deployments.values(),
+                                  node_instances)
+        return True
+
+    def _update_created(self, name, list_func, known):
+        """Entities after sweeping the ones created since the cursor, and
+        the ids of the swept ones.
+
+        Entities deleted and created again under the same id are swept as
+        well, as their creation time is newer.
+        """
+        swept, total = self._sweep(name, list_func)
+        current = dict(known)
+        current.update((e.id, e) for e in swept)
+        created = set(e.id for e in swept)
+        if total is None or total != len(current):
+            # some were deleted, or created with an older creation time
+            ids = set(e.id for e in list_all(self._query(list_func,
+                                                         projections.ID)))
+            current = dict((entity_id, entity)
+                           for entity_id, entity in current.iteritems()
+                           if entity_id in ids)
+            missing = ids - current.viewkeys()
+            for entity in list_all(self._query(list_func)) if missing \
+                    else []:
+                if entity.id in missing:
+                    current[entity.id] = entity
+                    created.add(entity.id)
+        return current, created
+
+    def _sweep(self, name, list_func, fields=None, **kwargs):
+        """Entities created since the cursor, newest first, and the total
+        the manager reports. Advances the cursor.
+
+        Creation times are not unique, entities created at the cursor are
+        swept too, unless they were swept before.
+        """
+        cursor, cursor_ids = self._cursors.get(name, (None, set()))
+        list_func = self._query(list_func, fields)
+        swept = []
+        total = None
+        offset = 0
+        size = SWEEP_PAGE_SIZE
+        while True:
+            response = list_func(_sort=['-created_at'],
+                                 _offset=offset,
+                                 _size=size,
+                                 **kwargs)
+            if total is None:
+                total = _total(response)
+            page = response.items
+            for entity in page:
+                created_at = entity.get('created_at')
+                if cursor is not None and created_at < cursor:
+                    break
+                if created_at != cursor or entity.id not in cursor_ids:
+                    swept.append(entity)
+            else:
+                offset += len(page)
+                if page and (total is None or offset < total):
+                    size = min(size * 2, PAGE_SIZE)
+                    continue
+            self._advance_cursor(name, swept)
+            return swept, total
+
+    def _advance_cursor(self, name, entities):
+        cursor, cursor_ids = self._cursors.get(name, (None, set()))
+        for entity in entities:
+            created_at = entity.get('created_at')
+            if created_at > cursor:
+                cursor, cursor_ids = created_at, set()
+            if created_at == cursor:
+                cursor_ids = cursor_ids | set([entity.id])
+        self._cursors[name] = (cursor, cursor_ids)
@@ -0,0 +1,77 @@
+#########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+
+import json
+import time
+from unittest import SkipTest
+
+from nose.plugins import Plugin
+
+
+class ProgressReporter(Plugin):
+    """Publishes test started and finished events as json lines.
+
+    Uses the same events file format as the suites runner progress events,
+    so a suite's tests show up in the suites runner live status.
+    """
+
+    name = 'progressreporter'
+    # skips are error classes, handled by the skip plugin which stops
+    # other plugins from seeing them unless they come first
+    score = 2000
+
+    def __init__(self):
+        super(ProgressReporter, self).__init__()
+        self.progress_events_path = None
+        self._started = {}
+
+    def options(self, parser, env):
+        super(ProgressReporter, self).options(parser, env)
+        parser.add_option('--progress-events-path',
+                          default='progress-events.jsonl')
+
+    def configure(self, options, conf):
+        super(ProgressReporter, self).configure(options, conf)
+        self.progress_events_path = options.progress_events_path
+
+    def _publish(self, event, **fields):
+        fields['event'] = event
+        fields['time'] = time.time()
+        with open(self.progress_events_path, 'a') as f:
+            f.write('{0}\n'.format(json.dumps(fields)))
+
+    def startTest(self, test):
+        self._started[test.id()] = time.time()
+        self._publish('test_started', test=test.id())
+
+    def _test_finished(self, test, result):
+        started = self._started.pop(test.id(), None)
+        duration = time.time() - started if started else 0
+        self._publish('test_finished',
+                      test=test.id(),
+                      result=result,
+                      duration=duration)
+
+    def addSuccess(self, test):
+        self._test_finished(test, 'passed')
+
+    def addFailure(self, test, err):
+        self._test_finished(test, 'failed')
+
+    def addError(self, test, err):
+        if issubclass(err[0], SkipTest):
+            self._test_finished(test, 'skipped')
+        else:
+            self._test_finished(test, 'error')
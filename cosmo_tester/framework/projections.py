@@ -0,0 +1,78 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import os
+import threading
+from collections import Counter
+
+# fields requested by helpers which only read some of a resource's fields
+ID = ['id']
+EXECUTION_STATUS = ['id', 'status']
+EXECUTION_ACTIVITY = ['id', 'deployment_id', 'status', 'created_at']
+NODE_INSTANCE_RUNTIME_PROPERTIES = ['id', 'runtime_properties']
+NODE_DEPLOYMENT = ['deploy_number_of_instances', 'deployment_id']
+
+# serializing responses to measure them is costly, so bytes received are
+# only collected when enabled
+COLLECT_BYTES_RECEIVED_ENV = 'COSMO_TESTER_COLLECT_BYTES_RECEIVED'
+collect_bytes_received = os.environ.get(COLLECT_BYTES_RECEIVED_ENV) == 'true'
+
+# resources and approximate payload bytes received, per helper
+items_received = Counter()
+bytes_received = Counter()
+_received_lock = threading.Lock()
+
+
+def query(helper, func, fields=None):
+    """Wraps a REST client call to request only the given fields.
+
+    Resources received are counted per helper, and so are their sizes when
+    collect_bytes_received is set.
+    """
+    def projected(*args, **kwargs):
+        if fields is not None:
+            kwargs['_include'] = fields
+        response = func(*args, **kwargs)
+        items = _items(response)
+        size = _payload_size(items) if collect_bytes_received else 0
+        with _received_lock:
+            items_received[helper] += len(items)
+            bytes_received[helper] += size
+        return response
+    return projected
+
+
+def _items(response):
+    # list responses hold their resources in items, resources are dicts
+    if isinstance(response, dict):
+        return [response]
+    return getattr(response, 'items', response)
+
+
+def _payload_size(items):
+    try:
+        return len(json.dumps(items, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def log_received(logger):
+    for helper, count in sorted(items_received.items()):
+        if collect_bytes_received:
+            logger.info('{0} received {1} resources, {2} bytes'.format(
+                helper, count, bytes_received[helper]))
+        else:
+            logger.info('{0} received {1} resources'.format(helper, count))
@@ -20,7 +20,6 @@ import sys
 import shutil
 import tempfile
 import time
-import copy
 import os
 import importlib
 import json
@@ -31,6 +30,9 @@ from path import path
 import fabric.api
 import fabric.context_managers
 
+from cosmo_tester.framework import manager_state
+from cosmo_tester.framework import projections
+from cosmo_tester.framework import waiter
 from cosmo_tester.framework.cfy_helper import (CfyHelper,
                                                DEFAULT_EXECUTE_TIMEOUT)
 from cosmo_tester.framework.util import (get_blueprint_path,
@@ -269,7 +271,7 @@ class TestCase(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        pass
+        projections.log_received(logger)
 
     def wait_until_deployment_ready_and_execute_install(self,
                                                         deployment_id,
@@ -282,7 +284,9 @@ class TestCase(unittest.TestCase):
             deployment_id=None,
             include_system_workflows=False,
             verify_no_failed_execution=False,
-            end_status_list=Execution.END_STATES):
+            end_status_list=Execution.END_STATES,
+            timeout=DEFAULT_EXECUTE_TIMEOUT,
+            deadline=None):
         if deployment_id:
             msg = "Waiting for executions on " \
                   "deployment {0} to finish".format(deployment_id)
@@ -292,24 +296,28 @@ class TestCase(unittest.TestCase):
             msg = "{0}, including system workflows.".format(msg)
         self.logger.info(msg)
 
-        start_time = time.time()
-        while len([execution for execution in self.client.executions.list(
-                deployment_id=deployment_id,
-                include_system_workflows=include_system_workflows)
-                if execution["status"] not in end_status_list]) > 0:
-            time.sleep(1)
-            if start_time - time.time() > DEFAULT_EXECUTE_TIMEOUT:
-                if deployment_id:
-                    timeout_msg = "Timeout while waiting for " \
-                                  "executions to end " \
-                                  "on deployment {0}.".format(deployment_id)
-                else:
-                    timeout_msg = "Timeout while waiting for " \
-                                  "system wide executions to end."
-                raise Exception(timeout_msg)
+        list_executions = projections.query(
+            'wait_until_all_deployment_executions_end',
+            self.client.executions.list,
+            projections.EXECUTION_STATUS)
+        for _ in waiter.Waiter(timeout, deadline):
+            if not [execution for execution in list_executions(
+                    deployment_id=deployment_id,
+                    include_system_workflows=include_system_workflows)
+                    if execution["status"] not in end_status_list]:
+                break
+        else:
+            if deployment_id:
+                timeout_msg = "Timeout while waiting for " \
+                              "executions to end " \
+                              "on deployment {0}.".format(deployment_id)
+            else:
+                timeout_msg = "Timeout while waiting for " \
+                              "system wide executions to end."
+            raise Exception(timeout_msg)
 
         if verify_no_failed_execution:
-            executions = [e for e in self.client.executions.list(
+            executions = [e for e in list_executions(
                           deployment_id=deployment_id,
                           include_system_workflows=include_system_workflows)
                           if e["status"] == Execution.FAILED]
@@ -343,6 +351,7 @@ class TestCase(unittest.TestCase):
                              management_user=management_user,
                              management_key=management_key_path)
         self.client = self.env.rest_client
+        self.manager_state_tracker = self._get_manager_state_tracker()
         self.test_id = 'system-test-{0}-{1}'.format(
             self._testMethodName,
             time.strftime("%Y%m%d-%H%M"))
@@ -365,46 +374,21 @@ class TestCase(unittest.TestCase):
         # unlike tearDown which is not called when setUp fails (which might
         # happen when tests override setUp)
 
+    def _get_manager_state_tracker(self):
+        # kept on the class so tests of a class share it, a full state is
+        # then only fetched once per class and rest client
+        tracker = getattr(type(self), '_manager_state_tracker', None)
+        if tracker is None or tracker.client is not self.client:
+            tracker = manager_state.ManagerStateTracker(self.client)
+            type(self)._manager_state_tracker = tracker
+        return tracker
+
     def get_manager_state(self):
         self.logger.info('Fetching manager current state')
-        blueprints = {}
-        for blueprint in self.client.blueprints.list():
-            blueprints[blueprint.id] = blueprint
-        deployments = {}
-        for deployment in self.client.deployments.list():
-            deployments[deployment.id] = deployment
-        nodes = {}
-        for deployment_id in deployments.keys():
-            for node in self.client.node_instances.list(deployment_id):
-                nodes[node.id] = node
-        deployment_nodes = {}
-        node_state = {}
-        for deployment_id in deployments.keys():
-            deployment_nodes[deployment_id] = self.client.node_instances.list(
-                deployment_id).items
-            node_state[deployment_id] = {}
-            for node in deployment_nodes[deployment_id]:
-                node_state[deployment_id][node.id] = node
-
-        return {
-            'blueprints': blueprints,
-            'deployments': deployments,
-            'nodes': nodes,
-            'node_state': node_state,
-            'deployment_nodes': deployment_nodes
-        }
+        return self.manager_state_tracker.snapshot()
 
     def get_manager_state_delta(self, before, after):
-        after = copy.deepcopy(after)
-        for blueprint_id in before['blueprints'].keys():
-            del after['blueprints'][blueprint_id]
-        for deployment_id in before['deployments'].keys():
-            del after['deployments'][deployment_id]
-            del after['deployment_nodes'][deployment_id]
-            del after['node_state'][deployment_id]
-        for node_id in before['nodes'].keys():
-            del after['nodes'][node_id]
-        return after
+        return manager_state.get_manager_state_delta(before, after)
 
     def execute_install(self,
                         deployment_id=None,
@@ -486,44 +470,79 @@ class TestCase(unittest.TestCase):
                         str(blueprint_path))
         return blueprint_path
 
+    def _dump_events(self, client, execution):
+        events, _ = client.events.get(execution.id,
+                                      batch_size=1000,
+                                      include_logs=True)
+        self.logger.info('Deployment creation events & logs:')
+        for event in events:
+            self.logger.info(json.dumps(event))
+
+    def _execution_ended(self, client, execution, status, assert_success):
+        if status == 'failed':
+            if assert_success:
+                self._dump_events(client, execution)
+                raise AssertionError('Execution "{}" failed'.format(
+                    execution.id))
+            return True
+        return status == 'terminated'
+
     def wait_for_execution(self, execution, timeout, client=None,
-                           assert_success=True):
-        def dump_events(_client, _execution):
-            events, _ = _client.events.get(_execution.id,
-                                           batch_size=1000,
-                                           include_logs=True)
-            self.logger.info('Deployment creation events & logs:')
-            for event in events:
-                self.logger.info(json.dumps(event))
+                           assert_success=True, deadline=None):
         client = client or self.client
-        end = time.time() + timeout
-        while time.time() < end:
-            status = client.executions.get(execution.id).status
-            if status == 'failed':
-                if assert_success:
-                    dump_events(client, execution)
-                    raise AssertionError('Execution "{}" failed'.format(
-                        execution.id))
-                else:
-                    return
-            if status == 'terminated':
+        get_execution = projections.query('wait_for_execution',
+                                          client.executions.get,
+                                          projections.EXECUTION_STATUS)
+        for _ in waiter.Waiter(timeout, deadline):
+            status = get_execution(execution.id).status
+            if self._execution_ended(client, execution, status,
+                                     assert_success):
                 return
-            time.sleep(1)
-        dump_events(client, execution)
+        self._dump_events(client, execution)
         raise AssertionError('Execution "{}" timed out'.format(execution.id))
 
+    def wait_for_executions(self, executions, timeout, client=None,
+                            assert_success=True, deadline=None):
+        """Waits for several executions with one executions list call per
+        deployment per poll, instead of one get call per execution.
+
+        Executions of no deployment, such as snapshot workflows, are
+        fetched by id.
+        """
+        client = client or self.client
+        list_executions = projections.query('wait_for_executions',
+                                            client.executions.list,
+                                            projections.EXECUTION_STATUS)
+        get_execution = projections.query('wait_for_executions',
+                                          client.executions.get,
+                                          projections.EXECUTION_STATUS)
+        pending = dict((execution.id, execution) for execution in executions)
+        for _ in waiter.Waiter(timeout, deadline):
+            deployment_ids = set(e.deployment_id for e in pending.values())
+            polled = []
+            for deployment_id in sorted(deployment_ids - set([None, ''])):
+                polled.extend(manager_state.list_all(
+                    list_executions,
+                    deployment_id=deployment_id,
+                    include_system_workflows=True))
+            polled.extend(get_execution(e.id) for e in pending.values()
+                          if not e.deployment_id)
+            for execution in polled:
+                if execution.id in pending and self._execution_ended(
+                        client, pending[execution.id], execution.status,
+                        assert_success):
+                    del pending[execution.id]
+            if not pending:
+                return
+        for execution in pending.values():
+            self._dump_events(client, execution)
+        raise AssertionError('Executions "{}" timed out'.format(
+            '", "'.join(sorted(pending))))
+
     def repetitive(self, func, timeout=10, exception_class=Exception,
-                   args=None, kwargs=None):
-        args = args or []
-        kwargs = kwargs or {}
-        deadline = time.time() + timeout
-        while True:
-            try:
-                return func(*args, **kwargs)
-            except exception_class:
-                if time.time() > deadline:
-                    raise
-                time.sleep(1)
+                   args=None, kwargs=None, deadline=None):
+        return waiter.retry(func, waiter.Waiter(timeout, deadline),
+                            exception_class, args, kwargs)
 
     @contextmanager
     def manager_env_fabric(self, **kwargs):
@@ -548,7 +567,10 @@ class TestCase(unittest.TestCase):
             filters['node_id'] = compute_node_id
         if compute_node_instance_id:
             filters['id'] = compute_node_instance_id
-        computes = self.client.node_instances.list(**filters).items
+        computes = projections.query(
+            'run_commands_on_agent_host',
+            self.client.node_instances.list,
+            projections.NODE_INSTANCE_RUNTIME_PROPERTIES)(**filters).items
         if not computes:
             self.fail('No compute nodes were found')
         if len(computes) > 1:
@@ -563,16 +585,14 @@ class TestCase(unittest.TestCase):
                      '-t -i /root/.ssh/agent_key.pem {0}@{1} "{2}"'
                      .format(user, private_ip, ' && '.join(commands)))
 
-    def wait_for_resource(self, predicate_func, timeout_sec=60):
-        timeout = time.time() + timeout_sec
-        while True:
-            if time.time() > timeout:
-                raise RuntimeError('Failed waiting for resource')
+    def wait_for_resource(self, predicate_func, timeout_sec=60,
+                          deadline=None):
+        for _ in waiter.Waiter(timeout_sec, deadline):
             try:
-                result = predicate_func()
-                if result:
+                if predicate_func():
                     break
             except Exception as e:
                 logger.info('predicate function raised an error; {error}'
                             .format(error=e))
-            time.sleep(1)
+        else:
+            raise RuntimeError('Failed waiting for resource')
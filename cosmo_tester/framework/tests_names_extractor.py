@@ -14,7 +14,11 @@
 #  * limitations under the License.
 
 import json
+import types
+import unittest
+from inspect import isclass, ismethod
 
+from nose.plugins import Plugin
 from nose.plugins import collect
 
 
@@ -25,6 +29,12 @@ def _extract_test_info(test):
     return test_details_dict
 
 
+def _add_tests_list_path_option(parser):
+    # both plugins read it, whichever is loaded first adds it
+    if not parser.has_option('--tests-list-path'):
+        parser.add_option('--tests-list-path', default='nose.cfy')
+
+
 def _write_tests_json(tests_summary, test_list_path):
     with open(test_list_path, 'w') as outfile:
         json.dump(tests_summary, outfile, indent=4)
@@ -42,7 +52,7 @@ class TestsNamesExtractor(collect.CollectOnly):
 
     def options(self, parser, env):
         super(collect.CollectOnly, self).options(parser, env)
-        parser.add_option('--tests-list-path', default='nose.cfy')
+        _add_tests_list_path_option(parser)
 
     def configure(self, options, conf):
         super(TestsNamesExtractor, self).configure(options, conf)
@@ -53,3 +63,58 @@ class TestsNamesExtractor(collect.CollectOnly):
 
     def finalize(self, result):
         _write_tests_json(self.accumulated_tests, self.tests_list_path)
+
+
+class TestsNamesRecorder(Plugin):
+    """Records the tests that should run during the actual test run.
+
+    Produces the same tests list as TestsNamesExtractor without a separate
+    collect only run. Tests are recorded as the loader makes them, before
+    their fixtures run, so tests of a class whose setUpClass fails are
+    recorded as well.
+    """
+
+    name = 'testnamerecorder'
+
+    def __init__(self):
+        super(TestsNamesRecorder, self).__init__()
+        self.accumulated_tests = []
+        self.tests_list_path = None
+        self._recorded = set()
+        self._loader = None
+
+    def options(self, parser, env):
+        super(TestsNamesRecorder, self).options(parser, env)
+        _add_tests_list_path_option(parser)
+
+    def configure(self, options, conf):
+        super(TestsNamesRecorder, self).configure(options, conf)
+        self.tests_list_path = options.tests_list_path
+
+    def prepareTestLoader(self, loader):
+        self._loader = loader
+
+    def makeTest(self, obj, parent=None):
+        if isclass(obj) and issubclass(obj, unittest.TestCase):
+            # nose transplants classes imported into another test module
+            if isinstance(parent, types.ModuleType):
+                module = parent.__name__
+            else:
+                module = obj.__module__
+            for name in self._loader.getTestCaseNames(obj):
+                self._record(module, obj.__name__, name)
+        elif ismethod(obj) and isclass(parent) and \
+                issubclass(parent, unittest.TestCase):
+            self._record(parent.__module__, parent.__name__, obj.__name__)
+
+    def _record(self, test_module, test_class, test_name):
+        key = (test_module, test_class, test_name)
+        if key in self._recorded:
+            return
+        self._recorded.add(key)
+        self.accumulated_tests.append({'test_module': test_module,
+                                       'test_class': test_class,
+                                       'test_name': test_name})
+
+    def finalize(self, result):
+        _write_tests_json(self.accumulated_tests, self.tests_list_path)
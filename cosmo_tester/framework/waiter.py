@@ -0,0 +1,103 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import random
+import sys
+import time
+
+INITIAL_INTERVAL = 1
+BACKOFF_FACTOR = 1.5
+MAX_INTERVAL = 5
+# intervals are randomly shortened by up to this fraction, so concurrent
+# waiters do not poll the manager in lockstep
+JITTER = 0.25
+
+
+class Deadline(object):
+    """A point in time, a timeout of None never expires."""
+
+    def __init__(self, timeout, clock=time.time):
+        self.clock = clock
+        if timeout is None:
+            self.end = float('inf')
+        else:
+            self.end = clock() + timeout
+
+    def remaining(self):
+        return max(0, self.end - self.clock())
+
+    def expired(self):
+        return self.clock() >= self.end
+
+
+class Waiter(object):
+    """Polls with exponential backoff, jitter and a capped interval.
+
+    Iterating a waiter yields once right away and then after each sleep,
+    the last time once the deadline is reached, so callers poll in a for
+    loop and handle a timeout in its else clause. A deadline may be shared
+    by several waiters so nested waits end together.
+    """
+
+    def __init__(self,
+                 timeout=None,
+                 deadline=None,
+                 initial_interval=INITIAL_INTERVAL,
+                 backoff_factor=BACKOFF_FACTOR,
+                 max_interval=MAX_INTERVAL,
+                 jitter=JITTER,
+                 sleep=time.sleep,
+                 clock=time.time):
+        if deadline is None:
+            deadline = Deadline(timeout, clock=clock)
+        self.deadline = deadline
+        self.initial_interval = initial_interval
+        self.backoff_factor = backoff_factor
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.sleep = sleep
+        self.attempts = 0
+
+    def expired(self):
+        return self.deadline.expired()
+
+    def intervals(self):
+        interval = self.initial_interval
+        while True:
+            yield interval * (1 - random.uniform(0, self.jitter))
+            interval = min(interval * self.backoff_factor, self.max_interval)
+
+    def __iter__(self):
+        intervals = self.intervals()
+        while True:
+            self.attempts += 1
+            yield self.attempts
+            if self.deadline.expired():
+                return
+            self.sleep(min(next(intervals), self.deadline.remaining()))
+
+
+def retry(func, waiter, exception_class=Exception, args=None, kwargs=None):
+    """Calls func until it does not raise exception_class, re-raising its
+    last exception once the waiter's deadline passes."""
+    args = args or []
+    kwargs = kwargs or {}
+    exc_info = None
+    for _ in waiter:
+        try:
+            return func(*args, **kwargs)
+        except exception_class:
+            exc_info = sys.exc_info()
+    raise exc_info[0], exc_info[1], exc_info[2]
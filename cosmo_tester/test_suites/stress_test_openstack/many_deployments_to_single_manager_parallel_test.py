@@ -22,6 +22,8 @@ import os
 from retrying import retry
 from threading import Thread
 
+from cosmo_tester.framework import projections
+from cosmo_tester.framework import waiter
 from cosmo_tester.framework.test_cases import MonitoringTestCase
 from cloudify_rest_client.executions import Execution
 
@@ -101,18 +103,19 @@ class MultiDeploymentParallelExecutionTest(MonitoringTestCase):
             x[0].join()
 
     def wait_until_all_deployment_executions_end(self, deployment_id):
-        start_time = time.time()
-        while len([execution for execution in self.client.executions.list(
-                deployment_id=deployment_id)
-                if execution["status"] not in Execution.END_STATES]) > 0:
+        list_executions = projections.query(
+            'wait_until_all_deployment_executions_end',
+            self.client.executions.list,
+            projections.EXECUTION_STATUS)
+        for _ in waiter.Waiter(self.execute_timeout):
+            if not [execution for execution in list_executions(
+                    deployment_id=deployment_id)
+                    if execution["status"] not in Execution.END_STATES]:
+                return
             self.logger.info("waiting for executions to end on deployment {0}"
                              .format(deployment_id))
-            time.sleep(1)
-            if time.time() - start_time > self.execute_timeout:
-                ex = Exception("Time out while waiting for executions on "
-                               "deployment {0}".format(deployment_id))
-                raise ex
-        return
+        raise Exception("Time out while waiting for executions on "
+                        "deployment {0}".format(deployment_id))
 
     @retry(stop_max_delay=10000,
            stop_max_attempt_number=555)
@@ -270,15 +273,16 @@ class MultiDeploymentParallelExecutionTest(MonitoringTestCase):
                 "sudo: unable to resolve host cloudify-manager-server", ""))
 
     def get_number_of_total_active_nodes(self):
-        return len((self.client.nodes.list(
-            _include=["deploy_number_of_instances",
-                      "deployment_id"])))
+        return len(projections.query(
+            'get_number_of_total_active_nodes',
+            self.client.nodes.list,
+            projections.NODE_DEPLOYMENT)())
 
     def get_number_of_active_nodes_per_deployment(self, deployment_id):
-        return len((self.client.nodes.list(
-            deployment_id=deployment_id,
-            _include=["deploy_number_of_instances",
-                      "deployment_id"])))
+        return len(projections.query(
+            'get_number_of_active_nodes_per_deployment',
+            self.client.nodes.list,
+            projections.NODE_DEPLOYMENT)(deployment_id=deployment_id))
 
     def _end_test(self):
         # self.check_all_installed_deployments_installed_successfully()
@@ -20,6 +20,8 @@ import fabric.api
 
 from cloudify_rest_client.executions import Execution
 
+from cosmo_tester.framework import projections
+from cosmo_tester.framework import waiter
 from cosmo_tester.framework.test_cases import MonitoringTestCase
 
 
@@ -34,11 +36,15 @@ def num(s):
 class ManyDeploymentsTest(MonitoringTestCase):
 
     def wait_until_all_deployment_executions_end(self, deployment_id):
-        while len([execution for execution in self.client.executions.list(
-                deployment_id=deployment_id)
-                if execution["status"] not in Execution.END_STATES]) > 0:
-                    time.sleep(1)
-        return
+        list_executions = projections.query(
+            'wait_until_all_deployment_executions_end',
+            self.client.executions.list,
+            projections.EXECUTION_STATUS)
+        for _ in waiter.Waiter():
+            if not [execution for execution in list_executions(
+                    deployment_id=deployment_id)
+                    if execution["status"] not in Execution.END_STATES]:
+                return
 
     def many_deployments_stress_test(self):
         self._run()
@@ -93,15 +99,16 @@ class ManyDeploymentsTest(MonitoringTestCase):
                 "sudo: unable to resolve host cloudify-manager-server", ""))
 
     def get_number_of_total_active_nodes(self):
-        return len((self.client.nodes.list(
-            _include=["deploy_number_of_instances",
-                      "deployment_id"])))
+        return len(projections.query(
+            'get_number_of_total_active_nodes',
+            self.client.nodes.list,
+            projections.NODE_DEPLOYMENT)())
 
     def get_number_of_active_nodes_per_deployment(self, deployment_id):
-        return len((self.client.nodes.list(
-            deployment_id=deployment_id,
-            _include=["deploy_number_of_instances",
-                      "deployment_id"])))
+        return len(projections.query(
+            'get_number_of_active_nodes_per_deployment',
+            self.client.nodes.list,
+            projections.NODE_DEPLOYMENT)(deployment_id=deployment_id))
 
     def _end_test(self, report, number_of_deployments):
         self.logger.info(json.dumps(report, indent=2))
@@ -54,8 +54,9 @@ class SnapshotsHelloWorldTest(TestCase):
 
     def tearDown(self):
         state = self.get_manager_state()
+        # a single executions list per poll for all deployments
+        self.wait_until_all_deployment_executions_end()
         for d in state['deployments']:
-            self.wait_until_all_deployment_executions_end(d)
             self.client.deployments.delete(d)
         for b in state['blueprints']:
             self.client.blueprints.delete(b)
@@ -46,6 +46,10 @@ setup(
         'nose.plugins.0.10': [
             'testnameextractor = cosmo_tester.framework'
             '.tests_names_extractor:TestsNamesExtractor',
+            'testnamerecorder = cosmo_tester.framework'
+            '.tests_names_extractor:TestsNamesRecorder',
+            'progressreporter = cosmo_tester.framework'
+            '.progress_reporter:ProgressReporter',
             ]
     },
 
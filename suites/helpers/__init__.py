@@ -14,17 +14,24 @@
 # limitations under the License.
 
 import sys
+import threading
 
+_write_lock = threading.Lock()
 
-def _write(stream, s):
+
+def _write(stream, s, prefix=None):
     try:
         s = s.encode('utf-8')
     except UnicodeDecodeError:
         pass
-    stream.write(s)
+    if prefix:
+        s = '[{0}] {1}'.format(prefix, s)
+    # commands may run concurrently, keep their lines whole
+    with _write_lock:
+        stream.write(s)
 
 
-def sh_bake(command):
+def sh_bake(command, prefix=None):
     return command.bake(
-        _out=lambda line: _write(sys.stdout, line),
-        _err=lambda line: _write(sys.stderr, line))
+        _out=lambda line: _write(sys.stdout, line, prefix),
+        _err=lambda line: _write(sys.stderr, line, prefix))
@@ -0,0 +1,87 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import logging
+import shutil
+
+import fasteners
+import sh
+
+from . import sh_bake
+
+logger = logging.getLogger('git_mirrors')
+logger.setLevel(logging.INFO)
+
+git = sh_bake(sh.git)
+
+
+class GitMirrors(object):
+    """Bare mirrors of git repositories shared by all suites of a run.
+
+    Mirrors are refreshed on the host and suites clone from them instead
+    of cloning from github, either sharing the mirror objects or as a
+    shallow single branch clone.
+    """
+
+    def __init__(self, mirrors_dir):
+        self.mirrors_dir = mirrors_dir
+
+    def mirror_path(self, repo, organization='cloudify-cosmo'):
+        return os.path.join(self.mirrors_dir, organization,
+                            '{0}.git'.format(repo))
+
+    def has_mirror(self, repo, organization='cloudify-cosmo'):
+        return os.path.isdir(self.mirror_path(repo, organization))
+
+    def refresh(self, url, repo, organization='cloudify-cosmo'):
+        mirror = self.mirror_path(repo, organization)
+        mirror_parent = os.path.dirname(mirror)
+        if not os.path.isdir(mirror_parent):
+            try:
+                os.makedirs(mirror_parent)
+            except OSError:
+                if not os.path.isdir(mirror_parent):
+                    raise
+        # several suites runners may share the mirrors
+        with fasteners.InterProcessLock('{0}.lock'.format(mirror)):
+            if os.path.isdir(mirror):
+                logger.info('Fetching git mirror: {0}'.format(mirror))
+                git('--git-dir={0}'.format(mirror),
+                    'fetch', '--prune', 'origin').wait()
+            else:
+                logger.info('Creating git mirror: {0}'.format(mirror))
+                git.clone('--mirror', url, mirror).wait()
+
+    def clone(self, url, repo, target, branch,
+              organization='cloudify-cosmo', shallow=False):
+        mirror = self.mirror_path(repo, organization)
+        cloned = False
+        if shallow:
+            try:
+                git.clone('--depth', '1', '--single-branch',
+                          '--branch', branch,
+                          'file://{0}'.format(mirror), target).wait()
+                cloned = True
+            except sh.ErrorReturnCode:
+                # branch may be a commit, which cannot be cloned shallowly
+                logger.warn('Shallow clone of {0} at {1} failed, falling '
+                            'back to a full clone'.format(repo, branch))
+                if os.path.isdir(target):
+                    shutil.rmtree(target)
+        if not cloned:
+            git.clone('--shared', mirror, target).wait()
+            git('-C', target, 'checkout', branch).wait()
+        git('-C', target, 'remote', 'set-url', 'origin', url).wait()
@@ -0,0 +1,70 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# written by suite containers into their work dir, read by the suites runner
+PROGRESS_EVENTS = 'progress-events.jsonl'
+
+
+class ProgressEvents(object):
+    """Publishes progress events of a suite as json lines.
+
+    Each event is appended with a single write, so the suite runner and
+    the nose processes it starts may publish to the same file. Finished
+    phases are also kept as timing spans for the suite's timings file.
+    """
+
+    def __init__(self, events_path):
+        self.events_path = events_path
+        self.spans = []
+
+    def publish(self, event, **fields):
+        fields['event'] = event
+        fields['time'] = time.time()
+        with open(self.events_path, 'a') as f:
+            f.write('{0}\n'.format(json.dumps(fields)))
+
+    @contextmanager
+    def phase(self, name, **fields):
+        self.publish('phase_started', phase=name, **fields)
+        started = time.time()
+        result = 'failed'
+        try:
+            yield
+            result = 'passed'
+        finally:
+            duration = time.time() - started
+            self.publish('phase_finished',
+                         phase=name,
+                         result=result,
+                         duration=duration,
+                         **fields)
+            span = dict(fields)
+            span.update(phase=name,
+                        started=started,
+                        duration=duration,
+                        result=result)
+            self.spans.append(span)
+
+    def write_timings(self, timings_path):
+        tmp_timings_path = '{0}.tmp'.format(timings_path)
+        with open(tmp_timings_path, 'w') as f:
+            json.dump(sorted(self.spans, key=lambda s: s['started']),
+                      f, indent=2)
+        os.rename(tmp_timings_path, timings_path)
@@ -9,11 +9,17 @@ setenv()
 
 create_activate_and_cd_virtualenv()
 {
-	echo "### Creating virtualenv"
-	virtualenv env
-	source env/bin/activate
-	pip install -r ${BASE_HOST_DIR}/requirements.txt
-	pip install --no-index --find-links=/wheels -r ${BASE_HOST_DIR}/wheel-requirements.txt
+	if [[ -n "${PREBAKED_VIRTUALENV}" ]]; then
+		echo "### Activating pre-baked virtualenv: ${PREBAKED_VIRTUALENV}"
+		source ${PREBAKED_VIRTUALENV}/bin/activate
+		mkdir -p env
+	else
+		echo "### Creating virtualenv"
+		virtualenv env
+		source env/bin/activate
+		pip install -r ${BASE_HOST_DIR}/requirements.txt
+		pip install --no-index --find-links=/wheels -r ${BASE_HOST_DIR}/wheel-requirements.txt
+	fi
 	cd env
 }
 
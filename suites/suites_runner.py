@@ -15,11 +15,20 @@
 
 import os
 import sys
+import errno
+import fcntl
+import hashlib
+import Queue
 import signal
+import collections
 import logging
 import json
 import random
+import select
 import shutil
+import sqlite3
+import subprocess
+import threading
 import time
 import tempfile
 from contextlib import contextmanager
@@ -32,6 +41,8 @@ from path import path
 from nose.plugins import xunit
 
 from helpers import sh_bake
+from helpers.git_mirrors import GitMirrors
+from helpers.progress import PROGRESS_EVENTS
 from helpers.suites_builder import build_suites_yaml
 
 logging.basicConfig()
@@ -49,29 +60,272 @@ except sh.CommandNotFound:
     vagrant = None
 
 reports_dir = path(__file__).dirname() / 'xunit-reports'
+XUNIT_TESTSUITE_COUNTERS = ['tests', 'errors', 'failures', 'skip']
 
 TEST_SUITES_PATH = 'TEST_SUITES_PATH'
+SUITES_LAUNCHER = 'SUITES_LAUNCHER'
+SUITES_SHARE_PAYLOAD = 'SUITES_SHARE_PAYLOAD'
+SUITES_PREBAKE_VIRTUALENV = 'SUITES_PREBAKE_VIRTUALENV'
+SUITES_GIT_MIRRORS = 'SUITES_GIT_MIRRORS'
+SUITES_SHALLOW_CLONES = 'SUITES_SHALLOW_CLONES'
+SUITES_MERGE_XUNIT_REPORTS = 'SUITES_MERGE_XUNIT_REPORTS'
+SUITES_IDLE_TIMEOUT = 'SUITES_IDLE_TIMEOUT'
+SUITES_LEGACY_ENVIRONMENTS = 'SUITES_LEGACY_ENVIRONMENTS'
+CONTAINER_GIT_MIRRORS_DIR = '/git-mirrors'
+# repositories every suite clones
+SUITE_REPOS = ['cloudify-system-tests',
+               'cloudify-cli',
+               'cloudify-manager-blueprints']
 DOCKER_REPOSITORY = 'cloudify/test'
 DOCKER_TAG = 'env'
+DOCKER_IMAGE = '{0}:{1}'.format(DOCKER_REPOSITORY, DOCKER_TAG)
+# files the docker image is built from, the image tag is derived from them
+DOCKER_BUILD_INPUTS = ['Dockerfile', 'wheel-requirements.txt']
+DOCKER_IMAGES_TO_KEEP = 3
+VIRTUALENV_DOCKER_TAG = 'venv'
+VIRTUALENV_DOCKERFILE_TEMPLATE = 'Dockerfile.virtualenv.template'
+# core repositories installed into the pre-baked virtualenv
+VIRTUALENV_CORE_REPOS = ['cloudify-dsl-parser',
+                         'cloudify-rest-client',
+                         'cloudify-plugins-common']
+VAGRANT_LAUNCHER = 'vagrant'
+DOCKER_LAUNCHER = 'docker'
+LAUNCHERS = [VAGRANT_LAUNCHER, DOCKER_LAUNCHER]
+# files every suite container needs under /vagrant
+SUITE_PAYLOAD = [
+    'Dockerfile',
+    'suite_runner.py',
+    'suite_runner.sh',
+    'requirements.txt',
+    'wheel-requirements.txt',
+    'suites',
+    'helpers',
+    'configurations']
+SHARED_PAYLOAD_DIR = '.shared-payload'
 SUITE_ENVS_DIR = 'suite-envs'
+CONTAINER_LOG = 'container.log'
+# only the tail of a container log is embedded in its custom xunit report
+CONTAINER_LOG_TAIL_SIZE = 2 * 1024 * 1024
+CONTAINER_LOG_READ_SIZE = 64 * 1024
 SCHEDULER_INTERVAL = 30
+SUITE_TIMEOUT = 60 * 60 * 5
+# suites without output or progress events for this long are terminated,
+# disabled unless set, as quiet phases like vagrant up or a manager
+# bootstrap may take long
+SUITE_IDLE_TIMEOUT = -1
+SUITE_DURATIONS_SAMPLES = 5
+ENVIRONMENT_LEASE_DURATION = 5 * 60
+PRUNE_BATCH_SIZE = 20
+PRUNE_PARALLELISM = 4
+
+
+class ContainerLog(object):
+    """Full output of a suite container, written to a file as it streams.
+
+    The last tail_size bytes are also kept in memory so reports do not
+    need to read back logs of suites that may have run for hours.
+    """
+
+    def __init__(self, log_path, tail_size=CONTAINER_LOG_TAIL_SIZE):
+        self.log_path = log_path
+        self.tail_size = tail_size
+        self.truncated = False
+        self.last_write = None
+        self._tail = collections.deque()
+        self._tail_bytes = 0
+        self._file = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def write(self, line):
+        try:
+            line = line.encode('utf-8')
+        except UnicodeDecodeError:
+            pass
+        with self._lock:
+            if self._closed:
+                return
+            if not self._file:
+                self._file = open(self.log_path, 'ab')
+            self._file.write(line)
+            self.last_write = time.time()
+            self._tail.append(line)
+            self._tail_bytes += len(line)
+            while self._tail_bytes > self.tail_size:
+                self.truncated = True
+                dropped = self._tail.popleft()
+                self._tail_bytes -= len(dropped)
+                if not self._tail:
+                    # a single line longer than the tail
+                    line = line[-self.tail_size:]
+                    self._tail.append(line)
+                    self._tail_bytes = len(line)
+
+    def tail(self):
+        with self._lock:
+            return ''.join(self._tail).decode('utf-8', 'replace')
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file:
+                self._file.close()
+
+
+class FollowedProcess(object):
+    """A process followed by ContainersLogs, alive until it exited and all
+    of its output was read."""
+
+    def __init__(self, process):
+        self._process = process
+        self.drained = threading.Event()
+
+    def is_alive(self):
+        return self._process.poll() is None or not self.drained.is_set()
+
+    def wait(self):
+        exit_code = self._process.wait()
+        self.drained.wait()
+        return exit_code
+
+
+class ContainersLogs(object):
+    """Streams the output of all suite containers through one reader.
+
+    Every followed container has its own docker logs -f process, the
+    output of all of them is read by a single thread with select rather
+    than by reader threads per process. Lines are prefixed with the suite
+    name and written by a single writer thread, so output of parallel
+    suites is never interleaved mid line. Lines are also written to the
+    container log when one is given.
+    """
+
+    def __init__(self, stream=sys.stdout):
+        self._stream = stream
+        self._lines = Queue.Queue()
+        self._writer = None
+        self._reader = None
+        self._threads_lock = threading.Lock()
+        # output fd to [file, collect, followed process, partial line]
+        self._followed = {}
+        self._wakeup_read, self._wakeup_write = None, None
+
+    def follow(self, container_name, prefix, log=None):
+        return self.follow_process(
+            subprocess.Popen(['docker', 'logs', '-f', container_name],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT,
+                             close_fds=True),
+            prefix,
+            log)
+
+    def follow_process(self, process, prefix=None, log=None):
+        followed = FollowedProcess(process)
+        collect = self.collector(prefix, log)
+        self._start_reader()
+        with self._threads_lock:
+            self._followed[process.stdout.fileno()] = [
+                process.stdout, collect, followed, '']
+        os.write(self._wakeup_write, 'x')
+        return followed
+
+    def collector(self, prefix=None, log=None):
+        self._start_writer()
+
+        def collect(line):
+            # written right away, the log is complete once the followed
+            # process ends
+            if log:
+                log.write(line)
+            self._lines.put((prefix, line))
+        return collect
+
+    def _start_writer(self):
+        with self._threads_lock:
+            if self._writer:
+                return
+            self._writer = threading.Thread(target=self._write_lines)
+            self._writer.daemon = True
+            self._writer.start()
+
+    def _start_reader(self):
+        with self._threads_lock:
+            if self._reader:
+                return
+            self._wakeup_read, self._wakeup_write = os.pipe()
+            self._reader = threading.Thread(target=self._read_lines)
+            self._reader.daemon = True
+            self._reader.start()
+
+    def _read_lines(self):
+        while True:
+            with self._threads_lock:
+                fds = self._followed.keys()
+            readable, _, _ = select.select(fds + [self._wakeup_read], [], [])
+            for fd in readable:
+                if fd == self._wakeup_read:
+                    os.read(fd, CONTAINER_LOG_READ_SIZE)
+                    continue
+                with self._threads_lock:
+                    followed = self._followed[fd]
+                output, collect, process, partial_line = followed
+                data = os.read(fd, CONTAINER_LOG_READ_SIZE)
+                lines = (partial_line + data).splitlines(True)
+                if data and lines and not lines[-1].endswith('\n'):
+                    followed[3] = lines.pop()
+                else:
+                    followed[3] = ''
+                for line in lines:
+                    collect(line.decode('utf-8', 'replace'))
+                if not data:
+                    with self._threads_lock:
+                        del self._followed[fd]
+                    output.close()
+                    process.drained.set()
+
+    def _write_lines(self):
+        while True:
+            prefix, line = self._lines.get()
+            if prefix:
+                line = u'[{0}] {1}'.format(prefix, line)
+            try:
+                line = line.encode('utf-8')
+            except UnicodeDecodeError:
+                pass
+            self._stream.write(line)
+
+
+containers_logs = ContainersLogs()
 
 
 class TestSuite(object):
-    def __init__(self, suite_name, suite_def, suite_work_dir, variables):
+    def __init__(self, suite_name, suite_def, suite_work_dir, variables,
+                 docker_image=DOCKER_IMAGE, launcher=VAGRANT_LAUNCHER,
+                 shared_payload_dir=None, git_mirrors_dir=None,
+                 shallow_clones=False, merge_xunit_reports=False):
         self.suite_name = suite_name
         self.container_name = '{0}_{1}'.format(os.getpid(), self.suite_name)
         self.suite_def = suite_def
         self.suite_work_dir = suite_work_dir
         self.suite_reports_dir = suite_work_dir / 'xunit-reports'
         self.variables = variables
+        self.docker_image = docker_image
+        self.launcher = launcher
+        self.shared_payload_dir = shared_payload_dir
+        self.git_mirrors_dir = git_mirrors_dir
+        self.shallow_clones = shallow_clones
+        self.merge_xunit_reports = merge_xunit_reports
+        self.container_log = ContainerLog(suite_work_dir / CONTAINER_LOG)
+        self.progress_events_path = suite_work_dir / PROGRESS_EVENTS
         self._handler_configuration_def = None
         self.process = None
         self.started = None
         self.terminated = None
         self.timed_out = False
+        self.timeout_reason = None
         self.failed = False
         self.exit_code = None
+        self.events = None
 
     @property
     def descriptor(self):
@@ -106,27 +360,35 @@ class TestSuite(object):
         vagrant_file_content = jinja2.Template(vagrant_file_template).render({
             'suite_name': self.suite_name,
             'container_name': self.container_name,
+            'docker_image': self.docker_image,
             'suite': json.dumps(self.suite_def),
-            'variables': json.dumps(self.variables)
+            'variables': json.dumps(self.variables),
+            'env': self._container_env(),
+            'volumes': self._container_volumes()
         })
         path(self.suite_work_dir / 'Vagrantfile').write_text(
             vagrant_file_content)
-        files_to_copy = [
-            'Dockerfile',
-            'suite_runner.py',
-            'suite_runner.sh',
-            'requirements.txt',
-            'wheel-requirements.txt',
-            'suites',
-            'helpers',
-            'configurations']
-        for file_name in files_to_copy:
-            if os.path.isdir(file_name):
-                shutil.copytree(file_name, os.path.join(self.suite_work_dir,
-                                                        file_name))
-            else:
-                shutil.copy(file_name, os.path.join(self.suite_work_dir,
-                                                    file_name))
+        if not self.shared_payload_dir:
+            copy_payload(path.getcwd(), self.suite_work_dir)
+        elif self.launcher != DOCKER_LAUNCHER:
+            link_payload(self.shared_payload_dir, self.suite_work_dir)
+        # with the docker launcher the shared payload is mounted read-only
+        # when the container is started
+
+    def _container_env(self):
+        env = {}
+        if self.git_mirrors_dir:
+            env['GIT_MIRRORS_DIR'] = CONTAINER_GIT_MIRRORS_DIR
+            if self.shallow_clones:
+                env['GIT_SHALLOW_CLONES'] = 'true'
+        return env
+
+    def _container_volumes(self):
+        volumes = []
+        if self.git_mirrors_dir:
+            volumes.append('{0}:{1}:ro'.format(self.git_mirrors_dir,
+                                               CONTAINER_GIT_MIRRORS_DIR))
+        return volumes
 
     @property
     def is_running(self):
@@ -138,14 +400,73 @@ class TestSuite(object):
         self.create_env()
         logger.info('Starting suite in docker container: {0}'.format(
             self.suite_name))
+        self._launch()
+        self._watch_process()
+
+    def _launch(self):
+        if self.launcher == DOCKER_LAUNCHER:
+            self._launch_with_docker()
+        else:
+            self._launch_with_vagrant()
+
+    def _launch_with_vagrant(self):
         cwd = path.getcwd()
         try:
             os.chdir(self.suite_work_dir)
             vagrant.up().wait()
-            self.process = vagrant('docker-logs', f=True, _bg=True).process
+            collect = containers_logs.collector(log=self.container_log)
+            self.process = vagrant('docker-logs', f=True, _bg=True,
+                                   _out=collect, _err=collect).process
         finally:
             os.chdir(cwd)
 
+    def _launch_with_docker(self):
+        # same container vagrant's docker provider would start, the suite
+        # work dir is what vagrant syncs to /vagrant
+        run_args = [
+            '-d',
+            '--name', self.container_name,
+            '-v', '{0}:/vagrant'.format(self.suite_work_dir.abspath())]
+        if self.shared_payload_dir:
+            for name in SUITE_PAYLOAD:
+                run_args += ['-v', '{0}:/vagrant/{1}:ro'.format(
+                    (self.shared_payload_dir / name).abspath(), name)]
+        for volume in self._container_volumes():
+            run_args += ['-v', volume]
+        for key, value in sorted(self._container_env().items()):
+            run_args += ['-e', '{0}={1}'.format(key, value)]
+        run_args += [
+            '-e', 'TEST_SUITE_NAME={0}'.format(self.suite_name),
+            '-e', 'TEST_SUITE={0}'.format(json.dumps(self.suite_def)),
+            '-e', 'TEST_SUITES_VARIABLES={0}'.format(
+                json.dumps(self.variables)),
+            self.docker_image,
+            '/vagrant/suite_runner.sh']
+        docker.run(*run_args).wait()
+        self.process = containers_logs.follow(self.container_name,
+                                              prefix=self.suite_name,
+                                              log=self.container_log)
+
+    def _watch_process(self):
+        if not self.events:
+            return
+
+        def watch():
+            try:
+                self.process.wait()
+            except Exception as e:
+                logger.warn('Error while waiting for suite process '
+                            '[suite={0}, error={1}]'.format(
+                                self.suite_name, str(e)))
+            self._notify_terminated()
+        t = threading.Thread(target=watch)
+        t.daemon = True
+        t.start()
+
+    def _notify_terminated(self):
+        if self.events:
+            self.events.notify()
+
     def terminate(self):
         logger.warn('Terminating suite: {0}'.format(self.suite_name))
         try:
@@ -175,17 +496,36 @@ class TestSuite(object):
                 sh.docker.wait(suite.container_name).strip())
             if suite.exit_code:
                 suite.failed = True
+        suite.container_log.close()
         suite.copy_xunit_reports()
         # kill removes the container so it should be called after exit code
         # is extracted and xunit reports are generated
         suite.kill()
 
+    @property
+    def archived_container_log_path(self):
+        return reports_dir / '{0}-{1}'.format(self.suite_name, CONTAINER_LOG)
+
     def copy_xunit_reports(self):
+        # phase timings written by the suite, kept along with its reports
+        for timings_file in self.suite_reports_dir.files('*-timings.json'):
+            shutil.copy(timings_file, reports_dir / timings_file.name)
+        # suite envs are removed by the next run, the container log is kept
+        # along with the reports so links to it stay valid
+        if self.container_log.log_path.exists():
+            try:
+                os.link(self.container_log.log_path,
+                        self.archived_container_log_path)
+            except OSError:
+                shutil.copy2(self.container_log.log_path,
+                             self.archived_container_log_path)
         report_files = self.suite_reports_dir.files('*.xml')
         if self.timed_out:
             self._generate_custom_xunit_report(
-                'Suite {0} timed out after {1} seconds.'.format(
-                        self.descriptor, self.running_time),
+                'Suite {0} {1}.'.format(
+                        self.descriptor,
+                        self.timeout_reason or 'timed out after {0} '
+                        'seconds'.format(self.running_time)),
                 error_type='TestSuiteTimeout',
                 error_message='Test suite timed out')
         elif not report_files:
@@ -195,35 +535,30 @@ class TestSuite(object):
                 error_type='TestSuiteSkipped',
                 error_message='Test suite skipped')
         else:
-            import lxml.etree as et
             logger.info('Suite [{0}] reports: {1}'.format(
                     self.suite_name, [r.name for r in report_files]))
-            # adding suite name as a prefix to each test in each report
-            parser = et.XMLParser(strip_cdata=False)
-            for report in report_files:
-                root = et.parse(report.realpath(), parser)
-                test_elements = root.findall('testcase')
-                for test in test_elements:
-                    test_name = test.get('name')
-                    test.set('name', '{0} @ {1}'.format(test_name,
-                                                        self.suite_name))
-                tmp_file = tempfile.NamedTemporaryFile()
-                tmp_file.write(et.tostring(root, pretty_print=True))
-                # flushing remaining text in buffer before closing the file
-                tmp_file.flush()
-                shutil.copy(tmp_file.name, reports_dir / report.name)
-                tmp_file.close()
+            if self.merge_xunit_reports:
+                write_xunit_report(
+                    report_files,
+                    reports_dir / '{0}-report.xml'.format(self.suite_name),
+                    self.suite_name)
+            else:
+                for report in report_files:
+                    write_xunit_report([report],
+                                       reports_dir / report.name,
+                                       self.suite_name)
 
     def _generate_custom_xunit_report(self,
                                       text,
                                       error_type,
                                       error_message,
                                       fetch_logs=True):
-        logger.info('Getting docker logs for container: {0}'.format(
-            self.container_name))
         if fetch_logs:
-            logs = xunit.xml_safe(sh.docker.logs(
-                self.container_name, _err_to_out=True).strip())
+            logs = self.container_log.tail().strip()
+            if self.container_log.truncated:
+                logs = u'[Last {0} bytes of the container log]\n{1}'.format(
+                    self.container_log.tail_size, logs)
+            logs = xunit.xml_safe(logs)
         else:
             logs = ''
         if self._handler_configuration_def:
@@ -241,10 +576,14 @@ Suite definition:
 Environment: {2}
 
 Handler configuration:
-{3}""".format(text,
+{3}
+
+Container log:
+{4}""".format(text,
               json.dumps(self.suite_def, indent=2),
               env_id,
-              json.dumps(config, indent=2))
+              json.dumps(config, indent=2),
+              self.archived_container_log_path.abspath())
         xunit_file_template = path('xunit-template.xml').text()
         xunit_file_content = jinja2.Template(xunit_file_template).render({
             'suite_name': self.suite_name,
@@ -331,6 +670,346 @@ class FileEnvironments(Environments):
                 json.dump(locked_environments, f)
 
 
+class LockFileEnvironments(Environments):
+    """Environments locked with one flock()ed file per environment.
+
+    Locking an environment only touches its own lock file, so runners
+    locking different environments do not contend with each other. Locks
+    are held on open file descriptors and are released by the kernel when
+    the holding process dies, so no prune pass is required.
+
+    While runners which only know environments.json share the machine,
+    legacy_environments (a FileEnvironments) is locked as well, so old
+    and new runners see each other's locks.
+    """
+
+    def __init__(self, locks_dir, legacy_environments=None):
+        self._locks_dir = locks_dir
+        self._legacy_environments = legacy_environments
+        self._held = {}
+        if not os.path.isdir(locks_dir):
+            try:
+                os.makedirs(locks_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _lock_path(self, env_id):
+        return os.path.join(self._locks_dir,
+                            '{0}.lock'.format(env_id.replace(os.sep, '_')))
+
+    def lock(self, env_id):
+        if env_id in self._held:
+            return False
+        fd = os.open(self._lock_path(env_id), os.O_RDWR | os.O_CREAT, 0o644)
+        # child processes must not inherit (and keep holding) the lock
+        fcntl.fcntl(fd, fcntl.F_SETFD,
+                    fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        if (self._legacy_environments and
+                not self._legacy_environments.lock(env_id)):
+            # locked by an old runner
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            return False
+        # holder pid is informative only, the flock is the lock
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()))
+        self._held[env_id] = fd
+        return True
+
+    def release(self, env_id):
+        fd = self._held.pop(env_id)
+        if self._legacy_environments:
+            self._legacy_environments.release(env_id)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def prune(self, include_self=False):
+        if include_self:
+            for env_id in self._held.keys():
+                self.release(env_id)
+        if self._legacy_environments:
+            # entries of crashed runners are only removed by pruning
+            self._legacy_environments.prune(include_self)
+
+
+class SqliteEnvironments(Environments):
+    """Environment leases stored in a local SQLite database.
+
+    A lease records its holder pid, when it was taken, the last heartbeat
+    and when it expires. Held leases are renewed by a background heartbeat
+    so leases of a crashed runner expire on their own.
+    """
+
+    def __init__(self, db_path, lease_duration=ENVIRONMENT_LEASE_DURATION):
+        self._db_path = db_path
+        self._lease_duration = lease_duration
+        self._heartbeat_thread = None
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS leases ('
+                         'env_id TEXT PRIMARY KEY, '
+                         'pid INTEGER, '
+                         'locked_at REAL, '
+                         'heartbeat REAL, '
+                         'expires REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS leases_expires '
+                         'ON leases (expires)')
+            conn.execute('CREATE INDEX IF NOT EXISTS leases_pid '
+                         'ON leases (pid)')
+
+    @contextmanager
+    def _connect(self):
+        # a connection per operation keeps the heartbeat thread safe
+        conn = sqlite3.connect(self._db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lock(self, env_id):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO leases (env_id) VALUES (?)',
+                         (env_id,))
+            locked = conn.execute(
+                'UPDATE leases SET pid = ?, locked_at = ?, heartbeat = ?, '
+                'expires = ? WHERE env_id = ? AND '
+                '(pid IS NULL OR expires < ?)',
+                (os.getpid(), now, now, now + self._lease_duration, env_id,
+                 now)).rowcount == 1
+        if locked:
+            self._start_heartbeat()
+        return locked
+
+    def release(self, env_id):
+        with self._connect() as conn:
+            conn.execute('UPDATE leases SET pid = NULL, expires = NULL '
+                         'WHERE env_id = ? AND pid = ?',
+                         (env_id, os.getpid()))
+
+    def prune(self, include_self=False):
+        with self._connect() as conn:
+            conn.execute('UPDATE leases SET pid = NULL, expires = NULL '
+                         'WHERE expires < ?', (time.time(),))
+            if include_self:
+                conn.execute('UPDATE leases SET pid = NULL, expires = NULL '
+                             'WHERE pid = ?', (os.getpid(),))
+
+    def heartbeat(self):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('UPDATE leases SET heartbeat = ?, expires = ? '
+                         'WHERE pid = ? AND expires >= ?',
+                         (now, now + self._lease_duration, os.getpid(), now))
+
+    def leases(self):
+        """Returns the currently held leases, longest held first."""
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT env_id, pid, locked_at, heartbeat, expires '
+                'FROM leases WHERE expires >= ? ORDER BY locked_at',
+                (now,)).fetchall()
+        return [{'env_id': env_id,
+                 'pid': pid,
+                 'locked_at': locked_at,
+                 'heartbeat': heartbeat,
+                 'expires': expires,
+                 'busy_for': now - locked_at}
+                for env_id, pid, locked_at, heartbeat, expires in rows]
+
+    def _start_heartbeat(self):
+        if self._heartbeat_thread and self._heartbeat_thread.is_alive():
+            return
+
+        def heartbeat():
+            while True:
+                time.sleep(self._lease_duration / 3.0)
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    logger.error('Environments heartbeat failed: {0}'.format(
+                        str(e)))
+        self._heartbeat_thread = threading.Thread(target=heartbeat)
+        self._heartbeat_thread.daemon = True
+        self._heartbeat_thread.start()
+
+
+class SuiteDurations(object):
+    """Running times of previous suite runs keyed by suite descriptor."""
+
+    def __init__(self, durations=None):
+        self._durations = durations or {}
+
+    def estimate(self, key):
+        samples = self._durations.get(key)
+        if not samples:
+            return None
+        return float(sum(samples)) / len(samples)
+
+    def record(self, key, running_time):
+        self._append(self._durations, key, running_time)
+
+    @staticmethod
+    def _append(durations, key, running_time):
+        samples = durations.setdefault(key, [])
+        samples.append(running_time)
+        del samples[:-SUITE_DURATIONS_SAMPLES]
+
+
+class FileSuiteDurations(SuiteDurations):
+
+    def __init__(self, durations_path):
+        self._durations_path = durations_path
+        self._durations_lock = fasteners.InterProcessLock(
+            '{}.lock'.format(durations_path))
+        with self._durations_lock:
+            super(FileSuiteDurations, self).__init__(self._load())
+
+    def record(self, key, running_time):
+        with self._durations_lock:
+            durations = self._load()
+            self._append(durations, key, running_time)
+            with open(self._durations_path, 'w') as f:
+                json.dump(durations, f)
+            self._durations = durations
+
+    def _load(self):
+        if not os.path.exists(self._durations_path):
+            return {}
+        with open(self._durations_path, 'r') as f:
+            return json.load(f)
+
+
+class SchedulerEvents(object):
+    """Wakes up an event driven scheduler.
+
+    Suites notify on process exit and the scheduler notifies on environment
+    release, so a freed environment is handed over to the next suite right
+    away instead of on the next scheduling interval.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = False
+
+    def notify(self):
+        with self._condition:
+            self._pending = True
+            self._condition.notify_all()
+
+    def wait(self, timeout):
+        with self._condition:
+            if not self._pending and timeout > 0:
+                self._condition.wait(timeout)
+            self._pending = False
+
+
+class SuitesProgress(object):
+    """Aggregates the progress events published by suite containers.
+
+    Keeps the current phase, test and test results of every suite for the
+    live status and a timeline of all events of the run, written as json
+    to timeline_path.
+    """
+
+    def __init__(self, timeline_path=None):
+        self.timeline_path = timeline_path
+        self.events = []
+        self._suites = {}
+
+    def poll(self, suite):
+        state = self._suites.setdefault(suite.suite_name, {
+            'offset': 0,
+            'last_event': None,
+            'phases': [],
+            'test': None,
+            'results': {},
+            'durations': {}})
+        try:
+            with open(suite.progress_events_path) as f:
+                f.seek(state['offset'])
+                data = f.read()
+        except IOError:
+            return
+        # the last line may still be being written
+        data = data[:data.rfind('\n') + 1]
+        state['offset'] += len(data)
+        for line in data.splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logger.warn('Invalid progress event of suite {0}: {1}'
+                            .format(suite.suite_name, line))
+                continue
+            event['suite'] = suite.suite_name
+            self.events.append(event)
+            self._apply(state, event)
+            state['last_event'] = time.time()
+
+    def last_event(self, suite_name):
+        return self._suites.get(suite_name, {}).get('last_event')
+
+    def phases(self, suite_name):
+        """Phases the suite is in, outermost first."""
+        return list(self._suites.get(suite_name, {}).get('phases', []))
+
+    @staticmethod
+    def _apply(state, event):
+        name = event['event']
+        if name == 'phase_started':
+            state['phases'].append(event['phase'])
+        elif name == 'phase_finished':
+            if event['phase'] in state['phases']:
+                state['phases'].remove(event['phase'])
+            state['durations'][event['phase']] = \
+                state['durations'].get(event['phase'], 0) + event['duration']
+        elif name == 'test_started':
+            state['test'] = event['test']
+        elif name == 'test_finished':
+            state['test'] = None
+            state['results'][event['result']] = \
+                state['results'].get(event['result'], 0) + 1
+
+    def status(self):
+        return {suite_name: {'phase': '/'.join(state['phases']) or None,
+                             'test': state['test'],
+                             'results': state['results'],
+                             'durations': state['durations']}
+                for suite_name, state in self._suites.items()}
+
+    def log_status(self):
+        lines = []
+        for suite_name, status in sorted(self.status().items()):
+            if not status['phase']:
+                continue
+            lines.append('{0}: phase={1}, test={2}, results={3}'.format(
+                suite_name, status['phase'], status['test'],
+                json.dumps(status['results'], sort_keys=True)))
+        if lines:
+            logger.info('Suites progress:\n\t{0}'.format('\n\t'.join(lines)))
+
+    def write_timeline(self):
+        if not self.timeline_path:
+            return
+        tmp_timeline_path = '{0}.tmp'.format(self.timeline_path)
+        with open(tmp_timeline_path, 'w') as f:
+            json.dump({'suites': self.status(),
+                       'events': sorted(self.events,
+                                        key=lambda e: e['time'])},
+                      f, indent=2)
+        os.rename(tmp_timeline_path, self.timeline_path)
+
+
 class SuitesScheduler(object):
     def __init__(self,
                  test_suites,
@@ -339,27 +1018,89 @@ class SuitesScheduler(object):
                  optimize=False,
                  after_suite_callback=None,
                  suite_timeout=-1,
-                 environments=None):
+                 environments=None,
+                 event_driven=False,
+                 durations=None,
+                 progress=None,
+                 idle_timeout=-1):
+        self._handler_configurations = handler_configurations
+        self._tags_index = self._build_tags_index(handler_configurations)
+        self._matches_cache = {}
+        self._durations = durations
+        self._progress = progress
         self._test_suites = test_suites
         if optimize:
+            # longest processing time first, suites with a specific
+            # handler configuration first among suites of equal length
             self._test_suites = sorted(
                 test_suites,
-                key=lambda x: x.handler_configuration is None)
-        self._handler_configurations = handler_configurations
+                key=lambda x: (-self._estimated_duration(x),
+                               x.handler_configuration is None))
         self._environments = environments or InMemoryEnvironments()
         self._scheduling_interval = scheduling_interval
         self._after_suite_callback = after_suite_callback
         self._suite_timeout = suite_timeout
+        # suites making no progress for idle_timeout seconds are timed out,
+        # suites may override both timeouts with timeout and idle_timeout
+        self._idle_timeout = idle_timeout
+        # in event driven mode scheduling_interval is only a fallback for
+        # events the scheduler cannot observe (e.g. environments released
+        # by other suites runner processes)
+        self._events = SchedulerEvents() if event_driven else None
+        if self._events:
+            for suite in self._test_suites:
+                suite.events = self._events
         self._validate()
         self._log_test_suites()
         self.timed_out_suites = []
         self.failed_suites = []
+        self.predicted_makespan = self._predict_makespan()
+        self.makespan = None
 
     def _log_test_suites(self):
         output = {x.suite_name: x.suite_def for x in self._test_suites}
         logger.info('SuitesScheduler initialized with the following suites'
                     ':\n{0}'.format(json.dumps(output, indent=2)))
 
+    @staticmethod
+    def _duration_key(suite):
+        return suite.descriptor or suite.suite_name
+
+    def _estimated_duration(self, suite):
+        if not self._durations:
+            return 0
+        estimate = self._durations.estimate(self._duration_key(suite))
+        if estimate is not None:
+            return estimate
+        # suites without history are assumed to take as long as an
+        # average suite with history
+        known = [self._durations.estimate(self._duration_key(s))
+                 for s in self._test_suites]
+        known = [k for k in known if k is not None]
+        return float(sum(known)) / len(known) if known else 0
+
+    def _predict_makespan(self):
+        """Simulates the scheduling order on the matching environments.
+
+        Every suite is placed on the matching environment that frees up
+        first, which is what the scheduler does at runtime when suites take
+        their estimated durations.
+        """
+        if not self._durations:
+            return None
+        env_available_at = {}
+        makespan = 0
+        for suite in self._test_suites:
+            envs = set(c['env'] for c in
+                       self._find_matching_handler_configurations(
+                           suite).values())
+            env = min(envs, key=lambda e: (env_available_at.get(e, 0), e))
+            end = env_available_at.get(env, 0) + \
+                self._estimated_duration(suite)
+            env_available_at[env] = end
+            makespan = max(makespan, end)
+        return makespan
+
     def _validate(self):
         for suite in self._test_suites:
             if not self._find_matching_handler_configurations(suite):
@@ -371,6 +1112,8 @@ class SuitesScheduler(object):
         logger.info('Test suites scheduler started')
         suites_list = self._test_suites
         while len(suites_list) > 0:
+            # idle timeouts are checked against up to date progress
+            self._update_progress(suites_list)
             logger.info('Current suites in scheduler: {0}'.format(
                 ', '.join(
                     ['{0} [started={1}]'.format(
@@ -379,31 +1122,8 @@ class SuitesScheduler(object):
             remaining_suites = []
             for suite in suites_list:
                 logger.info('Processing suite: {0}'.format(suite.suite_name))
-                # Run suite
+                # Suite is pending
                 if not suite.started:
-                    matches = self._find_matching_handler_configurations(suite)
-                    config_names = matches.keys()
-                    random.shuffle(config_names)
-                    logger.info(
-                        'Matching handler configurations for {0} are: {1}'
-                        .format(suite.suite_name, ', '.join(config_names)))
-                    for name in config_names:
-                        configuration = matches[name]
-                        if self._environments.lock(configuration['env']):
-                            suite.handler_configuration = (name,
-                                                           configuration)
-                            suite.started = time.time()
-                            logger.info(
-                                'Suite {0} will run using handler '
-                                'configuration: {1}'.format(
-                                        suite.suite_name,
-                                        suite.handler_configuration))
-                            suite.run()
-                            break
-                    else:
-                        logger.info(
-                            'All matching handler configurations for {0} '
-                            'are currently taken'.format(suite.suite_name))
                     remaining_suites.append(suite)
                 # Suite terminated
                 elif not suite.is_running:
@@ -412,29 +1132,154 @@ class SuitesScheduler(object):
                     self._after_suite(suite)
                     if suite.failed:
                         self.failed_suites.append(suite)
-                # Suite timed out
-                elif self._suite_timeout != -1 \
-                        and suite.running_time > self._suite_timeout:
-                    self.timed_out_suites.append(suite)
-                    suite.timed_out = True
-                    config = self._handler_configurations[
-                        suite.handler_configuration]
-                    logger.warn(
-                        'Suite timed out: {0} [handler_configuration={1}, '
-                        'suite_running_time={2}s]'.format(
-                            suite.suite_name,
-                            config,
-                            int(suite.running_time)))
-                    self._after_suite(suite)
-                # Suite is running
                 else:
-                    remaining_suites.append(suite)
+                    timeout_reason = self._timeout_reason(suite)
+                    # Suite timed out
+                    if timeout_reason:
+                        self._time_out_suite(suite, timeout_reason)
+                    # Suite is running
+                    else:
+                        remaining_suites.append(suite)
+            # Run suites, environments released above are already available
+            self._start_pending_suites(remaining_suites)
             suites_list = remaining_suites
-            time.sleep(self._scheduling_interval)
+            if suites_list:
+                self._wait(suites_list)
+        self._update_progress(suites_list)
+        self._log_makespan()
         logger.info('Test suites scheduler stopped')
 
+    def _start_pending_suites(self, suites_list):
+        pending = [(suite, self._find_matching_handler_configurations(suite))
+                   for suite in suites_list if not suite.started]
+        unavailable_envs = set(
+            self._handler_configurations[s.handler_configuration]['env']
+            for s in suites_list if s.started)
+        while pending:
+            assignment = match_suites_to_environments(pending,
+                                                      unavailable_envs)
+            lock_failed = False
+            for suite, name in assignment:
+                configuration = self._handler_configurations[name]
+                env_id = configuration['env']
+                unavailable_envs.add(env_id)
+                # environments may also be locked by other suites runners
+                if not self._environments.lock(env_id):
+                    lock_failed = True
+                    continue
+                suite.handler_configuration = (name, configuration)
+                suite.started = time.time()
+                logger.info(
+                    'Suite {0} will run using handler '
+                    'configuration: {1}'.format(
+                            suite.suite_name,
+                            suite.handler_configuration))
+                suite.run()
+            pending = [(suite, matches) for suite, matches in pending
+                       if not suite.started]
+            if not lock_failed:
+                break
+        for suite, matches in pending:
+            logger.info(
+                'All matching handler configurations for {0} '
+                'are currently taken [configurations={1}]'.format(
+                    suite.suite_name, ', '.join(matches.keys())))
+
+    def _log_makespan(self):
+        started = [s.started for s in self._test_suites if s.started]
+        terminated = [s.terminated for s in self._test_suites
+                      if s.terminated]
+        if started and terminated:
+            self.makespan = max(terminated) - min(started)
+        if self.predicted_makespan is not None:
+            logger.info('Suites makespan [predicted={0}s, actual={1}s]'.format(
+                int(self.predicted_makespan), int(self.makespan or 0)))
+
+    def _update_progress(self, suites_list):
+        if not self._progress:
+            return
+        for suite in suites_list:
+            if suite.started:
+                self._progress.poll(suite)
+        self._progress.log_status()
+        try:
+            self._progress.write_timeline()
+        except Exception as e:
+            logger.error('Failed writing suites timeline - error: {0}'
+                         .format(str(e)))
+
+    def _wait(self, suites_list):
+        if not self._events:
+            time.sleep(self._scheduling_interval)
+            return
+        timeout = self._scheduling_interval
+        deadlines = [self._deadline(s) for s in suites_list if s.started]
+        deadlines = [d - time.time() for d in deadlines if d is not None]
+        if deadlines:
+            timeout = min([timeout] + deadlines)
+        self._events.wait(max(timeout, 0))
+
+    def _suite_timeouts(self, suite):
+        timeout = suite.suite_def.get('timeout', self._suite_timeout)
+        idle_timeout = suite.suite_def.get('idle_timeout', self._idle_timeout)
+        if isinstance(idle_timeout, dict):
+            # budgets of the innermost phase the suite is in apply
+            phases = self._progress.phases(suite.suite_name) \
+                if self._progress else []
+            for phase in reversed(phases):
+                if phase in idle_timeout:
+                    idle_timeout = idle_timeout[phase]
+                    break
+            else:
+                idle_timeout = idle_timeout.get('default', self._idle_timeout)
+        return timeout, idle_timeout
+
+    def _last_activity(self, suite):
+        # container output or progress events, whichever came last
+        activity = [suite.started, suite.container_log.last_write]
+        if self._progress:
+            activity.append(self._progress.last_event(suite.suite_name))
+        return max(a for a in activity if a is not None)
+
+    def _deadline(self, suite):
+        timeout, idle_timeout = self._suite_timeouts(suite)
+        deadlines = []
+        if timeout != -1:
+            deadlines.append(suite.started + timeout)
+        if idle_timeout != -1:
+            deadlines.append(self._last_activity(suite) + idle_timeout)
+        return min(deadlines) if deadlines else None
+
+    def _timeout_reason(self, suite):
+        timeout, idle_timeout = self._suite_timeouts(suite)
+        if timeout != -1 and suite.running_time > timeout:
+            return 'timed out after {0} seconds'.format(
+                int(suite.running_time))
+        if idle_timeout != -1:
+            idle_time = time.time() - self._last_activity(suite)
+            if idle_time > idle_timeout:
+                return 'made no progress for {0} seconds'.format(
+                    int(idle_time))
+        return None
+
+    def _time_out_suite(self, suite, timeout_reason):
+        self.timed_out_suites.append(suite)
+        suite.timed_out = True
+        suite.timeout_reason = timeout_reason
+        config = self._handler_configurations[suite.handler_configuration]
+        logger.warn(
+            'Suite timed out: {0} [handler_configuration={1}, '
+            'suite_running_time={2}s, reason={3}]'.format(
+                suite.suite_name,
+                config,
+                int(suite.running_time),
+                suite.timeout_reason))
+        self._after_suite(suite)
+
     def _after_suite(self, suite):
         suite.terminated = time.time()
+        if self._progress:
+            self._progress.poll(suite)
         try:
             if self._after_suite_callback:
                 logger.info(
@@ -445,11 +1290,29 @@ class SuitesScheduler(object):
             logger.error(
                 'After suite callback failed for suite: {0} - '
                 'error: {1}'.format(suite.suite_name, str(e)))
+        if self._durations:
+            try:
+                self._durations.record(self._duration_key(suite),
+                                       suite.running_time)
+            except Exception as e:
+                logger.error(
+                    'Failed recording running time of suite: {0} - '
+                    'error: {1}'.format(suite.suite_name, str(e)))
         config = self._handler_configurations.get(suite.handler_configuration)
         if config:
             self._environments.release(config['env'])
+            if self._events:
+                self._events.notify()
 
     def _find_matching_handler_configurations(self, suite):
+        # matches never change after validation
+        matches = self._matches_cache.get(suite.suite_name)
+        if matches is None:
+            matches = self._match_handler_configurations(suite)
+            self._matches_cache[suite.suite_name] = matches
+        return matches
+
+    def _match_handler_configurations(self, suite):
         if suite.handler_configuration:
             config = self._handler_configurations.get(
                 suite.handler_configuration)
@@ -458,26 +1321,100 @@ class SuitesScheduler(object):
                     self._handler_configurations[suite.handler_configuration]
             } if config else {}
 
-        def tags_match(x, y):
-            return set(x) & set(y) == set(x)
+        postings = sorted([self._tags_index.get(tag, set())
+                           for tag in set(suite.requires)], key=len)
+        if postings:
+            names = set.intersection(*postings)
+        else:
+            names = self._handler_configurations.keys()
+        return {name: self._handler_configurations[name] for name in names}
 
-        return {
-            k: v for k, v in self._handler_configurations.iteritems()
-            if tags_match(suite.requires, v.get('tags', set()))
-        }
+    @staticmethod
+    def _build_tags_index(handler_configurations):
+        tags_index = {}
+        for name, config in handler_configurations.iteritems():
+            for tag in set(config.get('tags', ())):
+                tags_index.setdefault(tag, set()).add(name)
+        return tags_index
+
+
+def match_suites_to_environments(pending, unavailable_envs=()):
+    """Assigns pending suites to environments, one suite per environment.
+
+    Finds a maximum bipartite matching between suites and environments
+    using augmenting paths, so a suite with broad requirements does not
+    take the only environment a narrowly tagged suite can use. Suites are
+    processed in priority order and a matched suite is never unmatched by
+    a later one, so earlier suites are preferred among maximum matchings.
+
+    :param pending: list of (suite, matching handler configurations) in
+                    priority order.
+    :param unavailable_envs: environment ids that cannot be assigned.
+    :return: list of (suite, handler configuration name) in priority order.
+    """
+    candidates = {}
+    for suite, matches in pending:
+        names = [name for name in matches
+                 if matches[name]['env'] not in unavailable_envs]
+        # spread suites across equally suitable environments
+        random.shuffle(names)
+        candidates[suite.suite_name] = [(name, matches[name]['env'])
+                                        for name in names]
+    env_owners = {}
+
+    def augment(suite, visited):
+        for name, env_id in candidates[suite.suite_name]:
+            if env_id in visited:
+                continue
+            visited.add(env_id)
+            owner = env_owners.get(env_id)
+            if owner is None or augment(owner[0], visited):
+                env_owners[env_id] = (suite, name)
+                return True
+        return False
+
+    for suite, _ in pending:
+        augment(suite, set())
+    assigned = dict((suite.suite_name, name)
+                    for suite, name in env_owners.values())
+    return [(suite, assigned[suite.suite_name]) for suite, _ in pending
+            if suite.suite_name in assigned]
 
 
 class SuitesRunner(object):
 
-    def __init__(self, variables_path, descriptor):
+    def __init__(self, variables_path, descriptor,
+                 launcher=VAGRANT_LAUNCHER, share_payload=False,
+                 prebake_virtualenv=False, git_mirrors=False,
+                 shallow_clones=False, merge_xunit_reports=False,
+                 idle_timeout=SUITE_IDLE_TIMEOUT, legacy_environments=True):
+        if launcher not in LAUNCHERS:
+            raise ValueError('Unknown suites launcher: {0} (expected one of: '
+                             '{1})'.format(launcher, ', '.join(LAUNCHERS)))
         self.descriptor = descriptor
         self.variables_path = variables_path
+        self.launcher = launcher
+        self.share_payload = share_payload
+        self.prebake_virtualenv = prebake_virtualenv
+        self.git_mirrors = GitMirrors(
+            os.path.join(sys.prefix, 'git-mirrors')) if git_mirrors else None
+        self.shallow_clones = shallow_clones
+        self.merge_xunit_reports = merge_xunit_reports
+        self.idle_timeout = idle_timeout
+        self.legacy_environments = legacy_environments
         self.suites_yaml = None
         self.envs_dir = path.getcwd() / SUITE_ENVS_DIR
+        self.shared_payload_dir = None
+        self.docker_image = DOCKER_IMAGE
 
     def setenv(self):
         if os.path.exists(self.envs_dir):
             shutil.rmtree(self.envs_dir)
+        if self.share_payload:
+            # staged once, suites link or mount it instead of copying it
+            self.shared_payload_dir = self.envs_dir / SHARED_PAYLOAD_DIR
+            self.shared_payload_dir.makedirs()
+            copy_payload(path.getcwd(), self.shared_payload_dir)
 
         if not reports_dir.exists():
             reports_dir.mkdir()
@@ -505,6 +1442,12 @@ class SuitesRunner(object):
                 raise AssertionError(
                     'Suite: {0} does not have "requires" or '
                     '""handler_configuration" specified'.format(suite_name))
+            parallel_groups = suite.get('parallel_groups')
+            if not _valid_parallel_groups(parallel_groups):
+                raise AssertionError(
+                    'Suite: {0} has "parallel_groups" set to {1!r}, expected '
+                    'true or a positive number'.format(suite_name,
+                                                       parallel_groups))
         for name, configuration in self.suites_yaml[
                 'handler_configurations'].iteritems():
             if 'env' not in configuration:
@@ -514,18 +1457,36 @@ class SuitesRunner(object):
 
     def run_suites(self):
         self.build_docker_image()
+        if self.prebake_virtualenv:
+            self.build_virtualenv_docker_image()
+        if self.git_mirrors:
+            self.refresh_git_mirrors()
         variables = self.suites_yaml.get('variables', {})
         test_suites = [
             TestSuite(suite_name=suite_name,
                       suite_def=suite_def,
                       suite_work_dir=self.envs_dir / suite_name,
-                      variables=variables) for suite_name, suite_def in
+                      variables=variables,
+                      docker_image=self.docker_image,
+                      launcher=self.launcher,
+                      shared_payload_dir=self.shared_payload_dir,
+                      git_mirrors_dir=self.git_mirrors.mirrors_dir
+                      if self.git_mirrors else None,
+                      shallow_clones=self.shallow_clones,
+                      merge_xunit_reports=self.merge_xunit_reports)
+            for suite_name, suite_def in
             self.suites_yaml['test_suites'].iteritems()]
-        environments_path = os.path.join(sys.prefix, 'environments.json')
-        environments = FileEnvironments(
-            locked_environments_path=environments_path)
+        environments = LockFileEnvironments(
+            locks_dir=os.path.join(sys.prefix, 'environments'),
+            legacy_environments=FileEnvironments(
+                os.path.join(sys.prefix, 'environments.json'))
+            if self.legacy_environments else None)
         logger.info('Pruning environments before suites run')
         environments.prune()
+        durations = FileSuiteDurations(
+            durations_path=os.path.join(sys.prefix, 'suite-durations.json'))
+        progress = SuitesProgress(
+            timeline_path=reports_dir / 'suites-timeline.json')
 
         def sigterm_handler(num, frame):
             logger.info('Pruning environments on sigterm')
@@ -539,10 +1500,14 @@ class SuitesRunner(object):
             test_suites=test_suites,
             handler_configurations=self.suites_yaml['handler_configurations'],
             scheduling_interval=SCHEDULER_INTERVAL,
+            event_driven=True,
             optimize=True,
             after_suite_callback=TestSuite.after_suite,
-            suite_timeout=60 * 60 * 5,
-            environments=environments)
+            suite_timeout=SUITE_TIMEOUT,
+            idle_timeout=self.idle_timeout,
+            environments=environments,
+            durations=durations,
+            progress=progress)
         scheduler.run()
         if scheduler.failed_suites or scheduler.timed_out_suites:
             logger.warn('Failed test suites: {0}'.format(
@@ -556,12 +1521,16 @@ class SuitesRunner(object):
 
     @staticmethod
     def prune_containers(include_self=False):
-        container_ids = sh.docker.ps(a=True, q=True).stdout.strip()
-        container_ids = [c.strip() for c in container_ids.split(os.linesep)
-                         if c.strip()]
-        for container_id in container_ids:
-            container_name = sh.docker.ps(filter='id={0}'.format(container_id),
-                                          format='{{.Names}}').stdout.strip()
+        start = time.time()
+        containers = sh.docker.ps(
+            a=True, no_trunc=True,
+            format='{{.ID}} {{.Names}}').stdout.strip()
+        candidates = {}
+        for line in containers.split(os.linesep):
+            split_line = line.strip().split(' ', 1)
+            if len(split_line) < 2:
+                continue
+            container_id, container_name = split_line
             split_container_name = container_name.split('_', 1)
             if len(split_container_name) < 2:
                 continue
@@ -569,24 +1538,201 @@ class SuitesRunner(object):
                 pid = int(split_container_name[0])
             except ValueError:
                 continue
-            current_pid = os.getpid()
-            if ((include_self and pid == current_pid) or
-                    not is_pid_of_suites_runner(pid)):
-                kill_container(container_id)
+            candidates[container_id] = pid
+        live_pids = get_suites_runner_pids(set(candidates.values()))
+        current_pid = os.getpid()
+        dead_containers = [
+            c for c, p in candidates.items()
+            if (include_self and p == current_pid) or p not in live_pids]
+        kill_containers(dead_containers)
+        logger.info('Pruned {0} containers in {1:.2f} seconds'.format(
+            len(dead_containers), time.time() - start))
 
     def build_docker_image(self):
-        docker.build(
-                ['-t',
-                 '{0}:{1}'.format(DOCKER_REPOSITORY, DOCKER_TAG), '.']).wait()
-        docker_image_id = self._get_docker_image_id()
-        if not docker_image_id:
-            raise RuntimeError(
-                    'Docker image not found after docker image was built.')
+        self.docker_image = '{0}:{1}-{2}'.format(
+            DOCKER_REPOSITORY, DOCKER_TAG, self._docker_build_inputs_hash())
+        self._remove_least_recently_used_docker_images(self.docker_image)
+        if self._get_docker_image_id(self.docker_image):
+            logger.info('Docker image {0} is up to date, skipping '
+                        'build'.format(self.docker_image))
+        else:
+            docker.build(['-t', self.docker_image, '.']).wait()
+            if not self._get_docker_image_id(self.docker_image):
+                raise RuntimeError(
+                        'Docker image not found after docker image was '
+                        'built.')
+
+    def refresh_git_mirrors(self):
+        """Fetches the mirrors of all public repositories the suites clone.
+
+        Private repositories are not mirrored so their credentials are not
+        kept on the host, suites clone them from github as before.
+        """
+        repos = set(('cloudify-cosmo', repo) for repo in SUITE_REPOS)
+        for external in self._suites_externals():
+            if external.get('private'):
+                continue
+            repo = external['repo']
+            organization = external.get('organization', 'cloudify-cosmo')
+            if '{{' in repo or '{{' in organization:
+                continue
+            repos.add((organization, repo))
+        start = time.time()
+        for organization, repo in sorted(repos):
+            url = 'https://github.com/{0}/{1}'.format(organization, repo)
+            try:
+                self.git_mirrors.refresh(url, repo, organization)
+            except sh.ErrorReturnCode as e:
+                # suites clone repositories without a mirror from github
+                logger.warn('Failed refreshing git mirror of {0}: {1}'.format(
+                    url, str(e)))
+        logger.info('Refreshed {0} git mirrors in {1:.2f} seconds'.format(
+            len(repos), time.time() - start))
+
+    def _suites_externals(self):
+        tests = self.suites_yaml.get('tests', {})
+        configurations = self.suites_yaml['handler_configurations']
+        for suite in self.suites_yaml['test_suites'].values():
+            for test in suite.get('tests', []):
+                if isinstance(tests.get(test), dict) and \
+                        'external' in tests[test]:
+                    yield tests[test]['external']
+            if suite.get('handler_configuration'):
+                names = [suite['handler_configuration']]
+            else:
+                requires = set(suite.get('requires', []))
+                names = [name for name, config in configurations.items()
+                         if requires <= set(config.get('tags', []))]
+            for name in names:
+                if 'external' in configurations.get(name, {}):
+                    yield configurations[name]['external']
+
+    def build_virtualenv_docker_image(self):
+        """Builds an image with the suites virtualenv installed in /venv.
+
+        The image is derived from the test image and keyed by the commits
+        the core, cli and system tests branches point to, so it is built
+        once per run and then shared by all suites using these branches.
+        Wheels of everything installed are kept in /wheelhouse for offline
+        installs.
+        """
+        variables = self.suites_yaml.get('variables', {})
+        core_branch = variables['core_branch']
+        # installed by the cli dev requirements from branch archives, their
+        # commits rebuild the image (and its docker layers) when they move
+        core_revisions = ' '.join(
+            '{0}={1}'.format(repo, resolve_revision(repo, core_branch))
+            for repo in VIRTUALENV_CORE_REPOS)
+        values = {
+            'base_image': self.docker_image,
+            'core_revisions': core_revisions,
+            'cli_revision': resolve_revision(
+                'cloudify-cli', variables.get('cli_branch', core_branch)),
+            'system_tests_revision': resolve_revision(
+                'cloudify-system-tests', variables['system_tests_branch'])
+        }
+        digest = hashlib.sha1()
+        for key in sorted(values):
+            digest.update('{0}={1}'.format(key, values[key]))
+        for file_name in ['requirements.txt', VIRTUALENV_DOCKERFILE_TEMPLATE]:
+            digest.update(path(file_name).bytes())
+        docker_image = '{0}:{1}-{2}'.format(
+            DOCKER_REPOSITORY, VIRTUALENV_DOCKER_TAG,
+            digest.hexdigest()[:12])
+        self._remove_least_recently_used_docker_images(docker_image)
+        if self._get_docker_image_id(docker_image):
+            logger.info('Virtualenv docker image {0} is up to date, skipping '
+                        'build'.format(docker_image))
+        else:
+            build_dir = path(tempfile.mkdtemp(prefix='venv-image-'))
+            try:
+                for file_name in ['requirements.txt',
+                                  'wheel-requirements.txt']:
+                    path(file_name).copy(build_dir / file_name)
+                (build_dir / 'Dockerfile').write_text(jinja2.Template(
+                    path(VIRTUALENV_DOCKERFILE_TEMPLATE).text()).render(
+                        values))
+                docker.build(['-t', docker_image, build_dir]).wait()
+            finally:
+                build_dir.rmtree_p()
+            if not self._get_docker_image_id(docker_image):
+                raise RuntimeError(
+                        'Docker image not found after virtualenv docker image '
+                        'was built.')
+        self.docker_image = docker_image
+
+    @staticmethod
+    def _docker_build_inputs_hash():
+        digest = hashlib.sha1()
+        for file_name in DOCKER_BUILD_INPUTS:
+            digest.update(file_name)
+            digest.update(path(file_name).bytes())
+        return digest.hexdigest()[:12]
+
+    @staticmethod
+    def _remove_least_recently_used_docker_images(docker_image):
+        """Marks an image as used by this suites runner and removes the
+        least recently used images of its kind.
+
+        Images used by live suites runners are kept, another runner may
+        still start suites from them. Called before an image is built, so
+        another runner does not remove it in between.
+        """
+        images_path = os.path.join(sys.prefix, 'docker-images.json')
+        with fasteners.InterProcessLock('{}.lock'.format(images_path)):
+            if os.path.exists(images_path):
+                with open(images_path, 'r') as f:
+                    used = json.load(f)
+            else:
+                used = {}
+            for image, usage in used.items():
+                # files written before runners were tracked hold times only
+                if not isinstance(usage, dict):
+                    used[image] = {'last_used': usage, 'pids': []}
+            current_pid = os.getpid()
+            live_pids = get_suites_runner_pids(
+                set(pid for usage in used.values() for pid in usage['pids']))
+            live_pids.add(current_pid)
+            for usage in used.values():
+                usage['pids'] = [p for p in usage['pids'] if p in live_pids]
+            usage = used.setdefault(docker_image, {'pids': []})
+            usage['last_used'] = time.time()
+            if current_pid not in usage['pids']:
+                usage['pids'].append(current_pid)
+            # images of each kind (env, venv) are collected separately
+            kind = docker_image.rsplit('-', 1)[0]
+            # the fixed tag images had before they were keyed by their build
+            # inputs is not recorded, it is the least recently used one
+            if kind == DOCKER_IMAGE and DOCKER_IMAGE not in used and \
+                    SuitesRunner._get_docker_image_id(DOCKER_IMAGE):
+                used[DOCKER_IMAGE] = {'last_used': 0, 'pids': []}
+            images = sorted([i for i in used
+                             if i.rsplit('-', 1)[0] == kind],
+                            key=lambda i: used[i]['last_used'], reverse=True)
+            for image in images[DOCKER_IMAGES_TO_KEEP:]:
+                if used[image]['pids']:
+                    logger.info('Keeping docker image {0}, used by suites '
+                                'runners {1}'.format(image,
+                                                     used[image]['pids']))
+                    continue
+                logger.info('Removing least recently used docker image: '
+                            '{0}'.format(image))
+                try:
+                    sh.docker.rmi(image)
+                except sh.ErrorReturnCode as e:
+                    # still used by containers of another suites runner,
+                    # keep it for a later run
+                    logger.warn('Failed removing docker image {0}: {1}'
+                                .format(image, str(e)))
+                    continue
+                del used[image]
+            with open(images_path, 'w') as f:
+                json.dump(used, f)
 
     @staticmethod
-    def _get_docker_image_id():
+    def _get_docker_image_id(docker_image):
         image_ids = [line for line in sh.docker.images(
-                ['-q', DOCKER_REPOSITORY]).strip().split(os.linesep)
+                ['-q', docker_image]).strip().split(os.linesep)
                  if len(line) > 0]
         if len(image_ids) > 1:
             raise RuntimeError(
@@ -599,6 +1745,151 @@ def kill_container(container_name):
     docker.rm('-f', container_name).wait()
 
 
+def _valid_parallel_groups(parallel_groups):
+    # unset, a boolean, or the number of groups to run concurrently
+    if parallel_groups is None or isinstance(parallel_groups, bool):
+        return True
+    return isinstance(parallel_groups, int) and parallel_groups > 0
+
+
+def resolve_revision(repo, branch, organization='cloudify-cosmo'):
+    """Returns the commit a branch points to, or the branch itself."""
+    try:
+        refs = sh.git('ls-remote', 'https://github.com/{0}/{1}'.format(
+            organization, repo), branch).stdout.strip()
+    except sh.ErrorReturnCode as e:
+        logger.warn('Failed resolving {0} branch of {1}: {2}'.format(
+            branch, repo, str(e)))
+        return branch
+    return refs.split()[0] if refs else branch
+
+
+def copy_payload(source_dir, target_dir):
+    for name in SUITE_PAYLOAD:
+        source = os.path.join(source_dir, name)
+        target = os.path.join(target_dir, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copy(source, target)
+
+
+def link_payload(source_dir, target_dir):
+    """Hardlinks the payload files, only directories are created.
+
+    Falls back to copying files that cannot be linked (e.g. when the
+    target is on another file system).
+    """
+    def link(source, target):
+        if os.path.isdir(source):
+            os.makedirs(target)
+            for name in os.listdir(source):
+                link(os.path.join(source, name), os.path.join(target, name))
+        else:
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+    for name in SUITE_PAYLOAD:
+        link(os.path.join(source_dir, name), os.path.join(target_dir, name))
+
+
+def write_xunit_report(reports, report_file, suite_name):
+    """Writes xunit reports to report_file, adding the suite name as a
+    suffix to the name of each test.
+
+    Reports are parsed and written incrementally, one test at a time, so
+    memory does not grow with the size of the reports. Several reports
+    are merged into a single testsuite, with the attributes of the first
+    report and the counters and time of all of them summed.
+    """
+    import lxml.etree as et
+    # merged counters must be known before the first test is written
+    attributes = {}
+    for report in reports:
+        for name, value in _xunit_testsuite_attributes(report).items():
+            if name not in attributes:
+                attributes[name] = value
+            elif name in XUNIT_TESTSUITE_COUNTERS:
+                attributes[name] = str(int(attributes[name]) + int(value))
+            elif name == 'time':
+                attributes[name] = '{0:.3f}'.format(
+                    float(attributes[name]) + float(value))
+    tmp_report_file = '{0}.tmp'.format(report_file)
+    with et.xmlfile(tmp_report_file, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('testsuite', attributes):
+            for report in reports:
+                with open(report.realpath(), 'rb') as f:
+                    _write_xunit_testcases(xf, f, suite_name)
+    os.rename(tmp_report_file, report_file)
+
+
+def _write_xunit_testcases(xf, report, suite_name):
+    import lxml.etree as et
+    root = None
+    for event, element in et.iterparse(report,
+                                       events=('start', 'end'),
+                                       strip_cdata=False,
+                                       huge_tree=True):
+        if root is None:
+            root = element
+        if event != 'end' or element.getparent() is not root:
+            continue
+        if element.tag == 'testcase':
+            element.set('name', '{0} @ {1}'.format(
+                element.get('name'), suite_name))
+        xf.write(element, pretty_print=True)
+        # drop written elements to keep memory bounded
+        element.clear()
+        while element.getprevious() is not None:
+            del root[0]
+
+
+def _xunit_testsuite_attributes(report):
+    import lxml.etree as et
+    with open(report.realpath(), 'rb') as f:
+        for _, root in et.iterparse(f, events=('start',)):
+            return dict(root.attrib)
+
+
+def kill_containers(container_ids,
+                    batch_size=PRUNE_BATCH_SIZE,
+                    parallelism=PRUNE_PARALLELISM):
+    batches = [container_ids[i:i + batch_size]
+               for i in range(0, len(container_ids), batch_size)]
+    for i in range(0, len(batches), parallelism):
+        processes = []
+        for batch in batches[i:i + parallelism]:
+            logger.info('Killing containers: {0}'.format(', '.join(batch)))
+            processes.append(docker.rm('-f', *batch, _bg=True))
+        for process in processes:
+            try:
+                process.wait()
+            except sh.ErrorReturnCode as e:
+                logger.error('Error on containers kill: {0}'.format(str(e)))
+
+
+def get_suites_runner_pids(pids):
+    """Returns the subset of pids that belong to live suites runners.
+
+    Command lines are read from /proc instead of running ps for every pid,
+    which is only done where /proc is not available.
+    """
+    if not os.path.isdir('/proc'):
+        return set(pid for pid in pids if is_pid_of_suites_runner(pid))
+    live_pids = set()
+    for pid in pids:
+        try:
+            with open('/proc/{0}/cmdline'.format(pid)) as f:
+                cmd = f.read()
+        except IOError:
+            continue
+        if 'suites_runner' in cmd:
+            live_pids.add(pid)
+    return live_pids
+
+
 def is_pid_of_suites_runner(pid):
     try:
         os.kill(int(pid), 0)
@@ -612,8 +1903,20 @@ def is_pid_of_suites_runner(pid):
 
 
 def main():
-    suites_runner = SuitesRunner(variables_path=sys.argv[1],
-                                 descriptor=sys.argv[2])
+    suites_runner = SuitesRunner(
+        variables_path=sys.argv[1],
+        descriptor=sys.argv[2],
+        launcher=os.environ.get(SUITES_LAUNCHER, VAGRANT_LAUNCHER),
+        share_payload=os.environ.get(SUITES_SHARE_PAYLOAD) == 'true',
+        prebake_virtualenv=os.environ.get(SUITES_PREBAKE_VIRTUALENV) == 'true',
+        git_mirrors=os.environ.get(SUITES_GIT_MIRRORS) == 'true',
+        shallow_clones=os.environ.get(SUITES_SHALLOW_CLONES) == 'true',
+        merge_xunit_reports=os.environ.get(
+            SUITES_MERGE_XUNIT_REPORTS) == 'true',
+        idle_timeout=int(os.environ.get(SUITES_IDLE_TIMEOUT,
+                                        SUITE_IDLE_TIMEOUT)),
+        legacy_environments=os.environ.get(
+            SUITES_LEGACY_ENVIRONMENTS) != 'false')
     suites_runner.setenv()
     suites_runner.validate()
     logger.info('Pruning containers before suites run')
@@ -0,0 +1,414 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Micro-benchmarks for the suites runner. Each benchmark verifies the
+# optimized implementation against a baseline one and logs both timings.
+
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+import jinja2
+import lxml.etree as et
+import sh
+from path import path
+
+from suites.suites_runner import ContainersLogs
+from suites.suites_runner import SuitesScheduler
+from suites.suites_runner import TestSuite
+from suites.suites_runner import kill_container
+from suites.suites_runner import docker
+from suites.suites_runner import vagrant
+from suites.suites_runner import FileEnvironments
+from suites.suites_runner import LockFileEnvironments
+from suites.suite_runner import SuiteRunner
+from suites.tests.test_scheduler import MockTestSuite
+from suites.tests.test_manager_state import deepcopy_manager_state_delta
+from cosmo_tester.framework.manager_state import get_manager_state_delta
+
+
+logger = logging.getLogger('suites_benchmarks')
+logger.setLevel(logging.INFO)
+
+
+def _timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def _log_timings(name, baseline, optimized):
+    logger.info('{0}: baseline={1:.4f}s, optimized={2:.4f}s'.format(
+        name, baseline, optimized))
+
+
+class TestTagsMatchingBenchmark(unittest.TestCase):
+
+    configurations_count = 3000
+    suites_count = 100
+    passes = 3
+
+    def setUp(self):
+        rand = random.Random(0)
+        tags = ['tag{0}'.format(i) for i in range(50)]
+        self.handler_configurations = {
+            'config{0}'.format(i): {
+                'env': 'env{0}'.format(i),
+                'tags': rand.sample(tags, rand.randint(2, 8))
+            } for i in range(self.configurations_count)}
+        self.suites = [
+            MockTestSuite(suite_name='suite{0}'.format(i),
+                          suite_def={'requires': rand.sample(tags, 2)},
+                          suite_work_dir=path('/tmp'),
+                          variables={})
+            for i in range(self.suites_count)]
+
+    def _naive_matches(self, suite):
+        def tags_match(x, y):
+            return set(x) & set(y) == set(x)
+        return {
+            k: v for k, v in self.handler_configurations.iteritems()
+            if tags_match(suite.requires, v.get('tags', set()))
+        }
+
+    def test_tags_matching(self):
+        def naive():
+            for _ in range(self.passes):
+                result = [self._naive_matches(suite)
+                          for suite in self.suites]
+            return result
+
+        def indexed():
+            scheduler = SuitesScheduler(self.suites,
+                                        self.handler_configurations)
+            for _ in range(self.passes):
+                result = [scheduler._find_matching_handler_configurations(
+                    suite) for suite in self.suites]
+            return result
+
+        naive_result, naive_time = _timed(naive)
+        indexed_result, indexed_time = _timed(indexed)
+        _log_timings('Tags matching [configurations={0}, suites={1}, '
+                     'passes={2}]'.format(self.configurations_count,
+                                          self.suites_count,
+                                          self.passes),
+                     naive_time, indexed_time)
+        self.assertEqual(naive_result, indexed_result)
+
+
+def _lock_and_release(environments, env_ids, iterations):
+    for _ in range(iterations):
+        for env_id in env_ids:
+            if environments.lock(env_id):
+                environments.release(env_id)
+
+
+class TestEnvironmentsContentionBenchmark(unittest.TestCase):
+
+    processes_count = 8
+    envs_per_process = 5
+    iterations = 50
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+    def _run_processes(self, environments):
+        processes = [
+            multiprocessing.Process(
+                target=_lock_and_release,
+                args=(environments,
+                      ['ENV{0}_{1}'.format(i, j)
+                       for j in range(self.envs_per_process)],
+                      self.iterations))
+            for i in range(self.processes_count)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(0, process.exitcode)
+
+    def test_environments_contention(self):
+        file_environments = FileEnvironments(
+            os.path.join(self.work_dir, 'environments.json'))
+        lock_file_environments = LockFileEnvironments(
+            os.path.join(self.work_dir, 'environments'))
+        _, file_time = _timed(self._run_processes, file_environments)
+        _, lock_file_time = _timed(self._run_processes,
+                                   lock_file_environments)
+        _log_timings('Environments lock/release [processes={0}, '
+                     'envs_per_process={1}, iterations={2}]'.format(
+                         self.processes_count,
+                         self.envs_per_process,
+                         self.iterations),
+                     file_time, lock_file_time)
+        for environments in [file_environments, lock_file_environments]:
+            self.assertTrue(environments.lock('ENV0_0'))
+
+
+@unittest.skipUnless(docker and vagrant, 'docker and vagrant are required')
+class TestSuiteLaunchersBenchmark(unittest.TestCase):
+
+    docker_image = 'ubuntu:14.04'
+    suites_count = 3
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.vagrant_file_template = jinja2.Template(
+            (path(__file__).dirname().dirname() /
+             'Vagrantfile.template').text())
+
+    def _new_suite(self, launcher, index):
+        suite = TestSuite(
+            suite_name='{0}_benchmark_{1}'.format(launcher, index),
+            suite_def={},
+            suite_work_dir=self.work_dir / launcher / str(index),
+            variables={},
+            docker_image=self.docker_image,
+            launcher=launcher)
+        suite.suite_work_dir.makedirs()
+        (suite.suite_work_dir / 'Vagrantfile').write_text(
+            self.vagrant_file_template.render({
+                'suite_name': suite.suite_name,
+                'container_name': suite.container_name,
+                'docker_image': suite.docker_image,
+                'suite': '{}',
+                'variables': '{}',
+                'env': {},
+                'volumes': []}))
+        # a no-op payload, only the container start is measured
+        suite_runner = suite.suite_work_dir / 'suite_runner.sh'
+        suite_runner.write_text('#!/bin/bash\nsleep 1\n')
+        suite_runner.chmod(0o755)
+        return suite
+
+    def _launch_suites(self, suites):
+        for suite in suites:
+            suite._launch()
+
+    def _benchmark(self, launcher):
+        suites = [self._new_suite(launcher, i)
+                  for i in range(self.suites_count)]
+        try:
+            return _timed(self._launch_suites, suites)[1]
+        finally:
+            for suite in suites:
+                kill_container(suite.container_name)
+
+    def test_suite_start_latency(self):
+        vagrant_time = self._benchmark('vagrant')
+        docker_time = self._benchmark('docker')
+        _log_timings('Suites start latency [suites={0}]'.format(
+            self.suites_count), vagrant_time, docker_time)
+
+
+class LinesCounter(object):
+
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, line):
+        self.lines += 1
+
+
+class TestContainersLogsBenchmark(unittest.TestCase):
+    """Runs without docker, local processes stand in for docker logs -f
+    of each suite container."""
+
+    containers_count = 20
+    lines_per_container = 20000
+
+    def _command(self):
+        return ['seq', str(self.lines_per_container)]
+
+    def _wait_for_lines(self, stream):
+        expected = self.containers_count * self.lines_per_container
+        deadline = time.time() + 60
+        while stream.lines < expected and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(expected, stream.lines)
+
+    def _follow_with_reader_threads(self):
+        # as the container logs were followed before, each process with
+        # its own sh reader threads
+        stream = LinesCounter()
+        logs = ContainersLogs(stream=stream)
+        processes = []
+        for i in range(self.containers_count):
+            collect = logs.collector('suite{0}'.format(i))
+            processes.append(sh.Command(self._command()[0])(
+                *self._command()[1:], _bg=True, _out=collect,
+                _err=collect))
+        threads = threading.active_count()
+        for process in processes:
+            process.wait()
+        self._wait_for_lines(stream)
+        return threads
+
+    def _follow_with_single_reader(self):
+        stream = LinesCounter()
+        logs = ContainersLogs(stream=stream)
+        processes = [
+            logs.follow_process(
+                subprocess.Popen(self._command(),
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT,
+                                 close_fds=True),
+                prefix='suite{0}'.format(i))
+            for i in range(self.containers_count)]
+        threads = threading.active_count()
+        for process in processes:
+            process.wait()
+        self._wait_for_lines(stream)
+        return threads
+
+    def test_follow_containers_logs(self):
+        baseline_threads, baseline_time = _timed(
+            self._follow_with_reader_threads)
+        optimized_threads, optimized_time = _timed(
+            self._follow_with_single_reader)
+        name = 'Containers logs [containers={0}, lines={1}]'.format(
+            self.containers_count, self.lines_per_container)
+        _log_timings(name, baseline_time, optimized_time)
+        logger.info('{0}: baseline_threads={1}, optimized_threads={2}'.format(
+            name, baseline_threads, optimized_threads))
+        self.assertLess(optimized_threads, baseline_threads)
+
+
+def _naive_add_missing_tests(report_file_path, expected_tests_file_path):
+    parser = et.XMLParser(strip_cdata=False)
+    run_tests = set()
+    missing_tests = []
+    with open(expected_tests_file_path) as data_file:
+        expected_tests = json.load(data_file)
+    root = et.parse(report_file_path.realpath(), parser)
+    for test in root.findall('testcase'):
+        run_tests.add('{0}.{1}'.format(test.get('classname'),
+                                       test.get('name')))
+    for expected_test in expected_tests:
+        if '{0}.{1}.{2}'.format(expected_test['test_module'],
+                                expected_test['test_class'],
+                                expected_test['test_name']) not in run_tests:
+            missing_tests.append(expected_test)
+    for missing_test in missing_tests:
+        testcase_elem = et.SubElement(root.getroot(), 'testcase',
+                                      classname='{0}.{1}'.format(
+                                          missing_test['test_module'],
+                                          missing_test['test_class']),
+                                      name=missing_test['test_name'])
+        et.SubElement(testcase_elem, 'skipped',
+                      message='Test should have run, but did not')
+        with open(report_file_path, 'w') as report:
+            report.write(et.tostring(root, pretty_print=True))
+
+
+class TestAddMissingTestsBenchmark(unittest.TestCase):
+
+    run_tests_count = 5000
+    missing_tests_count = 1000
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        tests = [{'test_module': 'module{0}'.format(i / 100),
+                  'test_class': 'Test{0}'.format(i / 10),
+                  'test_name': 'test_{0}'.format(i)}
+                 for i in range(self.run_tests_count +
+                                self.missing_tests_count)]
+        self.tests_list_path = self.work_dir / 'tests_list.json'
+        self.tests_list_path.write_text(json.dumps(tests))
+        testsuite = et.Element('testsuite', name='suite',
+                               tests=str(self.run_tests_count))
+        for test in tests[:self.run_tests_count]:
+            et.SubElement(testsuite, 'testcase',
+                          classname='{0}.{1}'.format(test['test_module'],
+                                                     test['test_class']),
+                          name=test['test_name'], time='0.001')
+        self.report = et.tostring(testsuite, pretty_print=True)
+
+    def _report_copy(self, name):
+        report_path = self.work_dir / name
+        report_path.write_text(self.report)
+        return report_path
+
+    def test_add_missing_tests(self):
+        naive_report = self._report_copy('naive-report.xml')
+        report = self._report_copy('report.xml')
+        suite_runner = SuiteRunner.__new__(SuiteRunner)
+        _, naive_time = _timed(_naive_add_missing_tests, naive_report,
+                               self.tests_list_path)
+        _, single_write_time = _timed(suite_runner.add_missing_tests,
+                                      report, self.tests_list_path)
+        _log_timings('Add missing tests [run_tests={0}, missing_tests={1}]'
+                     .format(self.run_tests_count, self.missing_tests_count),
+                     naive_time, single_write_time)
+        self.assertEqual(naive_report.text(), report.text())
+
+
+class TestManagerStateDeltaBenchmark(unittest.TestCase):
+
+    deployments_count = 500
+    instances_per_deployment = 20
+    new_deployments_count = 5
+
+    def _state(self, deployments_count):
+        state = {'blueprints': {}, 'deployments': {}, 'nodes': {},
+                 'node_state': {}, 'deployment_nodes': {}}
+        for i in range(deployments_count):
+            deployment_id = 'deployment{0}'.format(i)
+            state['blueprints']['blueprint{0}'.format(i)] = {
+                'id': 'blueprint{0}'.format(i), 'plan': {'nodes': []}}
+            state['deployments'][deployment_id] = {
+                'id': deployment_id, 'inputs': {'image': 'image'}}
+            state['node_state'][deployment_id] = {}
+            state['deployment_nodes'][deployment_id] = []
+            for j in range(self.instances_per_deployment):
+                node_instance = {
+                    'id': 'node{0}_{1}'.format(i, j),
+                    'deployment_id': deployment_id,
+                    'state': 'started',
+                    'runtime_properties': {
+                        'ip': '10.0.0.{0}'.format(j),
+                        'networks': {'net': ['10.0.0.{0}'.format(j)]},
+                        'cloudify_agent': {'key': 'x' * 256}}}
+                state['nodes'][node_instance['id']] = node_instance
+                state['node_state'][deployment_id][node_instance['id']] = \
+                    node_instance
+                state['deployment_nodes'][deployment_id].append(
+                    node_instance)
+        return state
+
+    def test_manager_state_delta(self):
+        before = self._state(self.deployments_count)
+        after = self._state(self.deployments_count +
+                            self.new_deployments_count)
+        deepcopy_delta, deepcopy_time = _timed(
+            deepcopy_manager_state_delta, before, after)
+        delta, delta_time = _timed(get_manager_state_delta, before, after)
+        _log_timings('Manager state delta [node_instances={0}]'.format(
+            len(after['nodes'])), deepcopy_time, delta_time)
+        self.assertEqual(deepcopy_delta, delta)
+        self.assertEqual(
+            self.new_deployments_count * self.instances_per_deployment,
+            len(delta['nodes']))
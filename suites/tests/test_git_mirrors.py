@@ -0,0 +1,110 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import sh
+from path import path
+
+from suites.helpers.git_mirrors import GitMirrors
+
+
+def _git(*args):
+    return sh.git('-c', 'user.name=test', '-c', 'user.email=test@test',
+                  *args, _tty_out=False).stdout.strip()
+
+
+class TestGitMirrors(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        # a bare repository plays the role of github
+        self.url = self.work_dir / 'remote' / 'repo.git'
+        _git('init', '--bare', self.url)
+        self.source = self.work_dir / 'source'
+        _git('clone', self.url, self.source)
+        self._commit('file1')
+        _git('-C', self.source, 'push', 'origin', 'HEAD:master')
+        _git('-C', self.source, 'checkout', '-b', 'feature')
+        self._commit('file2')
+        _git('-C', self.source, 'push', 'origin', 'feature')
+        self.mirrors = GitMirrors(self.work_dir / 'mirrors')
+
+    def _commit(self, file_name):
+        (self.source / file_name).write_text(file_name)
+        _git('-C', self.source, 'add', file_name)
+        _git('-C', self.source, 'commit', '-m', file_name)
+        return _git('-C', self.source, 'rev-parse', 'HEAD')
+
+    def _clone(self, branch, shallow=False):
+        target = self.work_dir / 'clones' / '{0}-{1}'.format(
+            branch, shallow)
+        self.mirrors.clone(url=self.url,
+                           repo='repo',
+                           target=target,
+                           branch=branch,
+                           organization='org',
+                           shallow=shallow)
+        return target
+
+    def test_refresh_creates_mirror(self):
+        self.assertFalse(self.mirrors.has_mirror('repo', 'org'))
+        self.mirrors.refresh(self.url, 'repo', 'org')
+        self.assertTrue(self.mirrors.has_mirror('repo', 'org'))
+        self.assertEqual(self.work_dir / 'mirrors' / 'org' / 'repo.git',
+                         self.mirrors.mirror_path('repo', 'org'))
+
+    def test_refresh_fetches_new_commits(self):
+        self.mirrors.refresh(self.url, 'repo', 'org')
+        commit = self._commit('file3')
+        _git('-C', self.source, 'push', 'origin', 'feature')
+        self.mirrors.refresh(self.url, 'repo', 'org')
+        target = self._clone('feature')
+        self.assertEqual(commit, _git('-C', target, 'rev-parse', 'HEAD'))
+
+    def test_clone(self):
+        self.mirrors.refresh(self.url, 'repo', 'org')
+        target = self._clone('feature')
+        self.assertTrue((target / 'file2').exists())
+        self.assertEqual(self.url,
+                         _git('-C', target, 'remote', 'get-url', 'origin'))
+        # objects are shared with the mirror, not copied
+        alternates = target / '.git' / 'objects' / 'info' / 'alternates'
+        self.assertTrue(alternates.exists())
+        self.assertEqual(2, len(_git('-C', target, 'log', '--oneline')
+                                .splitlines()))
+
+    def test_shallow_clone(self):
+        self.mirrors.refresh(self.url, 'repo', 'org')
+        target = self._clone('feature', shallow=True)
+        self.assertTrue((target / 'file2').exists())
+        self.assertEqual(1, len(_git('-C', target, 'log', '--oneline')
+                                .splitlines()))
+        self.assertEqual(['origin/feature'],
+                         _git('-C', target, 'branch', '-r').split())
+        self.assertEqual(self.url,
+                         _git('-C', target, 'remote', 'get-url', 'origin'))
+
+    def test_shallow_clone_of_commit(self):
+        self.mirrors.refresh(self.url, 'repo', 'org')
+        commit = _git('-C', self.source, 'rev-parse', 'master')
+        target = self._clone(commit, shallow=True)
+        self.assertEqual(commit, _git('-C', target, 'rev-parse', 'HEAD'))
+        self.assertFalse((target / 'file2').exists())
+        self.assertTrue(os.path.isdir(target / '.git'))
@@ -0,0 +1,560 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import BaseHTTPServer
+import copy
+import json
+import threading
+import unittest
+import urlparse
+
+try:
+    from cloudify_rest_client import CloudifyClient
+    from cloudify_rest_client.exceptions import CloudifyClientError
+except ImportError:
+    CloudifyClient = None
+
+from cosmo_tester.framework.manager_state import get_manager_state
+from cosmo_tester.framework.manager_state import get_manager_state_delta
+from cosmo_tester.framework.manager_state import list_all
+from cosmo_tester.framework.manager_state import ManagerStateTracker
+from cosmo_tester.framework.manager_state import SWEEP_PAGE_SIZE
+
+
+class Resource(dict):
+
+    def __getattr__(self, item):
+        try:
+            return self[item]
+        except KeyError:
+            raise AttributeError(item)
+
+
+class ListResponse(object):
+
+    def __init__(self, items, total=None):
+        self.items = items
+        self.metadata = {}
+        if total is not None:
+            self.metadata['pagination'] = {'total': total}
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class MockResources(object):
+    """A REST resource list call capping pages at max_size."""
+
+    def __init__(self, items, max_size=None, paginated=True):
+        self._items = items
+        self._max_size = max_size
+        self._paginated = paginated
+        self._lock = threading.Lock()
+        self.calls = []
+
+        self.items_count = 0
+
+    def list(self, deployment_id=None, _offset=0, _size=None, _sort=None,
+             _include=None):
+        with self._lock:
+            self.calls.append((deployment_id, _offset, _size))
+        items = [i for i in self._items
+                 if deployment_id in (None, i.get('deployment_id'))]
+        for field in reversed(_sort or []):
+            items.sort(key=lambda i: i[field.lstrip('-')],
+                       reverse=field.startswith('-'))
+        items = [self._project(i, _include) for i in items]
+        total = len(items)
+        if self._paginated:
+            size = min(s for s in [_size, self._max_size, total]
+                       if s is not None)
+            items = items[_offset:_offset + size]
+        with self._lock:
+            self.items_count += len(items)
+        return ListResponse(items, total if self._paginated else None)
+
+    def get(self, resource_id, _include=None):
+        with self._lock:
+            self.items_count += 1
+        resource, = [i for i in self._items if i.id == resource_id]
+        return self._project(resource, _include)
+
+    @staticmethod
+    def _project(resource, _include):
+        if not _include:
+            return resource
+        return Resource((k, resource[k]) for k in _include)
+
+
+class MockExecutions(MockResources):
+
+    def list(self, deployment_id=None, include_system_workflows=False,
+             **kwargs):
+        assert include_system_workflows
+        return super(MockExecutions, self).list(deployment_id, **kwargs)
+
+
+class MockClient(object):
+
+    def __init__(self, deployments_count, instances_per_deployment,
+                 max_size=None):
+        self.instances_per_deployment = instances_per_deployment
+        self.blueprints = MockResources([])
+        self.deployments = MockResources([])
+        self.node_instances = MockResources([], max_size=max_size)
+        self.executions = MockExecutions([])
+        self._clock = 0
+        for i in range(deployments_count):
+            self.add_deployment(i)
+
+    def _now(self):
+        self._clock += 1
+        return self._clock
+
+    def add_deployment(self, i):
+        self.blueprints._items.append(Resource(
+            id='blueprint{0}'.format(i),
+            created_at=self._now()))
+        deployment_id = 'deployment{0}'.format(i)
+        self.deployments._items.append(Resource(
+            id=deployment_id,
+            created_at=self._now()))
+        self.node_instances._items.extend(
+            Resource(id='node{0}_{1}'.format(i, j),
+                     deployment_id=deployment_id,
+                     version=1)
+            for j in range(self.instances_per_deployment))
+        self.add_execution(deployment_id, 'create_deployment_environment')
+
+    def delete_deployment(self, i):
+        blueprint_id = 'blueprint{0}'.format(i)
+        deployment_id = 'deployment{0}'.format(i)
+        self.blueprints._items = [b for b in self.blueprints._items
+                                  if b.id != blueprint_id]
+        self.deployments._items = [d for d in self.deployments._items
+                                   if d.id != deployment_id]
+        self.node_instances._items = [n for n in self.node_instances._items
+                                      if n.deployment_id != deployment_id]
+        self.executions._items = [e for e in self.executions._items
+                                  if e.deployment_id != deployment_id]
+
+    def add_execution(self, deployment_id, workflow_id='install',
+                      status='terminated'):
+        execution = Resource(id='execution{0}'.format(self._now()),
+                             deployment_id=deployment_id,
+                             workflow_id=workflow_id,
+                             status=status,
+                             created_at=self._clock)
+        self.executions._items.append(execution)
+        return execution
+
+    def update_node_instance(self, node_instance_id, **fields):
+        for i, node_instance in enumerate(self.node_instances._items):
+            if node_instance.id == node_instance_id:
+                updated = Resource(node_instance)
+                updated.update(fields, version=node_instance.version + 1)
+                self.node_instances._items[i] = updated
+
+    def items_count(self):
+        return sum(r.items_count for r in
+                   [self.blueprints, self.deployments, self.node_instances,
+                    self.executions])
+
+
+def _per_deployment_manager_state(client):
+    blueprints = dict((b.id, b) for b in client.blueprints.list())
+    deployments = dict((d.id, d) for d in client.deployments.list())
+    nodes = {}
+    deployment_nodes = {}
+    node_state = {}
+    for deployment_id in deployments:
+        deployment_nodes[deployment_id] = client.node_instances.list(
+            deployment_id).items
+        node_state[deployment_id] = {}
+        for node in deployment_nodes[deployment_id]:
+            nodes[node.id] = node
+            node_state[deployment_id][node.id] = node
+    return {
+        'blueprints': blueprints,
+        'deployments': deployments,
+        'nodes': nodes,
+        'node_state': node_state,
+        'deployment_nodes': deployment_nodes
+    }
+
+
+class TestListAll(unittest.TestCase):
+
+    def test_pages(self):
+        resources = MockResources([Resource(id=i) for i in range(10)])
+        self.assertEqual(range(10),
+                         [r.id for r in list_all(resources.list,
+                                                 page_size=3)])
+        self.assertEqual([0, 3, 6, 9],
+                         [offset for _, offset, _ in resources.calls])
+
+    def test_capped_page_size(self):
+        resources = MockResources([Resource(id=i) for i in range(10)],
+                                  max_size=4)
+        self.assertEqual(range(10),
+                         [r.id for r in list_all(resources.list)])
+        self.assertEqual([(None, 0, 1000), (None, 4, 4), (None, 8, 4)],
+                         resources.calls)
+
+    def test_not_paginated(self):
+        resources = MockResources([Resource(id=i) for i in range(10)],
+                                  paginated=False)
+        self.assertEqual(10, len(list_all(resources.list, page_size=3)))
+        self.assertEqual(1, len(resources.calls))
+
+
+class TestGetManagerState(unittest.TestCase):
+
+    def test_same_as_per_deployment_state(self):
+        client = MockClient(deployments_count=20, instances_per_deployment=3,
+                            max_size=7)
+        state = get_manager_state(client)
+        self.assertEqual(_per_deployment_manager_state(client), state)
+        # 60 node instances in pages of 7
+        self.assertEqual(9, len([c for c in client.node_instances.calls
+                                 if c[0] is None]))
+
+    def test_deployment_without_node_instances(self):
+        client = MockClient(deployments_count=2, instances_per_deployment=0)
+        state = get_manager_state(client)
+        self.assertEqual({'deployment0': [], 'deployment1': []},
+                         state['deployment_nodes'])
+        self.assertEqual({'deployment0': {}, 'deployment1': {}},
+                         state['node_state'])
+
+    def test_node_instances_of_unlisted_deployment(self):
+        client = MockClient(deployments_count=2, instances_per_deployment=1)
+        client.node_instances._items.append(
+            Resource(id='new_node', deployment_id='new_deployment'))
+        state = get_manager_state(client)
+        self.assertNotIn('new_node', state['nodes'])
+        self.assertEqual(['node0_0', 'node1_0'], sorted(state['nodes']))
+
+
+def deepcopy_manager_state_delta(before, after):
+    after = copy.deepcopy(after)
+    for blueprint_id in before['blueprints'].keys():
+        del after['blueprints'][blueprint_id]
+    for deployment_id in before['deployments'].keys():
+        del after['deployments'][deployment_id]
+        del after['deployment_nodes'][deployment_id]
+        del after['node_state'][deployment_id]
+    for node_id in before['nodes'].keys():
+        del after['nodes'][node_id]
+    return after
+
+
+class TestGetManagerStateDelta(unittest.TestCase):
+
+    def test_same_as_deepcopy_delta(self):
+        client = MockClient(deployments_count=3, instances_per_deployment=2)
+        before = get_manager_state(client)
+        client = MockClient(deployments_count=5, instances_per_deployment=2)
+        after = get_manager_state(client)
+        delta = get_manager_state_delta(before, after)
+        self.assertEqual(deepcopy_manager_state_delta(before, after), delta)
+        self.assertEqual(['deployment3', 'deployment4'],
+                         sorted(delta['deployment_nodes']))
+        # entities are shared with the after state, not copied
+        self.assertIs(after['nodes']['node4_1'], delta['nodes']['node4_1'])
+        self.assertIs(after['deployment_nodes']['deployment4'],
+                      delta['deployment_nodes']['deployment4'])
+
+    def test_removed_entities(self):
+        before = get_manager_state(MockClient(deployments_count=3,
+                                              instances_per_deployment=1))
+        after = get_manager_state(MockClient(deployments_count=1,
+                                             instances_per_deployment=1))
+        delta = get_manager_state_delta(before, after)
+        for view in delta.values():
+            self.assertEqual({}, view)
+
+
+class TestManagerStateTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MockClient(deployments_count=20,
+                                 instances_per_deployment=5,
+                                 max_size=7)
+        self.tracker = ManagerStateTracker(self.client)
+        self.tracker.snapshot()
+
+    def _assert_snapshot(self):
+        items_count = self.client.items_count()
+        state = self.tracker.snapshot()
+        incremental_items_count = self.client.items_count() - items_count
+        self.assertEqual(get_manager_state(self.client), state)
+        return state, incremental_items_count
+
+    def test_unchanged(self):
+        before = self.tracker.state
+        self.tracker.snapshot()
+        for resources in [self.client.blueprints, self.client.deployments,
+                          self.client.executions]:
+            self.assertEqual((None, 0, SWEEP_PAGE_SIZE), resources.calls[-1])
+        after, items_count = self._assert_snapshot()
+        # a page of the newest executions, blueprints and deployments
+        self.assertEqual(3 * SWEEP_PAGE_SIZE, items_count)
+        self.assertIs(before['nodes']['node3_1'], after['nodes']['node3_1'])
+
+    def test_created(self):
+        self.client.add_deployment(20)
+        self.client.add_deployment(21)
+        state, items_count = self._assert_snapshot()
+        self.assertIn('deployment21', state['deployments'])
+        self.assertEqual(5, len(state['deployment_nodes']['deployment20']))
+        # the new deployments node instances only
+        self.assertEqual(3 * SWEEP_PAGE_SIZE + 10, items_count)
+
+    def test_sweep_pages(self):
+        for i in range(20, 40):
+            self.client.add_deployment(i)
+        state = self.tracker.snapshot()
+        self.assertEqual(40, len(state['deployments']))
+        self.assertEqual([(None, 0, 10), (None, 10, 20)],
+                         self.client.deployments.calls[-2:])
+
+    def test_created_older_than_cursor(self):
+        self.client.blueprints._items.append(
+            Resource(id='old_blueprint', created_at=-1))
+        state, _ = self._assert_snapshot()
+        self.assertIn('old_blueprint', state['blueprints'])
+
+    def test_recreated(self):
+        before = self.tracker.state
+        self.client.delete_deployment(3)
+        self.client.add_deployment(3)
+        after, _ = self._assert_snapshot()
+        self.assertIsNot(before['deployments']['deployment3'],
+                         after['deployments']['deployment3'])
+        self.assertIsNot(before['nodes']['node3_1'], after['nodes']['node3_1'])
+        self.assertIs(before['nodes']['node4_1'], after['nodes']['node4_1'])
+
+    def test_updated(self):
+        self.client.update_node_instance('node4_2', state='started')
+        self.client.add_execution('deployment4')
+        before = self.tracker.state
+        after, items_count = self._assert_snapshot()
+        self.assertEqual('started', after['nodes']['node4_2'].state)
+        self.assertEqual(3 * SWEEP_PAGE_SIZE + 5, items_count)
+        self.assertIsNot(before['nodes']['node4_2'],
+                         after['nodes']['node4_2'])
+        self.assertIs(before['nodes']['node5_2'], after['nodes']['node5_2'])
+
+    def test_running_execution(self):
+        execution = self.client.add_execution('deployment4', status='started')
+        self._assert_snapshot()
+        self.client.update_node_instance('node4_2', state='started')
+        state, _ = self._assert_snapshot()
+        self.assertEqual('started', state['nodes']['node4_2'].state)
+        execution['status'] = 'terminated'
+        self.client.update_node_instance('node4_2', state='stopped')
+        self._assert_snapshot()
+        _, items_count = self._assert_snapshot()
+        self.assertEqual(3 * SWEEP_PAGE_SIZE, items_count)
+
+    def test_system_workflow(self):
+        self.client.add_execution(None, 'restore_snapshot')
+        self.client.update_node_instance('node4_2', state='started')
+        state, _ = self._assert_snapshot()
+        self.assertEqual('started', state['nodes']['node4_2'].state)
+        _, items_count = self._assert_snapshot()
+        self.assertEqual(3 * SWEEP_PAGE_SIZE, items_count)
+
+    def test_deleted(self):
+        self.client.delete_deployment(3)
+        state, _ = self._assert_snapshot()
+        self.assertNotIn('deployment3', state['deployments'])
+        self.assertNotIn('node3_0', state['nodes'])
+
+    def test_deployment_created_between_listings(self):
+        deployments_list = self.client.deployments.list
+
+        def list_then_create(*args, **kwargs):
+            response = deployments_list(*args, **kwargs)
+            self.client.node_instances._items.append(
+                Resource(id='new_node',
+                         deployment_id='new_deployment',
+                         version=1))
+            return response
+        self.client.deployments.list = list_then_create
+        state = self.tracker.snapshot()
+        self.assertNotIn('new_node', state['nodes'])
+        self.assertEqual(get_manager_state(self.client), state)
+
+    def test_delta(self):
+        before = self.tracker.state
+        self.client.add_deployment(20)
+        delta = self.tracker.delta()
+        self.assertEqual(
+            get_manager_state_delta(before, get_manager_state(self.client)),
+            delta)
+        self.assertEqual(['deployment20'], delta['deployments'].keys())
+
+
+class RestStub(BaseHTTPServer.HTTPServer):
+    """Serves the resources of a MockClient the way the REST service
+    does, rejecting query arguments the REST service does not know."""
+
+    fields = {
+        'blueprints': ['id', 'created_at', 'updated_at', 'plan',
+                       'main_file_name', 'description'],
+        'deployments': ['id', 'blueprint_id', 'created_at', 'updated_at',
+                        'inputs', 'outputs', 'workflows', 'groups',
+                        'description'],
+        'node-instances': ['id', 'node_id', 'host_id', 'deployment_id',
+                           'state', 'runtime_properties', 'relationships',
+                           'version'],
+        'executions': ['id', 'workflow_id', 'blueprint_id', 'deployment_id',
+                       'status', 'error', 'created_at', 'parameters',
+                       'is_system_workflow']
+    }
+
+    def __init__(self, client):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0),
+                                           RestStubHandler)
+        self.resources = {
+            'blueprints': client.blueprints,
+            'deployments': client.deployments,
+            'node-instances': client.node_instances,
+            'executions': client.executions
+        }
+        self.requests = []
+
+
+class RestStubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        args = urlparse.parse_qs(url.query, keep_blank_values=True)
+        self.server.requests.append((url.path, args))
+        _, _, _, name, resource_id = (url.path.split('/') + [None])[:5]
+        try:
+            body = self._get(name, resource_id, args)
+        except (KeyError, ValueError) as e:
+            self._respond(400, {'message': 'bad query: {0}'.format(e),
+                                'error_code': 'bad_parameters_error',
+                                'server_traceback': None})
+        else:
+            self._respond(200, body)
+
+    def _get(self, name, resource_id, args):
+        fields = self.server.fields[name]
+        args = dict(args)
+        include = self._fields(fields, args.pop('_include', ['']), ',')
+        sort = args.pop('_sort', [])
+        offset = int(args.pop('_offset', ['0'])[0])
+        size = int(args.pop('_size', ['1000'])[0])
+        if name == 'executions' and not resource_id:
+            if args.pop('_include_system_workflows') != ['True']:
+                raise ValueError('_include_system_workflows')
+        items = self.server.resources[name]._items
+        if resource_id:
+            if args or sort:
+                raise KeyError(sorted(args) + sort)
+            item, = [i for i in items if i.id == resource_id]
+            return self._project(item, include)
+        for field, values in args.items():
+            if field not in fields:
+                raise KeyError(field)
+            items = [i for i in items if i.get(field) in values]
+        for field in reversed(sort):
+            self._fields(fields, [field.lstrip('-')])
+            items = sorted(items, key=lambda i: i.get(field.lstrip('-')),
+                           reverse=field.startswith('-'))
+        return {
+            'items': [self._project(i, include)
+                      for i in items[offset:offset + size]],
+            'metadata': {'pagination': {'total': len(items),
+                                        'offset': offset,
+                                        'size': size}}
+        }
+
+    @staticmethod
+    def _fields(fields, values, separator=None):
+        values = [field for value in values
+                  for field in value.split(separator) if field]
+        for field in values:
+            if field not in fields:
+                raise KeyError(field)
+        return values
+
+    @staticmethod
+    def _project(item, include):
+        return dict((k, item.get(k)) for k in include or item)
+
+    def _respond(self, status, body):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipUnless(CloudifyClient, 'cloudify-rest-client is required')
+class TestManagerStateTrackerRest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_client = MockClient(deployments_count=20,
+                                      instances_per_deployment=3)
+        self.server = RestStub(self.mock_client)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = CloudifyClient(host='localhost',
+                                     port=self.server.server_port)
+
+    def _requests(self, path):
+        return [args for request_path, args in self.server.requests
+                if request_path == '/api/v2.1/{0}'.format(path)]
+
+    def test_snapshots(self):
+        tracker = ManagerStateTracker(self.client)
+        self.assertEqual(get_manager_state(self.client), tracker.snapshot())
+        self.mock_client.add_deployment(20)
+        self.mock_client.update_node_instance('node4_2', state='started')
+        self.mock_client.add_execution('deployment4')
+        del self.server.requests[:]
+        state = tracker.snapshot()
+        self.assertEqual('started', state['nodes']['node4_2']['state'])
+        self.assertEqual(get_manager_state(self.client), state)
+
+        sweep = {'_sort': ['-created_at'], '_offset': ['0'], '_size': ['10']}
+        self.assertEqual([sweep, sweep], self._requests('blueprints')[:1] +
+                         self._requests('deployments')[:1])
+        executions = self._requests('executions')[0]
+        self.assertEqual(['-created_at'], executions['_sort'])
+        self.assertEqual(['created_at', 'deployment_id', 'id', 'status'],
+                         sorted(executions['_include'][0].split(',')))
+        self.assertEqual(
+            [['deployment20'], ['deployment4']],
+            sorted(args['deployment_id']
+                   for args in self._requests('node-instances')
+                   if 'deployment_id' in args))
+
+    def test_unknown_query_arguments_rejected(self):
+        self.assertRaises(CloudifyClientError, self.client.deployments.list,
+                          sort='created_at', is_descending=True)
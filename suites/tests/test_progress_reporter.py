@@ -0,0 +1,83 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import nose
+
+from cosmo_tester.framework.progress_reporter import ProgressReporter
+
+
+TESTS_MODULE = '''
+import unittest
+
+
+class ReportedTest(unittest.TestCase):
+
+    def test_error(self):
+        raise RuntimeError()
+
+    def test_failure(self):
+        self.fail()
+
+    def test_success(self):
+        pass
+
+    @unittest.skip('skipped')
+    def test_skipped(self):
+        pass
+'''
+
+
+class TestProgressReporter(unittest.TestCase):
+
+    def setUp(self):
+        # --where changes the working directory
+        self.cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp(prefix='progress-reporter-')
+        with open(os.path.join(self.work_dir,
+                               'reported_tests.py'), 'w') as f:
+            f.write(TESTS_MODULE)
+        self.events_path = os.path.join(self.work_dir, 'events.jsonl')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        sys.modules.pop('reported_tests', None)
+        shutil.rmtree(self.work_dir)
+
+    def test_test_events(self):
+        nose.run(argv=['nosetests', '--where', self.work_dir,
+                       '--with-progressreporter',
+                       '--progress-events-path', self.events_path,
+                       'reported_tests'],
+                 addplugins=[ProgressReporter()])
+        with open(self.events_path) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual(8, len(events))
+        started = [e['test'] for e in events if e['event'] == 'test_started']
+        results = dict((e['test'], e['result']) for e in events
+                       if e['event'] == 'test_finished')
+        self.assertEqual(sorted(started), sorted(results))
+        self.assertEqual({
+            'reported_tests.ReportedTest.test_error': 'error',
+            'reported_tests.ReportedTest.test_failure': 'failed',
+            'reported_tests.ReportedTest.test_success': 'passed',
+            'reported_tests.ReportedTest.test_skipped': 'skipped',
+        }, results)
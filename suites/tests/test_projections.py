@@ -0,0 +1,112 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import logging
+import unittest
+
+from mock import patch
+
+from cosmo_tester.framework import projections
+from cosmo_tester.framework.manager_state import ManagerStateTracker
+from cosmo_tester.framework.manager_state import get_manager_state
+
+from suites.tests.test_manager_state import ListResponse
+from suites.tests.test_manager_state import MockClient
+from suites.tests.test_manager_state import Resource
+
+logger = logging.getLogger('test_projections')
+
+
+class ReceivedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        projections.collect_bytes_received = True
+        projections.items_received.clear()
+        projections.bytes_received.clear()
+
+    def tearDown(self):
+        projections.collect_bytes_received = False
+        projections.items_received.clear()
+        projections.bytes_received.clear()
+
+
+class TestQuery(ReceivedTestCase):
+
+    def setUp(self):
+        super(TestQuery, self).setUp()
+        self.calls = []
+
+    def _get(self, execution_id, _include=None):
+        self.calls.append((execution_id, _include))
+        execution = Resource(id=execution_id, status='started',
+                             parameters={'a': 'b'})
+        if _include:
+            execution = Resource((k, execution[k]) for k in _include)
+        return execution
+
+    def _list(self, **kwargs):
+        return ListResponse([self._get('e1', **kwargs)], total=1)
+
+    def test_projected(self):
+        get_execution = projections.query('helper', self._get,
+                                          projections.EXECUTION_STATUS)
+        execution = get_execution('e1')
+        self.assertEqual([('e1', ['id', 'status'])], self.calls)
+        self.assertEqual({'id': 'e1', 'status': 'started'}, execution)
+        self.assertEqual(len(json.dumps([execution])),
+                         projections.bytes_received['helper'])
+
+    def test_not_projected(self):
+        execution = projections.query('helper', self._get)('e1')
+        self.assertEqual([('e1', None)], self.calls)
+        self.assertIn('parameters', execution)
+
+    def test_list_response(self):
+        list_executions = projections.query('helper', self._list,
+                                            projections.ID)
+        list_executions()
+        list_executions()
+        self.assertEqual(2 * len(json.dumps([{'id': 'e1'}])),
+                         projections.bytes_received['helper'])
+        self.assertEqual(2, projections.items_received['helper'])
+
+    def test_bytes_not_collected(self):
+        projections.collect_bytes_received = False
+        with patch('cosmo_tester.framework.projections.json') as json_mock:
+            projections.query('helper', self._list)()
+        self.assertFalse(json_mock.dumps.called)
+        self.assertEqual(0, projections.bytes_received['helper'])
+        self.assertEqual(1, projections.items_received['helper'])
+        projections.log_received(logger)
+
+    def test_log_received(self):
+        projections.query('helper', self._get)('e1')
+        projections.log_received(logger)
+
+
+class TestManagerStateBytesReceived(ReceivedTestCase):
+
+    def test_tracker_receives_less(self):
+        client = MockClient(deployments_count=20,
+                            instances_per_deployment=5)
+        tracker = ManagerStateTracker(client)
+        tracker.snapshot()
+        get_manager_state(client)
+        full = projections.bytes_received['get_manager_state']
+        tracker.snapshot()
+        incremental = projections.bytes_received['manager_state_tracker']
+        self.assertLess(0, incremental)
+        self.assertLess(incremental, full / 2)
@@ -14,12 +14,15 @@
 #    * limitations under the License.
 
 
+import json
 import logging
 import threading
 import time
 import os
+import shutil
 import unittest
 import tempfile
+import multiprocessing
 
 from path import path
 from mock import patch
@@ -27,6 +30,14 @@ from mock import patch
 from suites.suites_runner import TestSuite
 from suites.suites_runner import SuitesScheduler
 from suites.suites_runner import FileEnvironments
+from suites.suites_runner import InMemoryEnvironments
+from suites.suites_runner import LockFileEnvironments
+from suites.suites_runner import SqliteEnvironments
+from suites.suites_runner import SuiteDurations
+from suites.suites_runner import FileSuiteDurations
+from suites.suites_runner import match_suites_to_environments
+from suites.suites_runner import SuitesProgress
+from suites.helpers.progress import ProgressEvents
 
 
 logger = logging.getLogger('suites_scheduler')
@@ -45,6 +56,7 @@ class MockTestSuite(TestSuite):
         while time.time() < deadline and self._running:
             time.sleep(1)
         self._running = False
+        self._notify_terminated()
 
     def run(self):
         self._running = True
@@ -223,6 +235,422 @@ class TestSuiteScheduler(unittest.TestCase):
         scheduler.run()
         self.assertEqual(scheduler.failed_suites, suites)
 
+    def test_event_driven_suite_started_on_env_release(self):
+        suites = [
+            self._new_test_suite('suite1', requires=['env1'], run_for=1),
+            self._new_test_suite('suite2', requires=['env1'], run_for=1)
+        ]
+        handler_configurations = {
+            'config1': {'env': 'env1_id', 'tags': ['env1']}
+        }
+        scheduler = SuitesScheduler(
+            suites,
+            handler_configurations,
+            scheduling_interval=30,
+            event_driven=True)
+        start = time.time()
+        scheduler.run()
+        delta = time.time() - start
+        self.assertTrue(
+            delta < 10,
+            msg='Event driven scheduler should not wait for the scheduling '
+                'interval but ran for {0} seconds.'.format(delta))
+        self.assertTrue(suites[1].started > suites[0].terminated)
+        self.assertTrue(suites[1].started - suites[0].terminated < 1)
+
+    def test_event_driven_timed_out_suite(self):
+        suite_time = 20
+        suites = [
+            self._new_test_suite('suite1',
+                                 requires=['env1'],
+                                 run_for=suite_time)
+        ]
+        handler_configurations = {
+            'config1': {'env': 'env1_id', 'tags': ['env1']}
+        }
+        scheduler = SuitesScheduler(
+            suites,
+            handler_configurations,
+            scheduling_interval=30,
+            suite_timeout=1,
+            event_driven=True)
+        start = time.time()
+        scheduler.run()
+        delta = time.time() - start
+        self.assertTrue(
+            delta < 10,
+            msg='Scheduler should wake up on the suite timeout deadline but '
+                'ran for {0} seconds.'.format(delta))
+        self.assertTrue(suites[0].timed_out)
+        self.assertEqual(scheduler.timed_out_suites, suites)
+
+    def test_longest_processing_time_first(self):
+        suites = [
+            self._new_test_suite('suite1', requires=['env1'], run_for=1),
+            self._new_test_suite('suite2', requires=['env1'], run_for=2),
+            self._new_test_suite('suite3', requires=['env1'])
+        ]
+        handler_configurations = {
+            'config1': {'env': 'env1_id', 'tags': ['env1']}
+        }
+        durations = SuiteDurations({'suite1': [1], 'suite2': [2]})
+        scheduler = SuitesScheduler(
+            suites,
+            handler_configurations,
+            optimize=True,
+            durations=durations)
+        self.assertEqual(3 + 1.5, scheduler.predicted_makespan)
+        scheduler.run()
+        self.assertTrue(suites[0].started > suites[2].terminated)
+        self.assertTrue(suites[2].started > suites[1].terminated)
+        self.assertTrue(scheduler.makespan > 0)
+        self.assertEqual(2, len(durations._durations['suite1']))
+        self.assertEqual(1, len(durations._durations['suite3']))
+
+    def test_predicted_makespan_across_environments(self):
+        suites = [
+            self._new_test_suite('suite1', requires=['env']),
+            self._new_test_suite('suite2', requires=['env']),
+            self._new_test_suite('suite3', requires=['env']),
+            self._new_test_suite('suite4', handler_configuration='config2')
+        ]
+        handler_configurations = {
+            'config1': {'env': 'env1_id', 'tags': ['env']},
+            'config2': {'env': 'env2_id', 'tags': ['env']}
+        }
+        durations = SuiteDurations({'suite1': [6],
+                                    'suite2': [4],
+                                    'suite3': [3],
+                                    'suite4': [2]})
+        scheduler = SuitesScheduler(
+            suites,
+            handler_configurations,
+            optimize=True,
+            durations=durations)
+        self.assertEqual(['suite1', 'suite2', 'suite3', 'suite4'],
+                         [s.suite_name for s in scheduler._test_suites])
+        self.assertEqual(9, scheduler.predicted_makespan)
+
+    def test_broad_suite_does_not_block_narrow_suite(self):
+        handler_configurations = {
+            'config1': {'env': 'env1_id', 'tags': ['env', 'special']},
+            'config2': {'env': 'env2_id', 'tags': ['env']}
+        }
+        # config choice is randomized, repeat to cover both choices
+        for _ in range(5):
+            suites = [
+                self._new_test_suite('suite1', requires=['env'], run_for=2),
+                self._new_test_suite('suite2',
+                                     requires=['env', 'special'],
+                                     run_for=2)
+            ]
+            scheduler = SuitesScheduler(suites, handler_configurations)
+            scheduler.run()
+            self.assertEqual('config2', suites[0].handler_configuration)
+            self.assertEqual('config1', suites[1].handler_configuration)
+            self.assertTrue(suites[1].started < suites[0].terminated)
+
+    def test_env_locked_by_another_runner(self):
+        handler_configurations = {
+            'config1': {'env': 'env1_id', 'tags': ['env']},
+            'config2': {'env': 'env2_id', 'tags': ['env']}
+        }
+        environments = InMemoryEnvironments()
+        environments.lock('env1_id')
+        for _ in range(5):
+            suites = [self._new_test_suite('suite1', requires=['env'])]
+            scheduler = SuitesScheduler(suites,
+                                        handler_configurations,
+                                        environments=environments)
+            scheduler.run()
+            self.assertEqual('config2', suites[0].handler_configuration)
+
+
+class TestMatchSuitesToEnvironments(unittest.TestCase):
+
+    def _pending(self, suites_matches, handler_configurations):
+        pending = []
+        for suite_name, config_names in suites_matches:
+            suite = MockTestSuite(suite_name=suite_name,
+                                  suite_def={},
+                                  suite_work_dir=path('/tmp'),
+                                  variables={})
+            pending.append((suite, {name: handler_configurations[name]
+                                    for name in config_names}))
+        return pending
+
+    def _assignment(self, pending, unavailable_envs=()):
+        return {suite.suite_name: name for suite, name in
+                match_suites_to_environments(pending, unavailable_envs)}
+
+    def test_maximum_matching(self):
+        handler_configurations = {
+            'config1': {'env': 'env1_id'},
+            'config2': {'env': 'env2_id'},
+            'config3': {'env': 'env3_id'}
+        }
+        pending = self._pending([
+            ('suite1', ['config1', 'config2', 'config3']),
+            ('suite2', ['config1', 'config2']),
+            ('suite3', ['config1'])
+        ], handler_configurations)
+        self.assertEqual({'suite1': 'config3',
+                          'suite2': 'config2',
+                          'suite3': 'config1'},
+                         self._assignment(pending))
+
+    def test_priority_order(self):
+        handler_configurations = {
+            'config1': {'env': 'env1_id'}
+        }
+        pending = self._pending([
+            ('suite1', ['config1']),
+            ('suite2', ['config1'])
+        ], handler_configurations)
+        self.assertEqual({'suite1': 'config1'}, self._assignment(pending))
+
+    def test_configurations_sharing_env(self):
+        handler_configurations = {
+            'config1': {'env': 'env1_id'},
+            'config2': {'env': 'env1_id'},
+            'config3': {'env': 'env2_id'}
+        }
+        pending = self._pending([
+            ('suite1', ['config1']),
+            ('suite2', ['config2', 'config3'])
+        ], handler_configurations)
+        self.assertEqual({'suite1': 'config1', 'suite2': 'config3'},
+                         self._assignment(pending))
+
+    def test_unavailable_envs(self):
+        handler_configurations = {
+            'config1': {'env': 'env1_id'},
+            'config2': {'env': 'env2_id'}
+        }
+        pending = self._pending([
+            ('suite1', ['config1', 'config2']),
+            ('suite2', ['config1'])
+        ], handler_configurations)
+        self.assertEqual({'suite1': 'config2'},
+                         self._assignment(pending, {'env1_id'}))
+
+
+class TestFileSuiteDurations(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.durations_path = tempfile.mkstemp()
+        os.remove(self.durations_path)
+        os.close(fd)
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        os.remove(self.durations_path)
+        os.remove('{0}.lock'.format(self.durations_path))
+
+    def test_record_and_estimate(self):
+        durations = FileSuiteDurations(self.durations_path)
+        self.assertIsNone(durations.estimate('suite1'))
+        durations.record('suite1', 10)
+        durations.record('suite1', 20)
+        self.assertEqual(15, durations.estimate('suite1'))
+        self.assertEqual(
+            15, FileSuiteDurations(self.durations_path).estimate('suite1'))
+
+    def test_samples_limit(self):
+        durations = FileSuiteDurations(self.durations_path)
+        for running_time in range(100):
+            durations.record('suite1', running_time)
+        self.assertEqual(
+            97, FileSuiteDurations(self.durations_path).estimate('suite1'))
+
+
+class ProgressTestSuite(MockTestSuite):
+
+    def run(self):
+        progress = ProgressEvents(self.progress_events_path)
+        with progress.phase('tests'):
+            progress.publish('test_started', test='module.Test.test_1')
+            progress.publish('test_finished', test='module.Test.test_1',
+                             result='passed', duration=0.1)
+        super(ProgressTestSuite, self).run()
+
+
+class TestSuitesProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+    def _suite(self, suite_name, suite_class=MockTestSuite):
+        suite_work_dir = self.work_dir / suite_name
+        suite_work_dir.mkdir()
+        return suite_class(suite_name=suite_name,
+                           suite_def={'requires': ['env1']},
+                           suite_work_dir=suite_work_dir,
+                           variables={})
+
+    def test_poll(self):
+        suite = self._suite('suite1')
+        progress = SuitesProgress()
+        progress.poll(suite)
+        self.assertEqual({}, progress.status()['suite1']['results'])
+
+        events = ProgressEvents(suite.progress_events_path)
+        events.publish('phase_started', phase='install')
+        with events.phase('clone', repo='cloudify-cli'):
+            pass
+        events.publish('phase_started', phase='tests')
+        events.publish('test_started', test='module.Test.test_1')
+        events.publish('test_finished', test='module.Test.test_1',
+                       result='failed', duration=1)
+        events.publish('test_started', test='module.Test.test_2')
+        # partially written event
+        with open(suite.progress_events_path, 'a') as f:
+            f.write('{"event": "test_fin')
+        progress.poll(suite)
+        status = progress.status()['suite1']
+        self.assertEqual('install/tests', status['phase'])
+        self.assertEqual('module.Test.test_2', status['test'])
+        self.assertEqual({'failed': 1}, status['results'])
+        self.assertEqual(['clone'], status['durations'].keys())
+        self.assertEqual(7, len(progress.events))
+        self.assertTrue(all(e['suite'] == 'suite1' for e in progress.events))
+
+        with open(suite.progress_events_path, 'a') as f:
+            f.write('ished", "test": "module.Test.test_2", '
+                    '"result": "passed", "duration": 1, "time": 0}\n')
+        progress.poll(suite)
+        status = progress.status()['suite1']
+        self.assertIsNone(status['test'])
+        self.assertEqual({'failed': 1, 'passed': 1}, status['results'])
+
+    def test_scheduler_timeline(self):
+        test_suites = [self._suite('suite1', ProgressTestSuite),
+                       self._suite('suite2', ProgressTestSuite)]
+        timeline_path = self.work_dir / 'timeline.json'
+        scheduler = SuitesScheduler(
+            test_suites,
+            {'config1': {'env': 'env1_id', 'tags': ['env1']}},
+            event_driven=True,
+            progress=SuitesProgress(timeline_path=timeline_path))
+        scheduler.run()
+        timeline = json.loads(timeline_path.text())
+        self.assertEqual(
+            {'phase': None,
+             'test': None,
+             'results': {'passed': 1},
+             'durations': {'tests': timeline['suites']['suite1'][
+                 'durations']['tests']}},
+            timeline['suites']['suite1'])
+        self.assertEqual(['suite1', 'suite2'], sorted(timeline['suites']))
+        self.assertEqual(8, len(timeline['events']))
+        times = [e['time'] for e in timeline['events']]
+        self.assertEqual(sorted(times), times)
+
+
+class ActiveTestSuite(MockTestSuite):
+    """Writes container output or progress events while it runs."""
+
+    def __init__(self, *args, **kwargs):
+        super(ActiveTestSuite, self).__init__(*args, **kwargs)
+        self.output_interval = None
+        self.phase = None
+
+    def run(self):
+        if self.phase:
+            ProgressEvents(self.progress_events_path).publish(
+                'phase_started', phase=self.phase)
+        super(ActiveTestSuite, self).run()
+        if self.output_interval:
+            t = threading.Thread(target=self._write_output)
+            t.daemon = True
+            t.start()
+
+    def _write_output(self):
+        while self._running:
+            self.container_log.write('output\n')
+            time.sleep(self.output_interval)
+
+
+class TestIdleTimeout(unittest.TestCase):
+
+    handler_configurations = {
+        'config1': {'env': 'env1_id', 'tags': ['env1']}
+    }
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+    def _suite(self, suite_name, run_for, **suite_def):
+        suite_work_dir = self.work_dir / suite_name
+        suite_work_dir.mkdir()
+        suite_def['requires'] = ['env1']
+        suite = ActiveTestSuite(suite_name=suite_name,
+                                suite_def=suite_def,
+                                suite_work_dir=suite_work_dir,
+                                variables={})
+        suite.run_for = run_for
+        return suite
+
+    def _run(self, suites, idle_timeout):
+        scheduler = SuitesScheduler(
+            suites,
+            self.handler_configurations,
+            scheduling_interval=30,
+            event_driven=True,
+            progress=SuitesProgress(),
+            idle_timeout=idle_timeout)
+        start = time.time()
+        scheduler.run()
+        return scheduler, time.time() - start
+
+    def test_idle_suite_timed_out(self):
+        suite = self._suite('suite1', run_for=20)
+        scheduler, delta = self._run([suite], idle_timeout=1)
+        self.assertTrue(
+            delta < 10,
+            msg='Scheduler should wake up on the idle deadline but ran for '
+                '{0} seconds.'.format(delta))
+        self.assertEqual([suite], scheduler.timed_out_suites)
+        self.assertIn('made no progress for 1 seconds', suite.timeout_reason)
+
+    def test_output_keeps_suite_alive(self):
+        suite = self._suite('suite1', run_for=3)
+        suite.output_interval = 0.2
+        scheduler, _ = self._run([suite], idle_timeout=1)
+        self.assertEqual([], scheduler.timed_out_suites)
+
+    def test_suite_idle_timeout(self):
+        suites = [self._suite('suite1', run_for=2, idle_timeout=-1),
+                  self._suite('suite2', run_for=20, idle_timeout=1)]
+        scheduler, delta = self._run(suites, idle_timeout=-1)
+        self.assertTrue(delta < 10)
+        self.assertEqual([suites[1]], scheduler.timed_out_suites)
+
+    def test_suite_timeout(self):
+        suite = self._suite('suite1', run_for=20, timeout=1)
+        scheduler, delta = self._run([suite], idle_timeout=-1)
+        self.assertTrue(delta < 10)
+        self.assertEqual([suite], scheduler.timed_out_suites)
+        self.assertIn('timed out after 1 seconds', suite.timeout_reason)
+
+    def test_phase_idle_timeouts(self):
+        idle_timeout = {'install': 1, 'default': 60}
+        suites = [self._suite('suite1', run_for=20,
+                              idle_timeout=idle_timeout),
+                  self._suite('suite2', run_for=2,
+                              idle_timeout=idle_timeout)]
+        suites[0].phase = 'install'
+        suites[1].phase = 'tests'
+        suites[1].suite_def['requires'] = ['env2']
+        self.handler_configurations = dict(
+            self.handler_configurations,
+            config2={'env': 'env2_id', 'tags': ['env2']})
+        scheduler, delta = self._run(suites, idle_timeout=-1)
+        self.assertTrue(delta < 10)
+        self.assertEqual([suites[0]], scheduler.timed_out_suites)
+
 
 class TestFileEnvironments(unittest.TestCase):
 
@@ -280,3 +708,158 @@ class TestFileEnvironments(unittest.TestCase):
 
         for env in unavailable_envs:
             self.assertTrue(self.environments.lock(env))
+
+
+def _lock_in_other_process(locks_dir, env_id, release):
+    def lock(result):
+        environments = LockFileEnvironments(locks_dir)
+        locked = environments.lock(env_id)
+        result.put(locked)
+        if locked and release:
+            environments.release(env_id)
+        # exiting without release simulates a crashed runner
+    result = multiprocessing.Queue()
+    process = multiprocessing.Process(target=lock, args=(result,))
+    process.start()
+    process.join()
+    return result.get()
+
+
+class TestLockFileEnvironments(unittest.TestCase):
+
+    def setUp(self):
+        self.locks_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.locks_dir)
+        self.environments = LockFileEnvironments(self.locks_dir)
+
+    def test_lock_and_release(self):
+        env_id = 'ENV'
+        self.assertTrue(self.environments.lock(env_id))
+        self.assertFalse(self.environments.lock(env_id))
+        self.environments.release(env_id)
+        self.assertTrue(self.environments.lock(env_id))
+
+    def test_lock_held_across_processes(self):
+        self.assertTrue(self.environments.lock('ENV1'))
+        self.assertFalse(_lock_in_other_process(self.locks_dir, 'ENV1',
+                                                release=True))
+        self.assertTrue(_lock_in_other_process(self.locks_dir, 'ENV2',
+                                               release=True))
+        self.environments.release('ENV1')
+        self.assertTrue(_lock_in_other_process(self.locks_dir, 'ENV1',
+                                               release=True))
+
+    def test_lock_released_on_holder_exit(self):
+        self.assertTrue(_lock_in_other_process(self.locks_dir, 'ENV',
+                                               release=False))
+        self.assertTrue(self.environments.lock('ENV'))
+
+    def test_prune_include_self(self):
+        for env_id in ['ENV1', 'ENV2']:
+            self.assertTrue(self.environments.lock(env_id))
+        self.environments.prune()
+        self.assertFalse(_lock_in_other_process(self.locks_dir, 'ENV1',
+                                                release=True))
+        self.environments.prune(include_self=True)
+        for env_id in ['ENV1', 'ENV2']:
+            self.assertTrue(_lock_in_other_process(self.locks_dir, env_id,
+                                                   release=True))
+
+
+class TestLegacyEnvironments(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.legacy_path = os.path.join(self.work_dir, 'environments.json')
+        self.legacy_environments = FileEnvironments(self.legacy_path)
+        self.environments = LockFileEnvironments(
+            os.path.join(self.work_dir, 'environments'),
+            legacy_environments=FileEnvironments(self.legacy_path))
+
+    def test_locked_by_old_runner(self):
+        self.assertTrue(self.legacy_environments.lock('ENV'))
+        self.assertFalse(self.environments.lock('ENV'))
+        self.legacy_environments.release('ENV')
+        self.assertTrue(self.environments.lock('ENV'))
+
+    def test_seen_by_old_runner(self):
+        self.assertTrue(self.environments.lock('ENV'))
+        self.assertFalse(self.legacy_environments.lock('ENV'))
+        self.environments.release('ENV')
+        self.assertTrue(self.legacy_environments.lock('ENV'))
+
+    def test_prune(self):
+        self.assertTrue(self.environments.lock('ENV'))
+        self.environments.prune(include_self=True)
+        self.assertTrue(self.legacy_environments.lock('ENV'))
+
+
+class TestSqliteEnvironments(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.db_path = os.path.join(self.work_dir, 'environments.db')
+
+    def environments(self, lease_duration=60):
+        return SqliteEnvironments(self.db_path, lease_duration=lease_duration)
+
+    def test_lock_and_release(self):
+        environments = self.environments()
+        env_id = 'ENV'
+        self.assertTrue(environments.lock(env_id))
+        self.assertFalse(environments.lock(env_id))
+        self.assertFalse(self.environments().lock(env_id))
+        environments.release(env_id)
+        self.assertTrue(self.environments().lock(env_id))
+
+    def test_release_by_other_pid_is_ignored(self):
+        environments = self.environments()
+        self.assertTrue(environments.lock('ENV'))
+        with patch('os.getpid', lambda: 1):
+            environments.release('ENV')
+        self.assertFalse(environments.lock('ENV'))
+
+    def test_expired_lease(self):
+        environments = self.environments(lease_duration=60)
+        with patch('time.time', lambda: 1000):
+            self.assertTrue(environments.lock('ENV'))
+        with patch('time.time', lambda: 1059):
+            self.assertFalse(environments.lock('ENV'))
+        with patch('time.time', lambda: 1061):
+            self.assertTrue(environments.lock('ENV'))
+
+    def test_heartbeat_renews_lease(self):
+        environments = self.environments(lease_duration=60)
+        with patch('time.time', lambda: 1000):
+            self.assertTrue(environments.lock('ENV'))
+        with patch('time.time', lambda: 1050):
+            environments.heartbeat()
+        with patch('time.time', lambda: 1100):
+            self.assertFalse(environments.lock('ENV'))
+
+    def test_prune(self):
+        environments = self.environments(lease_duration=60)
+        with patch('time.time', lambda: 1000):
+            self.assertTrue(environments.lock('ENV1'))
+        with patch('time.time', lambda: 1050):
+            self.assertTrue(environments.lock('ENV2'))
+        with patch('time.time', lambda: 1070):
+            environments.prune()
+            leases = environments.leases()
+            self.assertEqual(['ENV2'], [lease['env_id'] for lease in leases])
+            environments.prune(include_self=True)
+            self.assertEqual([], environments.leases())
+
+    def test_leases(self):
+        environments = self.environments()
+        with patch('time.time', lambda: 1000):
+            self.assertTrue(environments.lock('ENV1'))
+        with patch('time.time', lambda: 1010):
+            self.assertTrue(environments.lock('ENV2'))
+        with patch('time.time', lambda: 1030):
+            leases = environments.leases()
+        self.assertEqual(['ENV1', 'ENV2'], [x['env_id'] for x in leases])
+        self.assertEqual([30, 20], [x['busy_for'] for x in leases])
+        self.assertEqual([os.getpid()] * 2, [x['pid'] for x in leases])
@@ -0,0 +1,258 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+import lxml.etree as et
+import sh
+from mock import MagicMock, patch
+from path import path
+
+from suites.helpers import _write
+from suites.helpers.progress import ProgressEvents
+from suites.suite_runner import SuiteRunner
+
+
+class MockSuiteRunner(SuiteRunner):
+
+    def __init__(self, tests, parallel_groups=None, failing_groups=()):
+        self.test_suite_name = 'suite'
+        self.test_suite = {'tests': tests}
+        if parallel_groups is not None:
+            self.test_suite['parallel_groups'] = parallel_groups
+        self.suites_yaml = {'tests': {}}
+        self.failing_groups = failing_groups
+        self.ran_groups = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def _run_test_group(self, test_group, tests, prefix_output=False):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.1)
+        with self._lock:
+            self.running -= 1
+            self.ran_groups.append((test_group, tests, prefix_output))
+        if test_group == 'broken':
+            raise IOError('report is missing')
+        return test_group not in self.failing_groups
+
+
+def _external_tests(*repos):
+    return [{'external': {'repo': repo, 'branch': 'master'},
+             'tests': ['{0}/tests'.format(repo)]} for repo in repos]
+
+
+class TestParallelGroups(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='suite-runner-')
+        patcher = patch('suites.suite_runner._process_variables',
+                        lambda suites_yaml, external: external)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _runner(self, repos, **kwargs):
+        runner = MockSuiteRunner(['cosmo_tester/test_suites/a'], **kwargs)
+        runner.work_dir = self.work_dir
+        for repo in repos:
+            os.mkdir(os.path.join(self.work_dir, repo))
+        for repo, test in zip(repos, _external_tests(*repos)):
+            runner.suites_yaml['tests'][repo] = test
+            runner.test_suite['tests'].append(repo)
+        return runner
+
+    def test_sequential_by_default(self):
+        runner = self._runner(['plugin-a', 'plugin-b'])
+        runner.run_nose()
+        self.assertEqual(1, runner.max_running)
+        self.assertEqual(3, len(runner.ran_groups))
+        self.assertFalse(any(prefix for _, _, prefix in runner.ran_groups))
+
+    def test_bounded_concurrency(self):
+        runner = self._runner(['plugin-a', 'plugin-b', 'plugin-c'],
+                              parallel_groups=2)
+        runner.run_nose()
+        self.assertEqual(2, runner.max_running)
+        self.assertEqual(
+            sorted(['cloudify-system-tests', 'plugin-a', 'plugin-b',
+                    'plugin-c']),
+            sorted(group for group, _, _ in runner.ran_groups))
+        self.assertTrue(all(prefix for _, _, prefix in runner.ran_groups))
+
+    def test_concurrency_at_least_one(self):
+        runner = self._runner(['plugin-a', 'plugin-b'], parallel_groups=-1)
+        runner.run_nose()
+        self.assertEqual(1, runner.max_running)
+        self.assertEqual(3, len(runner.ran_groups))
+
+    def test_all_groups_at_once(self):
+        runner = self._runner(['plugin-a', 'plugin-b', 'plugin-c'],
+                              parallel_groups=True)
+        runner.run_nose()
+        self.assertEqual(4, runner.max_running)
+
+    def test_failed_groups(self):
+        runner = self._runner(['plugin-a', 'broken'], parallel_groups=True,
+                              failing_groups=['plugin-a'])
+        with self.assertRaises(AssertionError) as cm:
+            runner.run_nose()
+        self.assertIn('plugin-a', str(cm.exception))
+        self.assertIn('broken', str(cm.exception))
+        self.assertNotIn('cloudify-system-tests', str(cm.exception))
+        self.assertEqual(3, len(runner.ran_groups))
+
+    def test_prefixed_output(self):
+        stream = StringIO()
+        _write(stream, u'ran 1 test\n', 'plugin-a')
+        _write(stream, 'ok\n')
+        self.assertEqual('[plugin-a] ran 1 test\nok\n', stream.getvalue())
+
+
+class TestAddMissingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp(prefix='suite-runner-'))
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.report_path = self.work_dir / 'report.xml'
+        self.report_path.write_text(
+            '<testsuite name="suite" tests="1">'
+            '<testcase classname="module.Test" name="test_ran">'
+            '<system-out><![CDATA[output]]></system-out>'
+            '</testcase></testsuite>')
+        self.tests_list_path = self.work_dir / 'tests_list.json'
+        self.suite_runner = SuiteRunner.__new__(SuiteRunner)
+
+    def _expect(self, *names):
+        self.tests_list_path.write_text(json.dumps([
+            {'test_module': 'module', 'test_class': 'Test',
+             'test_name': name} for name in names]))
+
+    def test_adds_missing_tests(self):
+        self._expect('test_ran', 'test_missing', 'test_other_missing')
+        self.suite_runner.add_missing_tests(self.report_path,
+                                            self.tests_list_path)
+        testcases = et.parse(self.report_path).findall('testcase')
+        self.assertEqual(['test_ran', 'test_missing', 'test_other_missing'],
+                         [t.get('name') for t in testcases])
+        self.assertIsNone(testcases[0].find('skipped'))
+        for testcase in testcases[1:]:
+            self.assertEqual('module.Test', testcase.get('classname'))
+            self.assertIsNotNone(testcase.find('skipped'))
+        self.assertIn('<![CDATA[output]]>', self.report_path.text())
+        self.assertEqual(['report.xml', 'tests_list.json'],
+                         sorted(os.listdir(self.work_dir)))
+
+    def test_report_written_once(self):
+        self._expect('test_ran', 'test_missing', 'test_other_missing')
+        with patch('suites.suite_runner.os.rename',
+                   side_effect=os.rename) as rename:
+            self.suite_runner.add_missing_tests(self.report_path,
+                                                self.tests_list_path)
+        self.assertEqual(1, rename.call_count)
+
+    def test_nothing_missing(self):
+        self._expect('test_ran')
+        report = self.report_path.text()
+        with patch('suites.suite_runner.os.rename') as rename:
+            self.suite_runner.add_missing_tests(self.report_path,
+                                                self.tests_list_path)
+        self.assertFalse(rename.called)
+        self.assertEqual(report, self.report_path.text())
+
+
+class TestTimings(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp(prefix='suite-runner-'))
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.progress = ProgressEvents(self.work_dir / 'events.jsonl')
+
+    def test_spans(self):
+        with self.progress.phase('install'):
+            with self.progress.phase('clone', repo='cloudify-cli'):
+                pass
+            with self.assertRaises(RuntimeError):
+                with self.progress.phase('pip', repo='cloudify-cli'):
+                    raise RuntimeError()
+        timings_path = self.work_dir / 'suite-timings.json'
+        self.progress.write_timings(timings_path)
+        spans = json.loads(timings_path.text())
+        self.assertEqual(['install', 'clone', 'pip'],
+                         [span['phase'] for span in spans])
+        self.assertEqual(['passed', 'passed', 'failed'],
+                         [span['result'] for span in spans])
+        self.assertEqual('cloudify-cli', spans[1]['repo'])
+        self.assertGreaterEqual(spans[0]['duration'],
+                                spans[1]['duration'] + spans[2]['duration'])
+        events = [json.loads(line) for line in
+                  (self.work_dir / 'events.jsonl').lines()]
+        self.assertEqual(6, len(events))
+        self.assertEqual(['events.jsonl', 'suite-timings.json'],
+                         sorted(os.listdir(self.work_dir)))
+
+
+class TestPipInstall(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp(prefix='suite-runner-'))
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.runner = MockSuiteRunner([])
+        self.runner.work_dir = self.work_dir
+        self.runner.progress = ProgressEvents(self.work_dir / 'events.jsonl')
+        self.runner.wheelhouse = None
+
+    def _install(self, failures):
+        calls = []
+
+        def install(*args):
+            calls.append(args)
+            if len(calls) <= failures:
+                raise sh.ErrorReturnCode_1('pip install', '', 'unreachable')
+            return MagicMock()
+        with patch('suites.suite_runner.pip') as pip_mock:
+            pip_mock.install.side_effect = install
+            self.runner._pip_install(requirements='requirements.txt')
+        return calls
+
+    def test_online(self):
+        self.runner.wheelhouse = '/wheelhouse'
+        self.assertEqual([('-r', 'requirements.txt')], self._install(0))
+
+    def test_offline_fallback(self):
+        self.runner.wheelhouse = '/wheelhouse'
+        self.assertEqual([('-r', 'requirements.txt'),
+                          ('--no-index', '--find-links=/wheelhouse',
+                           '-r', 'requirements.txt')],
+                         self._install(1))
+
+    def test_no_wheelhouse(self):
+        self.assertRaises(sh.ErrorReturnCode, self._install, 1)
+
+    def test_offline_failure(self):
+        self.runner.wheelhouse = '/wheelhouse'
+        self.assertRaises(sh.ErrorReturnCode, self._install, 2)
@@ -0,0 +1,644 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+import jinja2
+from mock import patch, MagicMock
+from path import path
+
+from suites.suites_runner import SuitesRunner
+from suites.suites_runner import TestSuite
+from suites.suites_runner import ContainerLog
+from suites.suites_runner import ContainersLogs
+from suites.suites_runner import SUITE_PAYLOAD
+from suites.suites_runner import copy_payload
+from suites.suites_runner import resolve_revision
+from suites.suites_runner import get_suites_runner_pids
+from suites.suites_runner import kill_containers
+from suites.suites_runner import write_xunit_report
+
+
+class TestPruneContainers(unittest.TestCase):
+
+    def _prune(self, include_self=False):
+        containers = os.linesep.join([
+            'aaa 100_suite1',
+            'bbb 300_suite2',
+            'ccc some_container',
+            'ddd 200_suite3',
+            'eee container'])
+        with patch('suites.suites_runner.sh') as sh_mock, \
+                patch('suites.suites_runner.kill_containers') as kill_mock, \
+                patch('suites.suites_runner.get_suites_runner_pids',
+                      lambda pids: pids & {100, 200}), \
+                patch('os.getpid', lambda: 200):
+            sh_mock.docker.ps.return_value.stdout = containers
+            SuitesRunner.prune_containers(include_self=include_self)
+        self.assertEqual(1, sh_mock.docker.ps.call_count)
+        return sorted(kill_mock.call_args[0][0])
+
+    def test_prune_containers(self):
+        self.assertEqual(['bbb'], self._prune())
+
+    def test_prune_containers_include_self(self):
+        self.assertEqual(['bbb', 'ddd'], self._prune(include_self=True))
+
+    def test_get_suites_runner_pids(self):
+        with patch('suites.suites_runner.open', create=True) as open_mock:
+            open_mock.return_value.__enter__.return_value.read.side_effect = [
+                'python\0suites_runner.py\0', 'bash\0']
+            self.assertEqual({1}, get_suites_runner_pids([1, 2]))
+        # pids above the kernel pid limit never exist
+        self.assertEqual(set(), get_suites_runner_pids([2 ** 23]))
+
+    def test_kill_containers_in_batches(self):
+        with patch('suites.suites_runner.docker') as docker_mock:
+            docker_mock.rm.return_value = MagicMock()
+            kill_containers(['c{0}'.format(i) for i in range(45)],
+                            batch_size=20,
+                            parallelism=2)
+        batches = [c[0][1:] for c in docker_mock.rm.call_args_list]
+        self.assertEqual([20, 20, 5], [len(b) for b in batches])
+        self.assertEqual(45, len(set(sum([list(b) for b in batches], []))))
+
+
+class TestBuildDockerImage(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        (self.work_dir / 'Dockerfile').write_text('FROM ubuntu:14.04')
+        (self.work_dir / 'wheel-requirements.txt').write_text('lxml')
+        self.prefix = self.work_dir / 'prefix'
+        self.prefix.mkdir()
+        self.images_path = self.prefix / 'docker-images.json'
+        cwd = os.getcwd()
+        os.chdir(self.work_dir)
+        self.addCleanup(os.chdir, cwd)
+
+    def _build(self, existing_images=()):
+        runner = SuitesRunner(variables_path=None, descriptor=None)
+        with patch('suites.suites_runner.sh') as sh_mock, \
+                patch('suites.suites_runner.docker') as docker_mock, \
+                patch('sys.prefix', self.prefix):
+            built = []
+
+            def build(args):
+                built.append(args[1])
+                return MagicMock()
+
+            def images(args):
+                return 'id' if args[1] in list(existing_images) + built else ''
+            docker_mock.build.side_effect = build
+            sh_mock.docker.images.side_effect = images
+            runner.build_docker_image()
+        return runner.docker_image, built, sh_mock.docker.rmi
+
+    def test_image_tag_derived_from_inputs(self):
+        image, built, _ = self._build()
+        self.assertTrue(image.startswith('cloudify/test:env-'))
+        self.assertEqual([image], built)
+        self.assertEqual(image, self._build()[0])
+        (self.work_dir / 'wheel-requirements.txt').write_text('lxml==3.4.4')
+        self.assertNotEqual(image, self._build()[0])
+
+    def test_build_skipped_when_image_exists(self):
+        image, _, _ = self._build()
+        _, built, _ = self._build(existing_images=[image])
+        self.assertEqual([], built)
+
+    def test_least_recently_used_images_removed(self):
+        self.images_path.write_text(json.dumps({
+            'cloudify/test:env-1': 1,
+            'cloudify/test:env-2': 2,
+            'cloudify/test:env-3': 3}))
+        image, _, rmi = self._build()
+        rmi.assert_called_once_with('cloudify/test:env-1')
+        last_used = json.loads(self.images_path.text())
+        self.assertEqual(sorted(['cloudify/test:env-2',
+                                 'cloudify/test:env-3',
+                                 image]),
+                         sorted(last_used))
+
+    def test_legacy_image_removed(self):
+        self.images_path.write_text(json.dumps({
+            'cloudify/test:env-1': 1,
+            'cloudify/test:env-2': 2}))
+        image, _, rmi = self._build(existing_images=['cloudify/test:env'])
+        rmi.assert_called_once_with('cloudify/test:env')
+        self.assertEqual(sorted(['cloudify/test:env-1',
+                                 'cloudify/test:env-2',
+                                 image]),
+                         sorted(json.loads(self.images_path.text())))
+
+    def test_images_of_live_suites_runners_kept(self):
+        self.images_path.write_text(json.dumps({
+            'cloudify/test:env-1': {'last_used': 1, 'pids': [111]},
+            'cloudify/test:env-2': {'last_used': 2, 'pids': [222]},
+            'cloudify/test:env-3': 3,
+            'cloudify/test:env-4': 4}))
+        with patch('suites.suites_runner.get_suites_runner_pids',
+                   side_effect=lambda pids: pids & set([111])):
+            image, _, rmi = self._build()
+        rmi.assert_called_once_with('cloudify/test:env-2')
+        used = json.loads(self.images_path.text())
+        self.assertEqual([111], used['cloudify/test:env-1']['pids'])
+        self.assertEqual([], used['cloudify/test:env-3']['pids'])
+        self.assertEqual([os.getpid()], used[image]['pids'])
+        self.assertNotIn('cloudify/test:env-2', used)
+
+
+class TestDockerLauncher(unittest.TestCase):
+
+    def test_launch_with_docker(self):
+        suite = TestSuite(suite_name='suite1',
+                          suite_def={'tests': ['test1']},
+                          suite_work_dir=path('/tmp/suite1'),
+                          variables={'key': 'value'},
+                          docker_image='cloudify/test:env-1',
+                          launcher='docker')
+        with patch('suites.suites_runner.docker') as docker_mock, \
+                patch('suites.suites_runner.containers_logs') as logs_mock:
+            suite._launch()
+        args = list(docker_mock.run.call_args[0])
+        self.assertEqual(['cloudify/test:env-1', '/vagrant/suite_runner.sh'],
+                         args[-2:])
+        self.assertIn('/tmp/suite1:/vagrant', args)
+        self.assertIn('TEST_SUITE_NAME=suite1', args)
+        self.assertIn('TEST_SUITE={"tests": ["test1"]}', args)
+        self.assertIn('TEST_SUITES_VARIABLES={"key": "value"}', args)
+        self.assertEqual(suite.container_name,
+                         args[args.index('--name') + 1])
+        logs_mock.follow.assert_called_once_with(suite.container_name,
+                                                 prefix='suite1',
+                                                 log=suite.container_log)
+        self.assertEqual(logs_mock.follow.return_value, suite.process)
+
+    def test_unknown_launcher(self):
+        self.assertRaises(ValueError, SuitesRunner, None, None, 'ruby')
+
+    def test_validate_parallel_groups(self):
+        runner = SuitesRunner(variables_path=None, descriptor=None)
+        for parallel_groups in [True, False, 2]:
+            suite = {'requires': ['a'], 'parallel_groups': parallel_groups}
+            runner.suites_yaml = {'test_suites': {'suite1': suite},
+                                  'handler_configurations': {}}
+            runner.validate()
+        for parallel_groups in [0, -1, 'two', 1.5]:
+            runner.suites_yaml['test_suites']['suite1'][
+                'parallel_groups'] = parallel_groups
+            self.assertRaises(AssertionError, runner.validate)
+
+    def test_idle_timeout_disabled_by_default(self):
+        runner = SuitesRunner(variables_path=None, descriptor=None)
+        self.assertEqual(-1, runner.idle_timeout)
+
+    def test_containers_logs(self):
+        stream = StringIO()
+        logs = ContainersLogs(stream=stream)
+
+        popen = subprocess.Popen
+
+        def docker_logs(args, **kwargs):
+            return popen(['echo', args[-1]], **kwargs)
+        with patch('suites.suites_runner.subprocess.Popen',
+                   side_effect=docker_logs) as popen_mock:
+            process1 = logs.follow('container1', prefix='suite1')
+        popen_mock.assert_called_once_with(
+            ['docker', 'logs', '-f', 'container1'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            close_fds=True)
+        process1.wait()
+        process2 = logs.follow_process(
+            subprocess.Popen(['printf', r'line1\n\342\234\223\nline3'],
+                             stdout=subprocess.PIPE),
+            prefix='suite2')
+        process2.wait()
+        self.assertFalse(process2.is_alive())
+        deadline = time.time() + 5
+        while stream.getvalue().count('[suite2]') < 3 and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual('[suite1] container1\n'
+                         '[suite2] line1\n'
+                         '[suite2] \xe2\x9c\x93\n'
+                         '[suite2] line3',
+                         stream.getvalue())
+
+    def test_containers_logs_collector(self):
+        stream = StringIO()
+        logs = ContainersLogs(stream=stream)
+        collect1 = logs.collector('suite1')
+        collect2 = logs.collector('suite2')
+        collect1('line1\n')
+        collect2(u'line2 \u2713\n')
+        collect1('line3\n')
+        deadline = time.time() + 5
+        while stream.getvalue().count('\n') < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual('[suite1] line1\n'
+                         '[suite2] line2 \xe2\x9c\x93\n'
+                         '[suite1] line3\n', stream.getvalue())
+
+
+class TestContainerLog(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.log_path = self.work_dir / 'container.log'
+
+    def test_tail(self):
+        log = ContainerLog(self.log_path, tail_size=12)
+        for i in range(5):
+            log.write('line{0}\n'.format(i))
+        log.write(u'\u2713\n')
+        log.close()
+        self.assertTrue(log.truncated)
+        self.assertEqual(u'line4\n\u2713\n', log.tail())
+        self.assertEqual('line0\nline1\nline2\nline3\nline4\n'
+                         '\xe2\x9c\x93\n', self.log_path.bytes())
+
+    def test_line_longer_than_tail(self):
+        log = ContainerLog(self.log_path, tail_size=4)
+        log.write('line0\n')
+        log.write('0123456789\n')
+        self.assertEqual('789\n', log.tail())
+
+    def test_write_after_close(self):
+        log = ContainerLog(self.log_path)
+        log.write('line0\n')
+        log.close()
+        log.write('line1\n')
+        self.assertFalse(log.truncated)
+        self.assertEqual('line0\n', log.tail())
+        self.assertEqual('line0\n', self.log_path.text())
+
+    def test_followed_container_log(self):
+        log = ContainerLog(self.log_path)
+        logs = ContainersLogs(stream=StringIO())
+        process = logs.follow_process(
+            subprocess.Popen(['sh', '-c', 'echo line1; echo line2 >&2'],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT),
+            prefix='suite1', log=log)
+        process.wait()
+        self.assertEqual('line1\nline2\n', log.tail())
+
+    def test_custom_report(self):
+        reports_dir = self.work_dir / 'reports'
+        reports_dir.mkdir()
+        suite = TestSuite(suite_name='suite1',
+                          suite_def={},
+                          suite_work_dir=self.work_dir,
+                          variables={})
+        suite.suite_reports_dir.mkdir()
+        suite.container_log.tail_size = 6
+        suite.container_log.write('line0\n')
+        suite.container_log.write('line1\n')
+        suite.container_log.close()
+        suite.timed_out = True
+        template = path(__file__).dirname().dirname() / 'xunit-template.xml'
+        cwd = os.getcwd()
+        os.chdir(template.dirname())
+        try:
+            with patch('suites.suites_runner.reports_dir', reports_dir):
+                suite.copy_xunit_reports()
+        finally:
+            os.chdir(cwd)
+        report = (reports_dir / 'suite1-docker-container-report.xml').text()
+        self.assertIn('[Last 6 bytes of the container log]\nline1', report)
+        self.assertNotIn('line0', report)
+        archived_log_path = reports_dir / 'suite1-container.log'
+        self.assertIn('Container log:\n{0}'.format(archived_log_path), report)
+        # kept when the suite env is removed by the next run
+        self.log_path.remove()
+        self.assertEqual('line0\nline1\n', archived_log_path.text())
+
+
+class TestSharedPayload(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.source_dir = self.work_dir / 'source'
+        self.source_dir.mkdir()
+        for name in SUITE_PAYLOAD:
+            if '.' in name:
+                (self.source_dir / name).write_text(name)
+            else:
+                (self.source_dir / name / 'nested').makedirs()
+                (self.source_dir / name / 'nested' / 'file').write_text(name)
+        (self.source_dir / 'Vagrantfile.template').write_text(
+            '{{suite_name}}')
+        self.shared_payload_dir = self.work_dir / 'shared'
+        self.shared_payload_dir.mkdir()
+        copy_payload(self.source_dir, self.shared_payload_dir)
+        cwd = os.getcwd()
+        os.chdir(self.source_dir)
+        self.addCleanup(os.chdir, cwd)
+
+    def _suite(self, launcher, shared_payload_dir):
+        suite = TestSuite(suite_name='suite1',
+                          suite_def={},
+                          suite_work_dir=self.work_dir / 'suite1',
+                          variables={},
+                          launcher=launcher,
+                          shared_payload_dir=shared_payload_dir)
+        suite.create_env()
+        self.assertEqual('suite1',
+                         (suite.suite_work_dir / 'Vagrantfile').text())
+        self.assertTrue(suite.suite_reports_dir.isdir())
+        return suite
+
+    def _inode(self, file_path):
+        return os.stat(file_path).st_ino
+
+    def test_copied_payload(self):
+        suite = self._suite('vagrant', shared_payload_dir=None)
+        file_path = suite.suite_work_dir / 'helpers' / 'nested' / 'file'
+        self.assertEqual('helpers', file_path.text())
+        self.assertNotEqual(
+            self._inode(self.shared_payload_dir / 'helpers' / 'nested' /
+                        'file'),
+            self._inode(file_path))
+
+    def test_linked_payload(self):
+        suite = self._suite('vagrant', self.shared_payload_dir)
+        for name in ['suite_runner.sh', 'helpers/nested/file']:
+            self.assertEqual(self._inode(self.shared_payload_dir / name),
+                             self._inode(suite.suite_work_dir / name))
+
+    def test_mounted_payload(self):
+        suite = self._suite('docker', self.shared_payload_dir)
+        for name in SUITE_PAYLOAD:
+            self.assertFalse((suite.suite_work_dir / name).exists())
+        with patch('suites.suites_runner.docker') as docker_mock, \
+                patch('suites.suites_runner.containers_logs'):
+            suite._launch()
+        args = docker_mock.run.call_args[0]
+        self.assertIn('{0}:/vagrant'.format(suite.suite_work_dir), args)
+        for name in SUITE_PAYLOAD:
+            self.assertIn('{0}/{1}:/vagrant/{1}:ro'.format(
+                self.shared_payload_dir, name), args)
+
+
+XUNIT_REPORT = """<?xml version="1.0" encoding="UTF-8"?>
+<testsuite name="suite1" tests="2" errors="1" failures="0" skip="0"
+ time="3.5" hostname="host1">
+<testcase classname="{0}.Test" name="test_ok" time="1.0">
+<system-out><![CDATA[a < b]]></system-out></testcase>
+<testcase classname="{0}.Test" name="test_error" time="2.0">
+<error type="Error" message="error"><![CDATA[traceback]]></error>
+</testcase>
+</testsuite>"""
+
+
+class TestXunitReports(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.reports_dir = self.work_dir / 'reports'
+        self.reports_dir.mkdir()
+        patcher = patch('suites.suites_runner.reports_dir', self.reports_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _suite(self, merge_xunit_reports=False):
+        suite = TestSuite(suite_name='suite1',
+                          suite_def={},
+                          suite_work_dir=self.work_dir / 'suite1',
+                          variables={},
+                          merge_xunit_reports=merge_xunit_reports)
+        suite.suite_reports_dir.makedirs()
+        for module in ['module1', 'module2']:
+            (suite.suite_reports_dir / '{0}-report.xml'.format(
+                module)).write_text(XUNIT_REPORT.format(module))
+        return suite
+
+    def _parse(self, name):
+        import lxml.etree as et
+        return et.parse(self.reports_dir / name)
+
+    def test_copy_reports(self):
+        self._suite().copy_xunit_reports()
+        self.assertEqual(['module1-report.xml', 'module2-report.xml'],
+                         sorted(f.name for f in self.reports_dir.files()))
+        report = self._parse('module1-report.xml')
+        self.assertEqual('2', report.getroot().get('tests'))
+        self.assertEqual('3.5', report.getroot().get('time'))
+        self.assertEqual(['test_ok @ suite1', 'test_error @ suite1'],
+                         [t.get('name') for t in report.iter('testcase')])
+        text = (self.reports_dir / 'module1-report.xml').text()
+        self.assertIn('<![CDATA[a < b]]>', text)
+        self.assertIn('<![CDATA[traceback]]>', text)
+
+    def test_copy_timings(self):
+        suite = self._suite()
+        (suite.suite_reports_dir / 'suite1-timings.json').write_text('[]')
+        suite.copy_xunit_reports()
+        self.assertEqual('[]',
+                         (self.reports_dir / 'suite1-timings.json').text())
+
+    def test_merge_reports(self):
+        self._suite(merge_xunit_reports=True).copy_xunit_reports()
+        self.assertEqual(['suite1-report.xml'],
+                         [f.name for f in self.reports_dir.files()])
+        root = self._parse('suite1-report.xml').getroot()
+        self.assertEqual('suite1', root.get('name'))
+        self.assertEqual(('4', '2', '0', '0'),
+                         (root.get('tests'), root.get('errors'),
+                          root.get('failures'), root.get('skip')))
+        self.assertEqual(('7.000', 'host1'),
+                         (root.get('time'), root.get('hostname')))
+        self.assertEqual(
+            ['module1.Test', 'module1.Test', 'module2.Test', 'module2.Test'],
+            sorted(t.get('classname') for t in root.iter('testcase')))
+
+    def test_report_replaced_atomically(self):
+        source = self.work_dir / 'source.xml'
+        source.write_text(XUNIT_REPORT.format('module1'))
+        report_file = self.reports_dir / 'report.xml'
+        report_file.write_text('previous')
+        with patch('suites.suites_runner.os.rename',
+                   side_effect=os.rename) as rename:
+            write_xunit_report([source], report_file, 'suite1')
+        rename.assert_called_once_with('{0}.tmp'.format(report_file),
+                                       report_file)
+        self.assertIn('test_ok @ suite1', report_file.text())
+
+
+class TestBuildVirtualenvDockerImage(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        suites_dir = path(__file__).dirname().dirname()
+        for file_name in ['requirements.txt',
+                          'wheel-requirements.txt',
+                          'Dockerfile.virtualenv.template']:
+            (suites_dir / file_name).copy(self.work_dir / file_name)
+        self.prefix = self.work_dir / 'prefix'
+        self.prefix.mkdir()
+        cwd = os.getcwd()
+        os.chdir(self.work_dir)
+        self.addCleanup(os.chdir, cwd)
+
+    def _build(self, variables, existing_images=(), revisions=None):
+        revisions = revisions or {}
+        runner = SuitesRunner(variables_path=None, descriptor=None)
+        runner.suites_yaml = {'variables': variables}
+        runner.docker_image = 'cloudify/test:env-1'
+        dockerfiles = []
+
+        def build(args):
+            dockerfiles.append((path(args[2]) / 'Dockerfile').text())
+            existing_images.append(args[1])
+            return MagicMock()
+
+        def images(args):
+            return 'id' if args[1] in existing_images else ''
+
+        with patch('suites.suites_runner.sh') as sh_mock, \
+                patch('suites.suites_runner.docker') as docker_mock, \
+                patch('suites.suites_runner.resolve_revision',
+                      lambda repo, branch: revisions.get(
+                          repo, '{0}@{1}'.format(repo, branch))), \
+                patch('sys.prefix', self.prefix):
+            docker_mock.build.side_effect = build
+            sh_mock.docker.images.side_effect = images
+            runner.build_virtualenv_docker_image()
+        return runner.docker_image, dockerfiles
+
+    def test_image_keyed_by_branches(self):
+        variables = {'core_branch': 'master',
+                     'system_tests_branch': 'master'}
+        existing_images = []
+        image, dockerfiles = self._build(variables, existing_images)
+        self.assertTrue(image.startswith('cloudify/test:venv-'))
+        self.assertEqual(1, len(dockerfiles))
+        self.assertIn('FROM cloudify/test:env-1', dockerfiles[0])
+        self.assertIn('git checkout cloudify-cli@master', dockerfiles[0])
+        self.assertIn('git checkout cloudify-system-tests@master',
+                      dockerfiles[0])
+
+        same_image, dockerfiles = self._build(variables, existing_images)
+        self.assertEqual(image, same_image)
+        self.assertEqual([], dockerfiles)
+
+        variables['cli_branch'] = 'CFY-1234'
+        other_image, dockerfiles = self._build(variables, existing_images)
+        self.assertNotEqual(image, other_image)
+        self.assertIn('git checkout cloudify-cli@CFY-1234', dockerfiles[0])
+
+    def test_image_keyed_by_core_commits(self):
+        variables = {'core_branch': 'master',
+                     'system_tests_branch': 'master'}
+        existing_images = []
+        image, dockerfiles = self._build(
+            variables, existing_images,
+            revisions={'cloudify-rest-client': 'abc123'})
+        self.assertIn('cloudify-rest-client=abc123', dockerfiles[0])
+        self.assertNotIn('core_revision', dockerfiles[0])
+        other_image, dockerfiles = self._build(
+            variables, existing_images,
+            revisions={'cloudify-rest-client': 'def456'})
+        self.assertNotEqual(image, other_image)
+        self.assertIn('ENV CORE_REVISIONS', dockerfiles[0])
+        self.assertIn('cloudify-rest-client=def456', dockerfiles[0])
+
+    def test_resolve_revision(self):
+        with patch('suites.suites_runner.sh') as sh_mock:
+            sh_mock.git.return_value.stdout = 'abc123\trefs/heads/master\n'
+            self.assertEqual('abc123',
+                             resolve_revision('cloudify-cli', 'master'))
+            sh_mock.git.return_value.stdout = ''
+            self.assertEqual('3.4m5',
+                             resolve_revision('cloudify-cli', '3.4m5'))
+
+
+class TestGitMirrorsInSuites(unittest.TestCase):
+
+    def test_container_env_and_volumes(self):
+        suite = TestSuite(suite_name='suite1',
+                          suite_def={},
+                          suite_work_dir=path('/tmp/suite1'),
+                          variables={},
+                          launcher='docker',
+                          git_mirrors_dir='/mirrors',
+                          shallow_clones=True)
+        with patch('suites.suites_runner.docker') as docker_mock, \
+                patch('suites.suites_runner.containers_logs'):
+            suite._launch()
+        args = docker_mock.run.call_args[0]
+        self.assertIn('/mirrors:/git-mirrors:ro', args)
+        self.assertIn('GIT_MIRRORS_DIR=/git-mirrors', args)
+        self.assertIn('GIT_SHALLOW_CLONES=true', args)
+
+        template = (path(__file__).dirname().dirname() /
+                    'Vagrantfile.template').text()
+        vagrant_file = jinja2.Template(template).render({
+            'env': suite._container_env(),
+            'volumes': suite._container_volumes()})
+        self.assertIn("'GIT_MIRRORS_DIR' => '/git-mirrors'", vagrant_file)
+        self.assertIn("d.volumes = ['/mirrors:/git-mirrors:ro']",
+                      vagrant_file)
+
+    def test_refresh_git_mirrors(self):
+        runner = SuitesRunner(variables_path=None, descriptor=None,
+                              git_mirrors=True)
+        runner.suites_yaml = {
+            'tests': {
+                'plugin_tests': {'external': {'repo': 'plugin'}},
+                'private_tests': {'external': {'repo': 'private',
+                                               'private': True}},
+                'unused_tests': {'external': {'repo': 'unused'}}
+            },
+            'handler_configurations': {
+                'config1': {'tags': ['a', 'b'],
+                            'external': {'repo': 'handler1',
+                                         'organization': 'org'}},
+                'config2': {'tags': ['b'],
+                            'external': {'repo': 'handler2'}},
+                'config3': {'tags': ['c'],
+                            'external': {'repo': 'handler3'}}
+            },
+            'test_suites': {
+                'suite1': {'requires': ['a'],
+                           'tests': ['plugin_tests', 'private_tests']},
+                'suite2': {'handler_configuration': 'config2',
+                           'tests': ['cosmo_tester/test_suites']}
+            }
+        }
+        with patch.object(runner.git_mirrors, 'refresh') as refresh_mock:
+            runner.refresh_git_mirrors()
+        refreshed = sorted((c[0][2], c[0][1]) for c in
+                           refresh_mock.call_args_list)
+        self.assertEqual([('cloudify-cosmo', 'cloudify-cli'),
+                          ('cloudify-cosmo', 'cloudify-manager-blueprints'),
+                          ('cloudify-cosmo', 'cloudify-system-tests'),
+                          ('cloudify-cosmo', 'handler2'),
+                          ('cloudify-cosmo', 'plugin'),
+                          ('org', 'handler1')], refreshed)
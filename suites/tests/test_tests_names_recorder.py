@@ -0,0 +1,106 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import nose
+
+from cosmo_tester.framework.tests_names_extractor import TestsNamesExtractor
+from cosmo_tester.framework.tests_names_extractor import TestsNamesRecorder
+
+
+TESTS_MODULE = '''
+import unittest
+
+
+class BrokenSetupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        raise RuntimeError('broken')
+
+    def test_first(self):
+        pass
+
+    def test_second(self):
+        pass
+
+
+class PassingTest(unittest.TestCase):
+
+    def test_passing(self):
+        pass
+
+    def test_failing(self):
+        self.fail()
+
+    def helper(self):
+        pass
+'''
+
+
+class TestTestsNamesRecorder(unittest.TestCase):
+
+    def setUp(self):
+        # --where changes the working directory
+        self.cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp(prefix='tests-names-recorder-')
+        with open(os.path.join(self.work_dir,
+                               'recorded_tests.py'), 'w') as f:
+            f.write(TESTS_MODULE)
+        self.tests_list_path = os.path.join(self.work_dir, 'tests.json')
+        self.report_path = os.path.join(self.work_dir, 'report.xml')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        sys.modules.pop('recorded_tests', None)
+        shutil.rmtree(self.work_dir)
+
+    def _run_nose(self, *args, **kwargs):
+        plugins = kwargs.get('plugins') or [TestsNamesExtractor(),
+                                            TestsNamesRecorder()]
+        argv = ['nosetests', '--where', self.work_dir,
+                '--tests-list-path', self.tests_list_path] + list(args)
+        nose.run(argv=argv + ['recorded_tests'], addplugins=plugins)
+        with open(self.tests_list_path) as f:
+            return sorted((t['test_module'], t['test_class'], t['test_name'])
+                          for t in json.load(f))
+
+    def test_records_tests_during_the_run(self):
+        recorded = self._run_nose('--with-testnamerecorder',
+                                  '--with-xunit',
+                                  '--xunit-file', self.report_path)
+        self.assertEqual([
+            ('recorded_tests', 'BrokenSetupTest', 'test_first'),
+            ('recorded_tests', 'BrokenSetupTest', 'test_second'),
+            ('recorded_tests', 'PassingTest', 'test_failing'),
+            ('recorded_tests', 'PassingTest', 'test_passing'),
+        ], recorded)
+        self.assertTrue(os.path.isfile(self.report_path))
+
+    def test_matches_collect_only_run(self):
+        recorded = self._run_nose('--with-testnamerecorder')
+        collected = self._run_nose('--with-testnameextractor')
+        self.assertEqual(collected, recorded)
+
+    def test_without_extractor(self):
+        recorded = self._run_nose('--with-testnamerecorder',
+                                  plugins=[TestsNamesRecorder()])
+        self.assertEqual(4, len(recorded))
@@ -0,0 +1,133 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import unittest
+
+from cosmo_tester.framework.waiter import Deadline
+from cosmo_tester.framework.waiter import Waiter
+from cosmo_tester.framework.waiter import retry
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestWaiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def _waiter(self, timeout=None, **kwargs):
+        kwargs.setdefault('jitter', 0)
+        return Waiter(timeout,
+                      sleep=self.clock.sleep,
+                      clock=self.clock.time,
+                      **kwargs)
+
+    def test_backoff_is_capped(self):
+        waiter = self._waiter(20, initial_interval=1, backoff_factor=2,
+                              max_interval=5)
+        attempts = list(waiter)
+        self.assertEqual([1, 2, 4, 5, 5, 3], self.clock.sleeps)
+        self.assertEqual(7, len(attempts))
+        self.assertTrue(waiter.expired())
+
+    def test_polls_once_more_at_deadline(self):
+        polled_at = [self.clock.time() for _ in self._waiter(2.5)]
+        self.assertEqual(1002.5, polled_at[-1])
+
+    def test_zero_timeout_polls_once(self):
+        self.assertEqual([1], list(self._waiter(0)))
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_jitter_shortens_intervals(self):
+        waiter = self._waiter(jitter=0.25, initial_interval=4,
+                              backoff_factor=1)
+        intervals = waiter.intervals()
+        for _ in range(100):
+            self.assertTrue(3 <= next(intervals) <= 4)
+
+    def test_no_timeout(self):
+        waiter = self._waiter()
+        for attempt in waiter:
+            if attempt == 50:
+                break
+        self.assertFalse(waiter.expired())
+
+    def test_shared_deadline(self):
+        deadline = Deadline(10, clock=self.clock.time)
+        for _ in self._waiter(deadline=deadline, initial_interval=4,
+                              backoff_factor=1):
+            pass
+        self.assertEqual(1010, self.clock.time())
+        self.assertEqual([1], list(self._waiter(deadline=deadline)))
+
+    def test_fewer_polls_than_fixed_interval(self):
+        # a 30 minutes wait polled every second before
+        polls = len(list(Waiter(1800,
+                                sleep=self.clock.sleep,
+                                clock=self.clock.time)))
+        self.assertLess(polls, 1800 / 4)
+
+
+class SteppingClock(FakeClock):
+    """Moves on with every reading, so the deadline may pass between a
+    waiter's own expiry check and its caller's."""
+
+    def time(self):
+        self.now += 0.4
+        return self.now
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SteppingClock()
+        self.calls = 0
+
+    def _waiter(self, timeout):
+        return Waiter(timeout, sleep=self.clock.sleep, clock=self.clock.time)
+
+    def _fail(self, succeed_on=None):
+        self.calls += 1
+        if self.calls == succeed_on:
+            return self.calls
+        raise ValueError(self.calls)
+
+    def test_returns_result(self):
+        self.assertEqual(3, retry(self._fail, self._waiter(60),
+                                  kwargs={'succeed_on': 3}))
+
+    def test_raises_last_exception_on_timeout(self):
+        for timeout in [0, 0.3, 1, 2.5, 10]:
+            self.calls = 0
+            with self.assertRaises(ValueError) as cm:
+                retry(self._fail, self._waiter(timeout), ValueError)
+            self.assertEqual((self.calls,), cm.exception.args)
+
+    def test_other_exceptions_are_raised(self):
+        with self.assertRaises(ValueError):
+            retry(self._fail, self._waiter(60), KeyError)
+        self.assertEqual(1, self.calls)